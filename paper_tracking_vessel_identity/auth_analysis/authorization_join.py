@@ -0,0 +1,180 @@
+#-------------------------------------------------------------
+#-- Authorized fishing attribution by sorted interval join
+#-- This module labels fishing effort rows as authorized or
+#-- unknown per region, the local equivalent of joining
+#-- `fishing_effort` to `identity_authorization` on ssvid, region
+#-- (`source_code = rfmo` over `UNNEST(rfmo)`) and
+#-- `date BETWEEN authorized_from AND authorized_to`.
+#--
+#-- Authorizations are sorted by (ssvid, source_code,
+#-- authorized_from) and merged into disjoint periods per
+#-- (ssvid, source_code); each (effort row, region) pair then finds
+#-- its period with one vectorized `searchsorted`, so the join
+#-- never fans out to every authorization of a vessel.
+#--
+#-- Example:
+#--   pairs = attribute_authorization(effort, authorizations)
+#--   effort["authorized"] = authorized_rows(effort, pairs)
+#-------------------------------------------------------------
+import numpy as np
+import pandas as pd
+
+#
+# Authorization data of these RFMOs start later; earlier effort rows in any
+# of their areas are excluded in all their regions, as in the authorization
+# queries
+AUTHORIZATION_START = {"IATTC": "2019-05-01", "ICCAT": "2019-05-01"}
+
+
+def _days(values):
+    """
+    Dates or timestamps as integer days since the epoch
+    """
+    values = pd.to_datetime(pd.Series(values).reset_index(drop=True))
+    if values.dt.tz is not None:
+        values = values.dt.tz_convert(None)
+    return values.to_numpy("datetime64[D]").astype(np.int64)
+
+
+def effort_region_pairs(effort, region_column="rfmo"):
+    """
+    (effort row, region) pairs from a column of region lists, like the
+    `rfmo` array attached from the regions table
+
+    :param effort: DataFrame with a column of list-like regions
+    :param region_column: String, name of the column
+    :return: Tuple of numpy arrays (row position, region)
+    """
+    regions = effort[region_column].reset_index(drop=True).explode()
+    regions = regions[regions.notna()]
+    return regions.index.to_numpy(np.int64), regions.to_numpy(dtype=object)
+
+
+def merge_periods(authorizations):
+    """
+    Sort authorizations by (ssvid, source_code, authorized_from) and merge
+    overlapping or adjacent periods of the same (ssvid, source_code)
+
+    :param authorizations: DataFrame with ssvid, source_code, authorized_from and authorized_to
+    :return: DataFrame of disjoint periods in the same sort order, with
+             integer days `start` and `end` (both inclusive)
+    """
+    df = pd.DataFrame({
+        "ssvid": authorizations["ssvid"].astype(str).to_numpy(),
+        "source_code": authorizations["source_code"].astype(str).to_numpy(),
+        "start": _days(authorizations["authorized_from"]),
+        "end": _days(authorizations["authorized_to"])})
+    df = df[df["start"] <= df["end"]].sort_values(["ssvid", "source_code", "start"], kind="stable")
+
+    ssvid = df["ssvid"].to_numpy()
+    code = df["source_code"].to_numpy()
+    start = df["start"].to_numpy()
+    end = df["end"].to_numpy()
+    if len(df) == 0:
+        return df.reset_index(drop=True)
+    first = np.r_[True, (ssvid[1:] != ssvid[:-1]) | (code[1:] != code[:-1])]
+
+    #
+    # Running max of the end within each key (keys lifted apart by `big` so a
+    # single accumulate does not carry across keys); a period opens a new merged
+    # period when it starts after the running end of the previous ones
+    group = np.cumsum(first) - 1
+    big = end.max() - start.min() + 2
+    running_end = np.maximum.accumulate(end - start.min() + group * big) - group * big + start.min()
+    new = first.copy()
+    new[1:] |= start[1:] > running_end[:-1] + 1
+    heads = np.flatnonzero(new)
+
+    return pd.DataFrame({
+        "ssvid": ssvid[heads], "source_code": code[heads], "start": start[heads],
+        "end": np.maximum.reduceat(end, heads)})
+
+
+def attribute_authorization(effort, authorizations, region_column="rfmo", pairs=None,
+                            authorization_start=AUTHORIZATION_START):
+    """
+    Label each (effort row, region) pair as authorized or not: authorized when
+    the vessel holds an authorization of that region covering the date.
+
+    :param effort: DataFrame with ssvid and date (and `region_column` unless `pairs` is given)
+    :param authorizations: DataFrame with ssvid, source_code, authorized_from and authorized_to
+    :param region_column: String, column of list-like regions of each row
+    :param pairs: Tuple (row position, region) overriding `region_column`, e.g.
+                  the `np.nonzero` of `region_labels.RegionGrid.rfb_membership`
+                  with its rows and RFB codes
+    :param authorization_start: Dict of region to the date its authorization
+                                data start; all pairs of an effort row in one of
+                                these regions before that date are marked excluded
+    :return: DataFrame with row, region, authorized and excluded
+    """
+    row, region = effort_region_pairs(effort, region_column) if pairs is None else pairs
+    ssvid = effort["ssvid"].astype(str).to_numpy()[row]
+    day = _days(effort["date"])[row]
+
+    periods = merge_periods(authorizations)
+
+    #
+    # One integer key per (ssvid, region) shared by effort and periods, then
+    # a single searchsorted of (key, day) into the sorted period starts
+    keys = pd.MultiIndex.from_arrays([
+        np.concatenate([periods["ssvid"].to_numpy(), ssvid]),
+        np.concatenate([periods["source_code"].to_numpy(), region.astype(str)])])
+    codes = pd.factorize(keys, sort=True)[0].astype(np.int64)
+    period_key, pair_key = codes[:len(periods)], codes[len(periods):]
+
+    day0 = min(periods["start"].min(), day.min()) if len(periods) and len(day) else 0
+    span = max(periods["end"].max(), day.max()) - day0 + 1 if len(periods) and len(day) else 1
+    period_pos = period_key * span + (periods["start"].to_numpy() - day0)
+    pair_pos = pair_key * span + (day - day0)
+
+    i = np.searchsorted(period_pos, pair_pos, side="right") - 1
+    found = i >= 0
+    i = np.where(found, i, 0)
+    authorized = found & (period_key[i] == pair_key) & (day <= periods["end"].to_numpy()[i]) \
+        if len(periods) else np.zeros(len(row), dtype=bool)
+
+    #
+    # The authorization queries drop the whole effort row, so a row excluded in
+    # one of its regions is excluded in every region
+    excluded = np.zeros(len(row), dtype=bool)
+    for code, start in authorization_start.items():
+        excluded |= (region == code) & (day < _days([start])[0])
+    excluded_rows = np.bincount(row, weights=excluded, minlength=len(effort)) > 0
+    excluded = excluded_rows[row]
+
+    return pd.DataFrame({"row": row, "region": region,
+                         "authorized": authorized & ~excluded, "excluded": excluded})
+
+
+def authorized_rows(effort, pairs):
+    """
+    Whether each effort row is authorized in any of its regions, the
+    equivalent of `fishing_effort_authorized_vessels`. Excluded rows are
+    never authorized; the queries also leave them out of all effort.
+
+    :param effort: DataFrame the pairs were made from
+    :param pairs: DataFrame from `attribute_authorization`
+    :return: numpy bool array, one per effort row
+    """
+    return np.bincount(pairs["row"].to_numpy(), weights=pairs["authorized"].to_numpy(),
+                       minlength=len(effort)) > 0
+
+
+def hours_by_region(effort, pairs):
+    """
+    Authorized and unknown fishing hours per region, leaving out excluded pairs
+
+    :param effort: DataFrame with fishing_hours
+    :param pairs: DataFrame from `attribute_authorization`
+    :return: DataFrame with region, fishing_hours_total, fishing_hours_authorized,
+             fishing_hours_auth_unknown and ratio_auth_unknown_fishing
+    """
+    pairs = pairs[~pairs["excluded"].to_numpy()]
+    hours = effort["fishing_hours"].to_numpy(np.float64)[pairs["row"].to_numpy()]
+    df = pd.DataFrame({"region": pairs["region"].to_numpy(),
+                       "fishing_hours_total": hours,
+                       "fishing_hours_authorized": np.where(pairs["authorized"], hours, 0)})
+    df = df.groupby("region", as_index=False).sum()
+    df["fishing_hours_auth_unknown"] = df["fishing_hours_total"] - df["fishing_hours_authorized"]
+    df["ratio_auth_unknown_fishing"] = df["fishing_hours_auth_unknown"] / df["fishing_hours_total"]
+    return df
@@ -0,0 +1,131 @@
+#-------------------------------------------------------------
+#-- Pre-rendered basemap layers
+#-- Land, country borders and EEZ boundaries dominate the render
+#-- time of every map at 300-500 dpi. This module renders those
+#-- layers once per (projection, extent, pixel size, dpi, style)
+#-- to a transparent RGBA array cached on disk, and composites it
+#-- over the data layers of later maps with one `imshow`, so a map
+#-- mostly costs drawing its own data.
+#--
+#-- Call it where `add_land`, `add_countries` and `add_eezs` were
+#-- called, once the map extent is set:
+#--   with pyseas.context(psm.styles.dark):
+#--       fig, ax = psm.create_maps(1, 1, figsize=(15, 15), dpi=300)
+#--       psm.add_bivariate_raster(...)
+#--       add_basemap(ax, style=psm.styles.dark)
+#-------------------------------------------------------------
+import os
+import hashlib
+from functools import lru_cache
+import numpy as np
+import matplotlib.pyplot as plt
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASEMAP_DIR = os.path.join(ROOT_DIR, "..", "..", "data", "basemap_cache")
+
+LAYERS = ("land", "countries", "eezs")
+
+
+def _layer_function(layer):
+    """
+    Drawing function of a layer: a pyseas `add_{layer}` or a callable taking the axes
+    """
+    if callable(layer):
+        return layer
+    import pyseas.maps as psm
+    return getattr(psm, f"add_{layer}")
+
+
+def _layer_name(layer):
+    return layer if isinstance(layer, str) else f"{layer.__module__}.{layer.__qualname__}"
+
+
+def basemap_key(ax, layers=LAYERS, style=None):
+    """
+    Cache key of the basemap of a map: its projection, extent, pixel size,
+    dpi, layers and style
+
+    :param ax: cartopy GeoAxes with its final extent
+    :param layers: Tuple of layer names or callables
+    :param style: Dict, pyseas style the layers are drawn with
+    :return: String
+    """
+    bbox = ax.get_window_extent()
+    key = repr((ax.projection.proj4_init,
+                np.round(ax.get_xlim(), 3).tolist(), np.round(ax.get_ylim(), 3).tolist(),
+                int(round(bbox.width)), int(round(bbox.height)), ax.figure.dpi,
+                [_layer_name(l) for l in layers],
+                sorted((k, repr(v)) for k, v in style.items()) if style else None))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def render_basemap(projection, xlim, ylim, width, height, dpi, layers=LAYERS):
+    """
+    Render layers on a transparent canvas of exactly the map's pixel size
+
+    :param projection: cartopy CRS of the map
+    :param xlim: Tuple, projected x limits of the map
+    :param ylim: Tuple, projected y limits of the map
+    :param width: Integer, map width in pixels
+    :param height: Integer, map height in pixels
+    :param dpi: Number, figure dpi
+    :param layers: Tuple of layer names or callables
+    :return: numpy uint8 array (height, width, 4)
+    """
+    fig = plt.figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+    try:
+        ax = fig.add_axes([0, 0, 1, 1], projection=projection)
+        ax.set_xlim(xlim)
+        ax.set_ylim(ylim)
+        for layer in layers:
+            _layer_function(layer)(ax)
+        ax.set_xlim(xlim)
+        ax.set_ylim(ylim)
+
+        #
+        # Only the layers are kept: transparent background, no frame
+        fig.patch.set_alpha(0)
+        ax.patch.set_visible(False)
+        for spine in ax.spines.values():
+            spine.set_visible(False)
+
+        fig.canvas.draw()
+        rgba = np.asarray(fig.canvas.buffer_rgba())[:height, :width].copy()
+    finally:
+        plt.close(fig)
+    return rgba
+
+
+@lru_cache(maxsize=16)
+def _load(path):
+    return np.load(path)
+
+
+def add_basemap(ax, layers=LAYERS, style=None, zorder=2):
+    """
+    Composite the cached basemap layers of a map onto it, rendering and
+    caching them first if needed. Replaces the `add_land`, `add_countries`
+    and `add_eezs` calls on the map.
+
+    :param ax: cartopy GeoAxes with its final extent
+    :param layers: Tuple of layer names (pyseas `add_{name}`) or callables
+    :param style: Dict, pyseas style in use, part of the cache key
+    :param zorder: Number, drawing order of the basemap over the data layers
+    :return: matplotlib AxesImage
+    """
+    ax.apply_aspect()
+    bbox = ax.get_window_extent()
+    width, height = int(round(bbox.width)), int(round(bbox.height))
+    xlim, ylim = ax.get_xlim(), ax.get_ylim()
+
+    path = os.path.join(BASEMAP_DIR, f"{basemap_key(ax, layers, style)}.npy")
+    if not os.path.exists(path):
+        os.makedirs(BASEMAP_DIR, exist_ok=True)
+        np.save(path, render_basemap(ax.projection, xlim, ylim, width, height,
+                                     ax.figure.dpi, layers))
+
+    im = ax.imshow(_load(path), extent=(*xlim, *ylim), transform=ax.projection,
+                   origin="upper", interpolation="nearest", zorder=zorder)
+    ax.set_xlim(xlim)
+    ax.set_ylim(ylim)
+    return im
@@ -0,0 +1,223 @@
+#-------------------------------------------------------------
+#-- Fishing effort raster pyramid
+#-- This module pulls fishing effort once at the finest resolution
+#-- (`fishing_effort_bands.sql`, 50 cells/degree) with fishing
+#-- hours by all and known vessels (as in `known_vs_all_fishing.sql`)
+#-- and by all and authorized vessels on the high seas (as in
+#-- `authorization_known_vs_unknown.sql`) as separate bands, and
+#-- stores it locally as a pyramid of NPY memmaps sum-pooled to 1/5,
+#-- 1 and 5 degree cells. Global maps and regional zooms are then
+#-- windowed reads from the pyramid instead of new warehouse queries
+#-- per resolution and region.
+#--
+#-- Each level is one (band, row, col) float32 array, origin upper,
+#-- covering the globe. The unknown bands (total minus known or
+#-- authorized hours, floored at 0) are derived per finest cell
+#-- before pooling. Levels are written stripe by stripe so the
+#-- finest level (about 4 GB) is never held in memory.
+#--
+#-- Run the following command (with date version as YYYYMMDD)
+#-- to build the pyramid once:
+#-- `python effort_pyramid.py YYYYMMDD`
+#--
+#-- Example:
+#--   grid_total, grid_ratio, extent = pyramid_raster(
+#--       "20220701", 50, "authorized", extent=(-16, 0, 58, 66))
+#-------------------------------------------------------------
+import sys
+import os
+import numpy as np
+import pandas as pd
+from effort_raster import cell_area_km2, GLOBAL_EXTENT
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+PYRAMID_DIR = os.path.join(ROOT_DIR, "..", "..", "data", "effort_pyramid")
+
+PROJECT = "world-fishing-827"
+FISHING_EFFORT_BANDS = "vessel_identity_staging.fishing_effort_bands_50th_deg_v"
+
+#
+# Bands fetched from `fishing_effort_bands.sql`
+BAND_COLUMNS = {"all": "fishing_hours_all",
+                "known": "fishing_hours_known_vessels",
+                "all_high_seas": "fishing_hours_all_high_seas",
+                "authorized": "fishing_hours_authorized_vessels"}
+
+#
+# Bands of identified vessels: the band of all vessels they are a part of
+# and the derived band of the others (unknown)
+PAIRS = {"known": ("all", "unknown"),
+         "authorized": ("all_high_seas", "auth_unknown")}
+
+BANDS = list(BAND_COLUMNS) + [unknown for _, unknown in PAIRS.values()]
+
+#
+# Cells per degree of each level: 1/50, 1/5, 1 and 5 degree cells
+LEVELS = [50, 5, 1, 0.2]
+FINEST = LEVELS[0]
+
+#
+# Fine rows per stripe, one row of the coarsest level
+STRIPE_ROWS = int(FINEST / LEVELS[-1])
+
+
+def level_path(YYYYMMDD, xyscale):
+    """
+    Return the local NPY file of a pyramid level
+
+    :param YYYYMMDD: vessel identity data version
+    :param xyscale: Number of cells per degree, one of LEVELS
+    :return: String, path to the NPY file
+    """
+    if xyscale not in LEVELS:
+        raise ValueError(f"xyscale must be one of {LEVELS}")
+    return os.path.join(PYRAMID_DIR, f"v{YYYYMMDD}", f"level_{xyscale:g}.npy")
+
+
+def fetch_fine_effort(YYYYMMDD):
+    """
+    Read the finest binned fishing effort of all bands from BigQuery
+    (the output of `fishing_effort_bands.sql`)
+
+    :param YYYYMMDD: vessel identity data version
+    :return: DataFrame with lat_bin, lon_bin and a column per band
+    """
+    q = f"""
+    SELECT lat_bin, lon_bin, {", ".join(BAND_COLUMNS.values())}
+    FROM `{FISHING_EFFORT_BANDS}{YYYYMMDD}`
+    """
+    return pd.read_gbq(q, project_id=PROJECT, dialect='standard')
+
+
+def _pool(stripe, factor):
+    """
+    Sum-pool a (band, row, col) stripe by an integer factor on both axes
+    """
+    nb, ny, nx = stripe.shape
+    return stripe.reshape(nb, ny // factor, factor, nx // factor, factor).sum(axis=(2, 4))
+
+
+def build_pyramid(df, YYYYMMDD):
+    """
+    Grid the finest binned effort and write every level of the pyramid.
+    Cells are sorted by row once; each stripe of STRIPE_ROWS fine rows is
+    accumulated densely, completed with the unknown bands of its cells,
+    written to the finest level and pooled into the matching rows of the
+    coarser levels.
+
+    :param df: DataFrame with lat_bin, lon_bin (at FINEST cells/degree) and BAND_COLUMNS
+    :param YYYYMMDD: vessel identity data version
+    :return: List of the level paths
+    """
+    ny, nx = 180 * FINEST, 360 * FINEST
+    row = ny - 1 - (df["lat_bin"].to_numpy(np.int64) + 90 * FINEST)
+    col = (df["lon_bin"].to_numpy(np.int64) + 180 * FINEST) % nx
+    values = np.nan_to_num(df[list(BAND_COLUMNS.values())].to_numpy(np.float64)).T
+    valid = (row >= 0) & (row < ny)
+
+    order = np.argsort(row[valid], kind="stable")
+    row, col, values = row[valid][order], col[valid][order], values[:, valid][:, order]
+    bounds = np.searchsorted(row, np.arange(0, ny + STRIPE_ROWS, STRIPE_ROWS))
+
+    paths = [level_path(YYYYMMDD, s) for s in LEVELS]
+    os.makedirs(os.path.dirname(paths[0]), exist_ok=True)
+    levels = [np.lib.format.open_memmap(
+        p, mode="w+", dtype=np.float32,
+        shape=(len(BANDS), int(180 * s), int(360 * s))) for p, s in zip(paths, LEVELS)]
+
+    for i in range(ny // STRIPE_ROWS):
+        lo, hi = bounds[i], bounds[i + 1]
+        r0 = i * STRIPE_ROWS
+        stripe = np.zeros((len(BANDS), STRIPE_ROWS, nx))
+        flat = (row[lo:hi] - r0) * nx + col[lo:hi]
+        for b in range(len(BAND_COLUMNS)):
+            stripe[b] = np.bincount(flat, weights=values[b, lo:hi],
+                                    minlength=STRIPE_ROWS * nx).reshape(STRIPE_ROWS, nx)
+
+        #
+        # Unknown hours floored at 0 per finest cell, before any pooling
+        for band, (total, unknown) in PAIRS.items():
+            stripe[BANDS.index(unknown)] = np.maximum(
+                stripe[BANDS.index(total)] - stripe[BANDS.index(band)], 0)
+
+        for level, s in zip(levels, LEVELS):
+            factor = int(FINEST / s)
+            level[:, r0 // factor:(r0 + STRIPE_ROWS) // factor] = _pool(stripe, factor)
+
+    for level in levels:
+        level.flush()
+    return paths
+
+
+def read_window(YYYYMMDD, xyscale, extent=None):
+    """
+    Read a window of a pyramid level. Only the rows and columns of the window
+    are read from the memmap.
+
+    :param YYYYMMDD: vessel identity data version
+    :param xyscale: Number of cells per degree, one of LEVELS
+    :param extent: Tuple (lon0, lon1, lat0, lat1), global if None
+    :return: Tuple of a dict of band to fishing hours grid, the first row of
+             the window and the extent snapped outward to the level's cells
+    """
+    path = level_path(YYYYMMDD, xyscale)
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"No local effort pyramid for v{YYYYMMDD}. "
+            f"Run `python effort_pyramid.py {YYYYMMDD}` first.")
+
+    level = np.load(path, mmap_mode="r")
+    lon0, lon1, lat0, lat1 = GLOBAL_EXTENT if extent is None else extent
+    c0 = max(int(np.floor((lon0 + 180) * xyscale)), 0)
+    c1 = min(int(np.ceil((lon1 + 180) * xyscale)), level.shape[2])
+    r0 = max(int(np.floor((90 - lat1) * xyscale)), 0)
+    r1 = min(int(np.ceil((90 - lat0) * xyscale)), level.shape[1])
+    if c0 >= c1 or r0 >= r1:
+        raise ValueError(f"Extent {extent} does not overlap the grid")
+
+    window = np.asarray(level[:, r0:r1, c0:c1], dtype=np.float64)
+    snapped = (c0 / xyscale - 180, c1 / xyscale - 180, 90 - r1 / xyscale, 90 - r0 / xyscale)
+    return dict(zip(BANDS, window)), r0, snapped
+
+
+def pyramid_raster(YYYYMMDD, xyscale, band, extent=None):
+    """
+    Total fishing hours per km2 and the ratio of fishing hours by vessels
+    outside a band (e.g. authorization unknown) to those by all vessels,
+    in the same form as `effort_raster.make_raster`. The total is the band
+    of all vessels of the same query (all for known, all_high_seas for
+    authorized).
+
+    :param YYYYMMDD: vessel identity data version
+    :param xyscale: Number of cells per degree, one of LEVELS
+    :param band: String, known or authorized
+    :param extent: Tuple (lon0, lon1, lat0, lat1), global if None
+    :return: Tuple of the total grid, the ratio grid and the snapped extent
+    """
+    if band not in PAIRS:
+        raise ValueError(f"band must be one of {list(PAIRS)}")
+
+    bands, r0, snapped = read_window(YYYYMMDD, xyscale, extent)
+    total, unknown = (bands[b] for b in PAIRS[band])
+    ratio = np.divide(unknown, total, out=np.zeros_like(total), where=total != 0)
+
+    area = cell_area_km2(xyscale, np.arange(r0, r0 + total.shape[0]))
+    return total / area[:, None], ratio, snapped
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) != 2:
+        print("Use example: python effort_pyramid.py YYYYMMDD")
+        raise ValueError('Version date is supposed to be passed as "YYYYMMDD"')
+
+    #
+    # Setting
+    YYYYMMDD = sys.argv[1]
+    if len(YYYYMMDD) != 8:
+        raise ValueError("Version date is supposed to be passed as YYYYMMDD")
+
+    #
+    # Run
+    for path in build_pyramid(fetch_fine_effort(YYYYMMDD), YYYYMMDD):
+        print(f"{path} written")
@@ -0,0 +1,157 @@
+#-------------------------------------------------------------
+#-- Sparse fishing effort rasters
+#-- This module grids the binned fishing effort of the
+#-- authorization queries (`lat_bin`, `lon_bin` as
+#-- FLOOR(lat/lon * xyscale)) into sparse rasters. Known, unknown
+#-- and total fishing hours are accumulated in a single pass into
+#-- CSR grids sharing one sparsity pattern, and only the viewport
+#-- being plotted is densified, so maps at 50 cells/degree do not
+#-- need dense global intermediates (324M cells each).
+#--
+#-- The grid layout follows `pyseas.maps.rasters.df2raster`:
+#-- global extent (-180, 180, -90, 90), origin upper, and
+#-- fishing hours per km2 when densified.
+#--
+#-- Example:
+#--   raster = EffortRaster.from_bins(df, 50, 'fishing_hours_authorized_vessels')
+#--   grid_total, grid_ratio, extent = raster.window((-16, 0, 58, 66))
+#-------------------------------------------------------------
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+EARTH_RADIUS_KM = 6371.0088
+GLOBAL_EXTENT = (-180, 180, -90, 90)
+
+
+def cell_area_km2(xyscale, rows=None):
+    """
+    Area of the grid cells of each raster row (cells in a row share one area)
+
+    :param xyscale: Integer, number of cells per degree
+    :param rows: Array-like of row indices (origin upper), all rows if None
+    :return: numpy array of km2 per cell
+    """
+    ny = 180 * xyscale
+    rows = np.arange(ny) if rows is None else np.asarray(rows)
+    lat1 = np.radians(90 - rows / xyscale)
+    lat0 = np.radians(90 - (rows + 1) / xyscale)
+    return EARTH_RADIUS_KM ** 2 * np.radians(1 / xyscale) * (np.sin(lat1) - np.sin(lat0))
+
+
+class EffortRaster:
+    """
+    Total, known and unknown fishing hours on a global grid in CSR form.
+    The three bands share `indptr` and `indices`, so any window slices the
+    same cells in each of them.
+    """
+
+    def __init__(self, total, known, unknown, xyscale):
+        """
+        :param total: scipy.sparse.csr_matrix of total fishing hours
+        :param known: scipy.sparse.csr_matrix of fishing hours by known vessels
+        :param unknown: scipy.sparse.csr_matrix of fishing hours by unknown vessels
+        :param xyscale: Integer, number of cells per degree
+        """
+        self.total = total
+        self.known = known
+        self.unknown = unknown
+        self.xyscale = xyscale
+
+    @classmethod
+    def from_bins(cls, df, xyscale, cat, total="fishing_hours_all"):
+        """
+        Grid binned fishing effort. The unknown hours of a cell are the total
+        minus the known hours (missing known hours count as 0), floored at 0.
+
+        :param df: DataFrame with lat_bin, lon_bin, the total and the known hours
+        :param xyscale: Integer, number of cells per degree used for the bins
+        :param cat: String, column of fishing hours by known vessels
+        :param total: String, column of fishing hours by all vessels
+        :return: EffortRaster
+        """
+        df = df[df[total].notnull()]
+        all_hours = df[total].to_numpy(np.float64)
+        known_hours = df[cat].fillna(0).to_numpy(np.float64)
+        unknown_hours = np.maximum(all_hours - known_hours, 0)
+
+        #
+        # Row/column of each bin, origin upper, wrapped/clipped to the global grid
+        ny, nx = 180 * xyscale, 360 * xyscale
+        row = ny - 1 - (df["lat_bin"].to_numpy(np.int64) + 90 * xyscale)
+        col = (df["lon_bin"].to_numpy(np.int64) + 180 * xyscale) % nx
+        valid = (row >= 0) & (row < ny)
+        row, col = row[valid], col[valid]
+
+        #
+        # One pass over the cells: sorted flat indices give the CSR layout directly
+        cells, inverse = np.unique(row * nx + col, return_inverse=True)
+        bands = [np.bincount(inverse, weights=v[valid], minlength=len(cells)).astype(np.float64)
+                 for v in (all_hours, known_hours, unknown_hours)]
+        indices = (cells % nx).astype(np.int32)
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(cells // nx, minlength=ny))])
+        return cls(*[sparse.csr_matrix((b, indices, indptr), shape=(ny, nx)) for b in bands],
+                   xyscale)
+
+    @property
+    def shape(self):
+        return self.total.shape
+
+    def _slices(self, extent):
+        """
+        Row and column slices of a (lon0, lon1, lat0, lat1) extent, snapped
+        outward to the grid, and the snapped extent
+        """
+        lon0, lon1, lat0, lat1 = extent
+        s = self.xyscale
+        c0 = max(int(np.floor((lon0 + 180) * s)), 0)
+        c1 = min(int(np.ceil((lon1 + 180) * s)), 360 * s)
+        r0 = max(int(np.floor((90 - lat1) * s)), 0)
+        r1 = min(int(np.ceil((90 - lat0) * s)), 180 * s)
+        if c0 >= c1 or r0 >= r1:
+            raise ValueError(f"Extent {extent} does not overlap the grid")
+        snapped = (c0 / s - 180, c1 / s - 180, 90 - r1 / s, 90 - r0 / s)
+        return slice(r0, r1), slice(c0, c1), snapped
+
+    def window(self, extent=None, per_km2=True):
+        """
+        Densify the viewport being plotted into the total fishing hours and
+        the ratio of unknown to total fishing hours
+
+        :param extent: Tuple (lon0, lon1, lat0, lat1), global if None
+        :param per_km2: Boolean, total fishing hours per km2 as in `df2raster`
+        :return: Tuple of the dense total grid, the dense ratio grid and the
+                 snapped extent to pass to the plotting functions
+        """
+        rows, cols, snapped = self._slices(GLOBAL_EXTENT if extent is None else extent)
+        total = self.total[rows, cols].toarray()
+        unknown = self.unknown[rows, cols].toarray()
+
+        ratio = np.divide(unknown, total, out=np.zeros_like(total), where=total != 0)
+        if per_km2:
+            area = cell_area_km2(self.xyscale, np.arange(rows.start, rows.stop))
+            total /= area[:, None]
+        return total, ratio, snapped
+
+    def band_totals(self):
+        """
+        Total, known and unknown fishing hours over the whole grid
+
+        :return: pandas Series of hours by band
+        """
+        return pd.Series({"total": self.total.sum(), "known": self.known.sum(),
+                          "unknown": self.unknown.sum()})
+
+
+def make_raster(df, xyscale, cat, extent=None):
+    """
+    Total fishing hours per km2 and the ratio of fishing hours by unknown
+    vessels to those by all vessels, as dense grids of the viewport
+
+    :param df: DataFrame with lat_bin, lon_bin, fishing_hours_all and `cat`
+    :param xyscale: Integer, number of cells per degree
+    :param cat: String, column of fishing hours by known vessels
+    :param extent: Tuple (lon0, lon1, lat0, lat1), global if None
+    :return: Tuple of the total grid, the ratio grid and the snapped extent
+    """
+    return EffortRaster.from_bins(df, xyscale, cat).window(extent)
@@ -24,11 +24,14 @@ from pyseas.maps import scalebar, core, rasters, ticks
 import imp
 import matplotlib.colors as colors
 from cartopy import crs
-from cartopy.io.shapereader import Reader
 import pyseas.maps as psm
 import matplotlib.colors as mpcolors
 from matplotlib.colors import LinearSegmentedColormap
-import glob
+from effort_raster import make_raster
+from effort_pyramid import pyramid_raster
+from geometry_store import fao_areas, rfbs, attribute_lookup
+from region_effort import region_totals
+from basemap import add_basemap
 
 
 # -
@@ -45,24 +48,6 @@ def reload():
     imp.reload(pyseas)
 
 
-def make_raster(df, xyscale, cat):
-    authorized_all = df[df["fishing_hours_all"].notnull()]
-    authorized_known = df[df[cat].notnull()]
-    authorized_unknown = authorized_all.copy()
-    authorized_unknown[cat] = authorized_unknown[cat].fillna(0)
-    authorized_unknown['fishing_hours_unknown'] = authorized_unknown.apply(
-        lambda x: max (x["fishing_hours_all"] - x[cat], 0), axis=1)
-
-    grid = pyseas.maps.rasters.df2raster(authorized_unknown, 'lon_bin', 'lat_bin', 
-                                         'fishing_hours_unknown', 
-                                         xyscale=xyscale, per_km2=True)
-    grid2 = pyseas.maps.rasters.df2raster(authorized_all, 'lon_bin', 'lat_bin', 
-                                         'fishing_hours_all', 
-                                         xyscale=xyscale, per_km2=True)
-    grid3 = np.divide(grid, grid2, out=np.zeros_like(grid), where=grid2!=0)
-    return grid2, grid3
-
-
 # # Known fishing effort
 
 # ## All fishing effort in AIS
@@ -88,9 +73,7 @@ with pyseas.context(pyseas.styles.dark,
         grid, cmap='fishing', loc='bottom', norm = norm,
         projection = "global.default") 
     
-    psm.add_land(ax)
-    psm.add_countries(ax)
-    psm.add_eezs(ax)
+    add_basemap(ax, style=pyseas.styles.dark)
 
     ax1 = ax.inset_axes([0.4, -0.215, 0.2, 0.2 / 3], transform=ax.transAxes)
     ax1.axis('off')
@@ -109,7 +92,7 @@ SELECT *
 FROM `vessel_identity_staging.fishing_effort_known_vs_all_5th_deg_v20220701`
 """
 authorized = pd.read_gbq(q, project_id='world-fishing-827', dialect='standard')
-grid_total, grid_ratio = make_raster(authorized, 5, 'fishing_hours_known_vessels')
+grid_total, grid_ratio, extent = make_raster(authorized, 5, 'fishing_hours_known_vessels')
 
 reload()
 cmap = psm.bivariate.TransparencyBivariateColormap(cm.misc.blue_orange)
@@ -117,10 +100,8 @@ with pyseas.context(psm.styles.dark):
     fig, ax = psm.create_maps(1, 1, figsize=(15, 15), dpi=300, facecolor='#f7f7f7')
     norm1 = mpcolors.Normalize(vmin=0.01, vmax=1.0, clip=True)
     norm2 = mpcolors.LogNorm(vmin=0.003, vmax=0.3, clip=True)
-    psm.add_bivariate_raster(grid_ratio, grid_total, cmap, norm1, norm2, ax=ax)
-    psm.add_land(ax)
-    psm.add_countries(ax)
-    psm.add_eezs(ax)
+    psm.add_bivariate_raster(grid_ratio, grid_total, cmap, norm1, norm2, ax=ax, extent=extent)
+    add_basemap(ax, style=psm.styles.dark)
     
     cb_ax = psm.add_bivariate_colorbox(cmap, norm1, norm2,
                                        xlabel='Hours fished by AIS-registry unmatched vessels\n' +
@@ -146,12 +127,10 @@ with pyseas.context(psm.styles.dark):
 
 # ## Fishing effort by vessels with known vs. unknown authorization
 
-q = """
-SELECT *
-FROM `vessel_identity_staging.fishing_effort_auth_vs_all_5th_deg_v20220701`
-"""
-authorized = pd.read_gbq(q, project_id='world-fishing-827', dialect='standard')
-grid_total, grid_ratio = make_raster(authorized, 5, 'fishing_hours_authorized_vessels')
+#
+# Read from the local effort pyramid (`python effort_pyramid.py 20220701`), whose
+# authorization bands are built with the filters of `authorization_known_vs_unknown.sql`
+grid_total, grid_ratio, extent = pyramid_raster('20220701', 5, 'authorized')
 
 reload()
 cmap = psm.bivariate.TransparencyBivariateColormap(cm.misc.blue_orange)
@@ -159,10 +138,8 @@ with pyseas.context(psm.styles.dark):
     fig, ax = psm.create_maps(1, 1, figsize=(15, 15), dpi=300, facecolor='#f7f7f7')
     norm1 = mpcolors.Normalize(vmin=0.01, vmax=1.0, clip=True)
     norm2 = mpcolors.LogNorm(vmin=0.003, vmax=0.3, clip=True)
-    psm.add_bivariate_raster(grid_ratio, grid_total, cmap, norm1, norm2, ax=ax)
-    psm.add_land(ax)
-    psm.add_countries(ax)
-    psm.add_eezs(ax)
+    psm.add_bivariate_raster(grid_ratio, grid_total, cmap, norm1, norm2, ax=ax, extent=extent)
+    add_basemap(ax, style=psm.styles.dark)
     
     cb_ax = psm.add_bivariate_colorbox(cmap, norm1, norm2,
                                        xlabel='Hours fished by authorization unknown vessels\n' +
@@ -195,7 +172,7 @@ SELECT *
 FROM `vessel_identity_staging.fishing_effort_auth_vs_all_5th_deg_v20220701`
 """
 authorized = pd.read_gbq(q, project_id='world-fishing-827', dialect='standard')
-grid_total, grid_ratio = make_raster(authorized, 5, 'fishing_hours_authorized_vessels')
+grid_total, grid_ratio, extent = make_raster(authorized, 5, 'fishing_hours_authorized_vessels')
 
 reload()
 cmap = psm.bivariate.TransparencyBivariateColormap(cm.misc.blue_orange)
@@ -203,10 +180,8 @@ with pyseas.context(psm.styles.dark):
     fig, ax = psm.create_maps(1, 1, figsize=(15, 15), dpi=300, facecolor='#f7f7f7')
     norm1 = mpcolors.Normalize(vmin=0.01, vmax=1.0, clip=True)
     norm2 = mpcolors.LogNorm(vmin=0.003, vmax=0.3, clip=True)
-    psm.add_bivariate_raster(grid_ratio, grid_total, cmap, norm1, norm2, ax=ax)
-    psm.add_land(ax)
-    psm.add_countries(ax)
-    psm.add_eezs(ax)
+    psm.add_bivariate_raster(grid_ratio, grid_total, cmap, norm1, norm2, ax=ax, extent=extent)
+    add_basemap(ax, style=psm.styles.dark)
     
     cb_ax = psm.add_bivariate_colorbox(cmap, norm1, norm2,
 #                                        xlabel='Ratio',
@@ -218,9 +193,8 @@ with pyseas.context(psm.styles.dark):
     lw = 1
     al = 1
     color = '#848b9b'
-    path = '../data/FAO_FISHERIES_AREA/'
-    for fname in glob.glob(path + 'FSA_*_simp/FSA_*.shp'):
-        ax.add_geometries(Reader(fname).geometries(),
+    for geoms in fao_areas(simplified=True).values():
+        ax.add_geometries(geoms,
                           crs.PlateCarree(), edgecolor=color, linewidth=lw, 
                           facecolor='none', alpha=al, zorder=0)
     
@@ -268,13 +242,26 @@ FROM `vessel_identity_staging.fishing_effort_auth_vs_all_ratio_by_fao_area_v2022
 """
 fao_region = pd.read_gbq(q, project_id='world-fishing-827', dialect='standard')
 
+# +
+#
+# Set to True to compare the FAO totals aggregated locally from the effort pyramid
+# (`python effort_pyramid.py 20220701`, see `region_effort.py`) with the table of
+# `identify_authorized_fishing_by_fao_area.sql` above, side by side
+compare_region_totals = False
+
+if compare_region_totals:
+    fao_local = region_totals('20220701')['fao']
+    fao_diff = fao_region.merge(fao_local, on='fao_area', how='outer', suffixes=('_sql', '_local'))
+    for col in ['fishing_hours_total', 'fishing_hours_auth_unknown', 'ratio_auth_unknown_fishing']:
+        fao_diff[f'{col}_diff'] = fao_diff[f'{col}_local'] - fao_diff[f'{col}_sql']
+    print(fao_diff.sort_values('fao_area').to_string(index=False))
+# -
+
 reload()
 cmap = psm.bivariate.TransparencyBivariateColormap(cm.misc.blue_orange)
 with pyseas.context(psm.styles.dark):
     fig, ax = psm.create_maps(1, 1, figsize=(15, 15), dpi=300, facecolor='#f7f7f7')
-    psm.add_land(ax)
-    psm.add_countries(ax)
-    psm.add_eezs(ax)
+    add_basemap(ax, style=psm.styles.dark)
     
 
     lw = 1
@@ -293,16 +280,14 @@ with pyseas.context(psm.styles.dark):
     ax0.yaxis.set_ticks([])
     ax0.set_xticklabels([l * 0.005 if l != 80 else '>0.4' for l in ax0.get_xticks()])
 
-    path = '../data/FAO_FISHERIES_AREA/'
-    for fname in glob.glob(path + 'FSA_*_simp/FSA_*.shp'):
-        fao_area = fname.split('/FSA_')[-1].split('.shp')[0]
+    ratios = attribute_lookup(fao_region, 'fao_area', 'ratio_auth_unknown_fishing')
+    for fao_area, geoms in fao_areas(simplified=True).items():
         if fao_area in ('18', '58'):
             color = 'none'
         else:
-            ratio = fao_region[fao_region['fao_area'] == fao_area]['ratio_auth_unknown_fishing'].iloc[0]
-            color = cmp(norm(ratio))
+            color = cmp(norm(ratios[fao_area]))
             
-        ax.add_geometries(Reader(fname).geometries(),
+        ax.add_geometries(geoms,
                           crs.PlateCarree(), edgecolor='#e6e7eb', linewidth=lw, 
                           facecolor=color, alpha=al, zorder=1)
     
@@ -348,7 +333,7 @@ SELECT *
 FROM `vessel_identity_staging.fishing_effort_auth_vs_all_5th_deg_trfmo_v20220701`
 """
 authorized = pd.read_gbq(q, project_id='world-fishing-827', dialect='standard')
-grid_total, grid_ratio = make_raster(authorized, 5, 'fishing_hours_authorized_vessels')
+grid_total, grid_ratio, extent = make_raster(authorized, 5, 'fishing_hours_authorized_vessels')
 
 reload()
 cmap = psm.bivariate.TransparencyBivariateColormap(cm.misc.blue_orange)
@@ -356,10 +341,8 @@ with pyseas.context(psm.styles.dark):
     fig, ax = psm.create_maps(1, 1, figsize=(15, 15), dpi=500, facecolor='#f7f7f7')
     norm1 = mpcolors.Normalize(vmin=0.01, vmax=1.0, clip=True)
     norm2 = mpcolors.LogNorm(vmin=0.005, vmax=0.5, clip=True)
-    psm.add_bivariate_raster(grid_ratio, grid_total, cmap, norm1, norm2, ax=ax)
-    psm.add_land(ax)
-    psm.add_countries(ax)
-    psm.add_eezs(ax)
+    psm.add_bivariate_raster(grid_ratio, grid_total, cmap, norm1, norm2, ax=ax, extent=extent)
+    add_basemap(ax, style=psm.styles.dark)
     
     cb_ax = psm.add_bivariate_colorbox(cmap, norm1, norm2,
 #                                        xlabel='Ratio of Fishing Hours by RFMO Authorization Matched Vessels to Those by All',
@@ -371,24 +354,19 @@ with pyseas.context(psm.styles.dark):
     lw = 4
     al = 0.4
     colors = ['#ad2176', '#d73b68', '#8abbc7', '#f68d4b', '#ebe55d']
-    fname = '../data/FAO_RFB/FAO_RFB_CCSBT_simplified/RFB_CCSBT.shp'
-    ax.add_geometries(Reader(fname).geometries(),
+    ax.add_geometries(rfbs('simplified')['CCSBT'],
                       crs.PlateCarree(), edgecolor=colors[0], linewidth=lw, #e6e7eb
                       facecolor='none', alpha=al+0.1)
-    fname = '../data/FAO_RFB/FAO_RFB_IATTC_simplified/RFB_IATTC.shp'
-    ax.add_geometries(Reader(fname).geometries(),
+    ax.add_geometries(rfbs('simplified')['IATTC'],
                       crs.PlateCarree(), edgecolor=colors[1], linewidth=lw,
                       facecolor='none', alpha=al)
-    fname = '../data/FAO_RFB/FAO_RFB_ICCAT_simplified/RFB_ICCAT.shp'
-    ax.add_geometries(Reader(fname).geometries(),
+    ax.add_geometries(rfbs('simplified')['ICCAT'],
                       crs.PlateCarree(), edgecolor=colors[2], linewidth=lw,
                       facecolor='none', alpha=al)
-    fname = '../data/FAO_RFB/FAO_RFB_IOTC_simplified/RFB_IOTC.shp'
-    ax.add_geometries(Reader(fname).geometries(),
+    ax.add_geometries(rfbs('simplified')['IOTC'],
                       crs.PlateCarree(), edgecolor=colors[3], linewidth=lw, 
                       facecolor='none', alpha=al)
-    fname = '../data/FAO_RFB/FAO_RFB_WCPFC_simplified/RFB_WCPFC.shp'
-    ax.add_geometries(Reader(fname).geometries(),
+    ax.add_geometries(rfbs('simplified')['WCPFC'],
                       crs.PlateCarree(), edgecolor=colors[4], linewidth=lw,
                       facecolor='none', alpha=al)
     
@@ -419,7 +397,7 @@ SELECT *
 FROM `vessel_identity_staging.fishing_effort_auth_vs_all_5th_deg_squid_rfmo_v20220701`
 """
 authorized = pd.read_gbq(q, project_id='world-fishing-827', dialect='standard')
-grid_total, grid_ratio = make_raster(authorized, 5, 'fishing_hours_authorized_vessels')
+grid_total, grid_ratio, extent = make_raster(authorized, 5, 'fishing_hours_authorized_vessels')
 
 reload()
 cmap = psm.bivariate.TransparencyBivariateColormap(cm.misc.blue_orange)
@@ -427,10 +405,8 @@ with pyseas.context(psm.styles.dark):
     fig, ax = psm.create_maps(1, 1, figsize=(15, 15), dpi=500, facecolor='#f7f7f7')
     norm1 = mpcolors.Normalize(vmin=0.01, vmax=1.0, clip=True)
     norm2 = mpcolors.LogNorm(vmin=0.005, vmax=0.5, clip=True)
-    psm.add_bivariate_raster(grid_ratio, grid_total, cmap, norm1, norm2, ax=ax)
-    psm.add_land(ax)
-    psm.add_countries(ax)
-    psm.add_eezs(ax)
+    psm.add_bivariate_raster(grid_ratio, grid_total, cmap, norm1, norm2, ax=ax, extent=extent)
+    add_basemap(ax, style=psm.styles.dark)
     
     cb_ax = psm.add_bivariate_colorbox(cmap, norm1, norm2,
 #                                        xlabel='Ratio of Fishing Hours by RFMO Authorization Matched Vessels to Those by All',
@@ -442,12 +418,10 @@ with pyseas.context(psm.styles.dark):
     lw = 4
     al = 0.4
     colors = ['#8abbc7', '#ebe55d']
-    fname = '../data/FAO_RFB/FAO_RFB_NPFC/RFB_NPFC.shp'
-    ax.add_geometries(Reader(fname).geometries(),
+    ax.add_geometries(rfbs('')['NPFC'],
                       crs.PlateCarree(), edgecolor=colors[0], linewidth=lw, #e6e7eb
                       facecolor='none', alpha=al)
-    fname = '../data/FAO_RFB/FAO_RFB_SPRFMO/RFB_SPRFMO.shp'
-    ax.add_geometries(Reader(fname).geometries(),
+    ax.add_geometries(rfbs('')['SPRFMO'],
                       crs.PlateCarree(), edgecolor=colors[1], linewidth=lw,
                       facecolor='none', alpha=al)
     
@@ -478,36 +452,18 @@ FROM scratch_jaeyoon.fishing_effort_auth_vs_all_50th_deg_fro
 """
 authorized = pd.read_gbq(q, project_id='world-fishing-827', dialect='standard')
 
-# +
-authorized_all = authorized[authorized["fishing_hours_all"].notnull()]
-authorized_known = authorized[authorized["fishing_hours_authorized_vessels"].notnull()]
-authorized_unknown = authorized_all.copy()
-authorized_unknown["fishing_hours_authorized_vessels"] = authorized_unknown["fishing_hours_authorized_vessels"].fillna(0)
-authorized_unknown['fishing_hours_authorized_unknown'] = authorized_unknown.apply(
-    lambda x: max (x["fishing_hours_all"] - x["fishing_hours_authorized_vessels"], 0), axis=1)
-
-grid = pyseas.maps.rasters.df2raster(authorized_unknown, 'lon_bin', 'lat_bin', 
-                                     'fishing_hours_authorized_unknown', 
-                                     xyscale=50, per_km2=True)
-grid2 = pyseas.maps.rasters.df2raster(authorized_all, 'lon_bin', 'lat_bin', 
-                                     'fishing_hours_all', 
-                                     xyscale=50, per_km2=True)
-grid3 = np.divide(grid, grid2, out=np.zeros_like(grid), where=grid2!=0)
-# -
+grid_total, grid_ratio, extent = make_raster(authorized, 50, 'fishing_hours_authorized_vessels',
+                                              extent=(-16, 0, 58, 66))
 
 reload()
-grid_ratio = grid3.copy()
-grid_total = grid2.copy()
 cmap = psm.bivariate.TransparencyBivariateColormap(cm.misc.blue_orange)
 with pyseas.context(psm.styles.dark):
     fig, ax = psm.create_maps(1, 1, figsize=(15, 15), dpi=300, facecolor='white',
                               projection='country.faroe')
     norm1 = mpcolors.Normalize(vmin=0.01, vmax=1.0, clip=True)
     norm2 = mpcolors.LogNorm(vmin=0.1, vmax=10.0, clip=True)
-    psm.add_bivariate_raster(grid_ratio, grid_total, cmap, norm1, norm2, ax=ax)
-    psm.add_land(ax)
-    psm.add_countries(ax)
-    psm.add_eezs(ax)
+    psm.add_bivariate_raster(grid_ratio, grid_total, cmap, norm1, norm2, ax=ax, extent=extent)
+    add_basemap(ax, style=psm.styles.dark)
     
     cb_ax = psm.add_bivariate_colorbox(cmap, norm1, norm2,
                                        xlabel='Ratio of Fishing Hours by Authorization Matched Vessels to Those by All',
@@ -535,7 +491,8 @@ SELECT *
 FROM vessel_identity_staging.fishing_effort_auth_vs_all_50th_deg_nor_v20211101
 """
 authorized = pd.read_gbq(q, project_id='world-fishing-827', dialect='standard')
-grid_total, grid_ratio = make_raster(authorized, 50, 'fishing_hours_authorized_vessels')
+grid_total, grid_ratio, extent = make_raster(authorized, 50, 'fishing_hours_authorized_vessels',
+                                              extent=(-10, 40, 54, 82))
 
 reload()
 cmap = psm.bivariate.TransparencyBivariateColormap(cm.misc.blue_orange)
@@ -544,10 +501,8 @@ with pyseas.context(psm.styles.dark):
                               projection='country.norway')
     norm1 = mpcolors.Normalize(vmin=0.01, vmax=1.0, clip=True)
     norm2 = mpcolors.LogNorm(vmin=0.1, vmax=10.0, clip=True)
-    psm.add_bivariate_raster(grid_ratio, grid_total, cmap, norm1, norm2, ax=ax)
-    psm.add_land(ax)
-    psm.add_countries(ax)
-    psm.add_eezs(ax)
+    psm.add_bivariate_raster(grid_ratio, grid_total, cmap, norm1, norm2, ax=ax, extent=extent)
+    add_basemap(ax, style=psm.styles.dark)
     
     cb_ax = psm.add_bivariate_colorbox(
         cmap, norm1, norm2,
@@ -574,7 +529,8 @@ SELECT *
 FROM vessel_identity_staging.fishing_effort_auth_vs_all_50th_deg_isl_v20211101
 """
 authorized = pd.read_gbq(q, project_id='world-fishing-827', dialect='standard')
-grid_total, grid_ratio = make_raster(authorized, 50, 'fishing_hours_authorized_vessels')
+grid_total, grid_ratio, extent = make_raster(authorized, 50, 'fishing_hours_authorized_vessels',
+                                              extent=(-32, -2, 59, 71))
 
 reload()
 cmap = psm.bivariate.TransparencyBivariateColormap(cm.misc.blue_orange)
@@ -583,10 +539,8 @@ with pyseas.context(psm.styles.dark):
                               projection='country.iceland')
     norm1 = mpcolors.Normalize(vmin=0.01, vmax=1.0, clip=True)
     norm2 = mpcolors.LogNorm(vmin=0.1, vmax=10.0, clip=True)
-    psm.add_bivariate_raster(grid_ratio, grid_total, cmap, norm1, norm2, ax=ax)
-    psm.add_land(ax)
-    psm.add_countries(ax)
-    psm.add_eezs(ax)
+    psm.add_bivariate_raster(grid_ratio, grid_total, cmap, norm1, norm2, ax=ax, extent=extent)
+    add_basemap(ax, style=psm.styles.dark)
     
     cb_ax = psm.add_bivariate_colorbox(cmap, norm1, norm2,
 #                                        xlabel='Ratio of Fishing Hours by Authorization Matched Vessels to Those by All',
@@ -612,7 +566,8 @@ SELECT *
 FROM scratch_jaeyoon.fishing_effort_auth_vs_all_50th_deg_per
 """
 authorized = pd.read_gbq(q, project_id='world-fishing-827', dialect='standard')
-grid_total, grid_ratio = make_raster(authorized, 50)
+grid_total, grid_ratio, extent = make_raster(authorized, 50, 'fishing_hours_authorized_vessels',
+                                              extent=(-90, -68, -22, 0))
 
 reload()
 cmap = psm.bivariate.TransparencyBivariateColormap(cm.misc.blue_orange)
@@ -621,10 +576,8 @@ with pyseas.context(psm.styles.dark):
                               projection='country.peru_tight')
     norm1 = mpcolors.Normalize(vmin=0.01, vmax=1.0, clip=True)
     norm2 = mpcolors.LogNorm(vmin=0.01, vmax=0.5, clip=True)
-    psm.add_bivariate_raster(grid_ratio, grid_total, cmap, norm1, norm2, ax=ax)
-    psm.add_land(ax)
-    psm.add_countries(ax)
-    psm.add_eezs(ax)
+    psm.add_bivariate_raster(grid_ratio, grid_total, cmap, norm1, norm2, ax=ax, extent=extent)
+    add_basemap(ax, style=psm.styles.dark)
     
     cb_ax = psm.add_bivariate_colorbox(cmap, norm1, norm2,
                                        xlabel='Ratio of Fishing Hours by Authorization Matched Vessels to Those by All',
@@ -0,0 +1,183 @@
+#-------------------------------------------------------------
+#-- FAO area and RFB geometry store
+#-- This module loads the shapefiles of `data/FAO_FISHERIES_AREA`
+#-- and `data/FAO_RFB` once into Shapely geometries keyed by FAO
+#-- area code or RFB (RFMO) code. Each parsed shapefile is cached
+#-- as a Feather file of WKB geometries and attributes next to its
+#-- source, and re-parsed only when the shapefile is newer than
+#-- its cache, so maps no longer pay shapefile parse costs.
+#--
+#-- Example:
+#--   areas = fao_areas(simplified=True)
+#--   ax.add_geometries(areas["27"], crs.PlateCarree(), ...)
+#--   ratios = attribute_lookup(fao_region, "fao_area", "ratio_auth_unknown_fishing")
+#-------------------------------------------------------------
+import os
+import glob
+from functools import lru_cache
+import pandas as pd
+import shapefile
+import shapely.wkb
+from shapely.geometry import shape
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(ROOT_DIR, "..", "..", "data")
+
+#
+# Source folders by kind and variant, with `{}` for the area/RFB code
+SOURCES = {
+    "fao": {
+        "": os.path.join("FAO_FISHERIES_AREA", "FSA_{}", "FSA_{}.shp"),
+        "simp": os.path.join("FAO_FISHERIES_AREA", "FSA_{}_simp", "FSA_{}.shp")},
+    "rfb": {
+        "": os.path.join("FAO_RFB", "FAO_RFB_{}", "RFB_{}.shp"),
+        "adjusted": os.path.join("FAO_RFB", "FAO_RFB_{}_adjusted", "RFB_{}.shp"),
+        "simplified": os.path.join("FAO_RFB", "FAO_RFB_{}_simplified", "RFB_{}.shp")}
+}
+
+
+def _encoding(shp_path):
+    """
+    Text encoding of a shapefile's attributes, from its .cpg or .cst file
+    """
+    for ext in (".cpg", ".cst"):
+        path = os.path.splitext(shp_path)[0] + ext
+        if os.path.exists(path):
+            with open(path) as f:
+                return f.read().strip() or "latin-1"
+    return "latin-1"
+
+
+def _cache_path(shp_path):
+    return os.path.splitext(shp_path)[0] + ".feather"
+
+
+def _parse_shapefile(shp_path):
+    """
+    Parse a shapefile into a DataFrame of its attributes and WKB geometries
+    """
+    with shapefile.Reader(shp_path, encoding=_encoding(shp_path)) as reader:
+        fields = [f[0] for f in reader.fields[1:]]
+        rows = [dict(zip(fields, sr.record), wkb=shape(sr.shape.__geo_interface__).wkb)
+                for sr in reader.iterShapeRecords() if sr.shape.points]
+    return pd.DataFrame(rows, columns=fields + ["wkb"])
+
+
+def read_shapefile(shp_path):
+    """
+    Read a shapefile through its Feather cache. The cache is rebuilt when any
+    of the shapefile's parts is newer than it.
+
+    :param shp_path: String, path to the .shp file
+    :return: DataFrame of attributes with a `geometry` column of Shapely geometries
+    """
+    cache = _cache_path(shp_path)
+    parts = glob.glob(os.path.splitext(shp_path)[0] + ".*")
+    source_mtime = max(os.path.getmtime(p) for p in parts if p != cache)
+
+    if os.path.exists(cache) and os.path.getmtime(cache) >= source_mtime:
+        df = pd.read_feather(cache)
+    else:
+        df = _parse_shapefile(shp_path)
+        #
+        # Attribute types differ between files; keep them as read except for
+        # mixed object columns, which Feather cannot store
+        for c in df.columns.drop("wkb"):
+            if df[c].dtype == object:
+                df[c] = df[c].astype(str)
+        df.to_feather(cache)
+
+    df["geometry"] = [shapely.wkb.loads(g) for g in df.pop("wkb")]
+    return df
+
+
+def source_files(kind, variant=""):
+    """
+    Shapefiles of a kind and variant keyed by area/RFB code
+
+    :param kind: String, fao or rfb
+    :param variant: String, "" or "simp" for fao, "", "adjusted" or "simplified" for rfb
+    :return: Dict of code to .shp path
+    """
+    if kind not in SOURCES or variant not in SOURCES[kind]:
+        raise ValueError(f"Unknown kind/variant: {kind}/{variant}. Options are {SOURCES}")
+
+    pattern = SOURCES[kind][variant]
+    prefix, suffix = pattern.split("{}", 1)[0], pattern.rsplit("{}", 1)[1]
+    files = {}
+    for path in sorted(glob.glob(os.path.join(DATA_DIR, pattern.format("*", "*")))):
+        rel = os.path.relpath(path, DATA_DIR)
+        code = rel[len(prefix):].split(os.sep)[0]
+        code = code[:-len(variant) - 1] if variant else code
+        if rel == pattern.format(code, code):
+            files[code] = path
+    return files
+
+
+@lru_cache(maxsize=None)
+def load_geometries(kind, variant=""):
+    """
+    Shapely geometries of a kind and variant keyed by area/RFB code.
+    Shapefiles without any geometry (e.g. an empty adjusted layer) are left out.
+
+    :param kind: String, fao or rfb
+    :param variant: String, see `source_files`
+    :return: Dict of code to a tuple of Shapely geometries (one per record)
+    """
+    geometries = {}
+    for code, path in source_files(kind, variant).items():
+        df = read_shapefile(path)
+        if len(df):
+            geometries[code] = tuple(df["geometry"])
+    return geometries
+
+
+@lru_cache(maxsize=None)
+def load_attributes(kind, variant=""):
+    """
+    Attributes of the first record of each shapefile keyed by area/RFB code
+
+    :param kind: String, fao or rfb
+    :param variant: String, see `source_files`
+    :return: Dict of code to a dict of attributes
+    """
+    attributes = {}
+    for code, path in source_files(kind, variant).items():
+        df = read_shapefile(path).drop(columns="geometry")
+        if len(df):
+            attributes[code] = df.iloc[0].to_dict()
+    return attributes
+
+
+def fao_areas(simplified=True):
+    """
+    FAO major fishing area geometries keyed by area code (e.g. "27")
+
+    :param simplified: Boolean, use the simplified polygons made for mapping
+    :return: Dict of code to a tuple of Shapely geometries
+    """
+    return load_geometries("fao", "simp" if simplified else "")
+
+
+def rfbs(variant="simplified"):
+    """
+    RFB (RFMO) geometries keyed by RFB code (e.g. "IATTC"). Not every RFB has
+    an adjusted or simplified variant.
+
+    :param variant: String, "", "adjusted" or "simplified"
+    :return: Dict of code to a tuple of Shapely geometries
+    """
+    return load_geometries("rfb", variant)
+
+
+def attribute_lookup(df, key, value):
+    """
+    Dictionary of key to value for joining DataFrame attributes to geometries,
+    instead of filtering the DataFrame once per polygon
+
+    :param df: DataFrame
+    :param key: String, column holding the area/RFB code
+    :param value: String, column to look up
+    :return: Dict of code to value
+    """
+    return dict(zip(df[key].astype(str), df[value]))
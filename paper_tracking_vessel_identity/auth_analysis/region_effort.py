@@ -0,0 +1,173 @@
+#-------------------------------------------------------------
+#-- Fishing effort by region from label rasters
+#-- This module aggregates one binned fishing effort grid (the
+#-- bands of `effort_pyramid.py`) by FAO
+#-- area, RFMO and EEZ in a single weighted `np.bincount` pass,
+#-- using the FAO/RFB label grids of `region_labels.py` and an EEZ
+#-- label raster made once from the `regions` table. It replaces
+#-- re-binning effort and re-joining the regions table in each of
+#-- `identify_authorized_fishing_by_{fao_area,rfmo,eez}.sql`.
+#--
+#-- As in those queries, FAO area and RFMO totals are restricted
+#-- to the high seas (plus the Mediterranean, FAO area 37). The
+#-- authorization ratio is taken over the authorization bands of the
+#-- pyramid, which cover the high seas only (as
+#-- `authorization_known_vs_unknown.sql`), so it leaves out the part
+#-- of FAO area 37 outside the high seas.
+#--
+#-- Example:
+#--   totals = region_totals("20220701")
+#--   fao_region = totals["fao"]  # fao_area, ..., ratio_auth_unknown_fishing
+#-------------------------------------------------------------
+import os
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from effort_pyramid import PROJECT, BANDS, read_window
+from region_labels import LABELS_DIR, region_grid
+
+REGIONS = "vessel_identity_staging.regions"
+EEZ_INFO = "gfw_research.eez_info"
+HIGH_SEAS = "highseas"
+HIGH_SEAS_EXCEPTIONS = ["37"]
+
+
+@lru_cache(maxsize=None)
+def load_eez_labels(xyscale):
+    """
+    EEZ label raster: for each cell, the EEZ (or "highseas") covering most of
+    its 100th degree gridcodes in the regions table. EEZs are the ISO3 codes
+    of the 200NM EEZs in the EEZ info table, the codes `regions.sql` puts in
+    the table (its other labels, such as RFMOs, are ignored). Read from the
+    local cache if present, otherwise from BigQuery (and cached).
+
+    :param xyscale: Integer, number of cells per degree
+    :return: Tuple of a list of EEZ codes and a numpy int16 grid of their
+             indices (-1 where the table has no gridcode), origin upper
+    """
+    path = os.path.join(LABELS_DIR, f"eez_iso3_{xyscale}.npz")
+    if os.path.exists(path):
+        with np.load(path) as f:
+            return f["codes"].tolist(), f["labels"]
+
+    q = f"""
+    WITH
+      cells AS (
+        SELECT
+          FLOOR (CAST (REGEXP_EXTRACT (gridcode, r"lat:([-+0-9.]+)") AS FLOAT64) * {xyscale}) AS lat_bin,
+          FLOOR (CAST (REGEXP_EXTRACT (gridcode, r"lon:([-+0-9.]+)") AS FLOAT64) * {xyscale}) AS lon_bin,
+          eez
+        FROM `{REGIONS}`
+        CROSS JOIN UNNEST (region) AS eez
+        WHERE eez = "{HIGH_SEAS}"
+        OR eez IN (
+          SELECT territory1_iso3
+          FROM `{EEZ_INFO}`
+          WHERE eez_type = "200NM" )
+      )
+
+    SELECT lat_bin, lon_bin, eez
+    FROM cells
+    GROUP BY 1,2,3
+    QUALIFY ROW_NUMBER () OVER (PARTITION BY lat_bin, lon_bin ORDER BY COUNT (*) DESC, eez) = 1
+    """
+    df = pd.read_gbq(q, project_id=PROJECT, dialect='standard')
+
+    ny, nx = 180 * xyscale, 360 * xyscale
+    codes, index = np.unique(df["eez"].to_numpy(dtype=str), return_inverse=True)
+    labels = np.full((ny, nx), -1, dtype=np.int16)
+    row = np.clip(ny - 1 - (df["lat_bin"].to_numpy(np.int64) + 90 * xyscale), 0, ny - 1)
+    col = (df["lon_bin"].to_numpy(np.int64) + 180 * xyscale) % nx
+    labels[row, col] = index
+
+    os.makedirs(LABELS_DIR, exist_ok=True)
+    np.savez_compressed(path, codes=codes, labels=labels)
+    return codes.tolist(), labels
+
+
+def aggregate_regions(bands, xyscale, grid, eez=None, high_seas_only=True):
+    """
+    Fishing hours and ratios by FAO area, RFMO and EEZ of a global effort grid.
+    Cells are labelled by their center; all region kinds and bands are summed
+    in one `np.bincount` over (region key, band).
+
+    :param bands: Dict of band (see `effort_pyramid.BANDS`) to a global grid
+                  of fishing hours at `xyscale`, origin upper
+    :param xyscale: Integer, number of cells per degree
+    :param grid: RegionGrid of FAO areas and RFBs
+    :param eez: Tuple of EEZ codes and label grid at `xyscale`, see `load_eez_labels`
+    :param high_seas_only: Boolean, keep only the high seas (and HIGH_SEAS_EXCEPTIONS)
+                           for FAO areas and RFMOs; needs `eez`
+    :return: Dict of fao, rfmo and eez to a DataFrame of totals and ratios
+    """
+    ny, nx = bands["all"].shape
+    cells = np.flatnonzero(bands["all"].ravel() > 0)
+    weights = np.stack([bands[b].ravel()[cells] for b in BANDS], axis=1)
+
+    row, col = np.divmod(cells, nx)
+    fao, rfb = grid.tag(90 - (row + 0.5) / xyscale, (col + 0.5) / xyscale - 180)
+
+    if eez is not None:
+        eez_codes, eez_labels = eez
+        eez_index = eez_labels.ravel()[cells]
+    else:
+        eez_codes, eez_index = [], np.full(len(cells), -1)
+
+    if high_seas_only:
+        if eez is None:
+            raise ValueError("EEZ labels are needed to restrict to the high seas")
+        in_scope = eez_index == eez_codes.index(HIGH_SEAS) if HIGH_SEAS in eez_codes \
+            else np.zeros(len(cells), dtype=bool)
+        exceptions = [grid.fao_codes.index(c) for c in HIGH_SEAS_EXCEPTIONS if c in grid.fao_codes]
+        fao_scope = in_scope | np.isin(fao, exceptions)
+    else:
+        in_scope = fao_scope = np.ones(len(cells), dtype=bool)
+
+    #
+    # (cell, region key) pairs of each region kind, with keys offset by kind
+    n_fao, n_rfb = len(grid.fao_codes), len(grid.rfb_codes)
+    f = np.flatnonzero((fao >= 0) & fao_scope)
+    r_cell, r_key = np.nonzero(
+        (rfb[:, None] & (np.uint32(1) << np.arange(n_rfb, dtype=np.uint32))) != 0)
+    keep = in_scope[r_cell]
+    e = np.flatnonzero(eez_index >= 0)
+
+    pair_cell = np.concatenate([f, r_cell[keep], e])
+    pair_key = np.concatenate([fao[f], n_fao + r_key[keep], n_fao + n_rfb + eez_index[e]])
+
+    nb = len(BANDS)
+    idx = (pair_key[:, None] * nb + np.arange(nb)).ravel()
+    sums = np.bincount(idx, weights=weights[pair_cell].ravel(),
+                       minlength=(n_fao + n_rfb + len(eez_codes)) * nb).reshape(-1, nb)
+
+    out = {}
+    for kind, column, codes, offset in [("fao", "fao_area", grid.fao_codes, 0),
+                                        ("rfmo", "rfmo", grid.rfb_codes, n_fao),
+                                        ("eez", "eez", eez_codes, n_fao + n_rfb)]:
+        s = sums[offset:offset + len(codes)]
+        df = pd.DataFrame(s, columns=[f"fishing_hours_{b}" for b in BANDS])
+        df = df.rename(columns={"fishing_hours_all": "fishing_hours_total"})
+        df.insert(0, column, codes)
+        df = df[df["fishing_hours_total"] > 0].reset_index(drop=True)
+        df["ratio_auth_unknown_fishing"] = \
+            df["fishing_hours_auth_unknown"] / df["fishing_hours_all_high_seas"]
+        df["ratio_unknown_fishing"] = df["fishing_hours_unknown"] / df["fishing_hours_total"]
+        out[kind] = df
+    return out
+
+
+def region_totals(YYYYMMDD, xyscale=5, fao_variant="", rfb_variant="adjusted", high_seas_only=True):
+    """
+    Fishing hours and ratios by FAO area, RFMO and EEZ from the local effort
+    pyramid of a version
+
+    :param YYYYMMDD: vessel identity data version
+    :param xyscale: Integer, pyramid level (cells per degree) to aggregate
+    :param fao_variant: String, "" or "simp"
+    :param rfb_variant: String, "", "adjusted" or "simplified"
+    :param high_seas_only: Boolean, see `aggregate_regions`
+    :return: Dict of fao, rfmo and eez to a DataFrame of totals and ratios
+    """
+    bands, _, _ = read_window(YYYYMMDD, xyscale)
+    return aggregate_regions(bands, xyscale, region_grid(xyscale, fao_variant, rfb_variant),
+                             load_eez_labels(xyscale), high_seas_only)
@@ -0,0 +1,235 @@
+#-------------------------------------------------------------
+#-- Grid cell to region assignment
+#-- This module rasterizes the bundled FAO major fishing area and
+#-- FAO RFB polygons (see `geometry_store.py`) into label grids at
+#-- a chosen resolution: one FAO area label per cell and one RFB
+#-- membership bit per RFB, since RFMO areas overlap. Cells crossed
+#-- by a polygon boundary are flagged, and only points falling in
+#-- those cells are resolved exactly with an STRtree
+#-- point-in-polygon test. Tagging (lat, lon) arrays is otherwise
+#-- an array index, so region aggregation runs locally instead of
+#-- through the `regions` table and its gridcode join.
+#--
+#-- Example:
+#--   grid = region_grid(10, fao_variant="", rfb_variant="adjusted")
+#--   df["fao_area"] = grid.fao_area(df["lat"], df["lon"])
+#--   rfmo = grid.rfb_membership(df["lat"], df["lon"])
+#-------------------------------------------------------------
+import os
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import shapely
+from geometry_store import DATA_DIR, load_geometries, source_files
+
+LABELS_DIR = os.path.join(DATA_DIR, "region_labels")
+
+
+def _cells(xyscale):
+    return 180 * xyscale, 360 * xyscale
+
+
+def _rasterize(geometry, xyscale):
+    """
+    Interior cells (by cell center) and boundary cells of a geometry
+
+    :return: Tuple of flat indices of interior cells and of boundary cells
+    """
+    ny, nx = _cells(xyscale)
+    lon0, lat0, lon1, lat1 = geometry.bounds
+    c0, c1 = max(int(np.floor((lon0 + 180) * xyscale)), 0), min(int(np.ceil((lon1 + 180) * xyscale)), nx)
+    r0, r1 = max(int(np.floor((90 - lat1) * xyscale)), 0), min(int(np.ceil((90 - lat0) * xyscale)), ny)
+
+    rows, cols = np.mgrid[r0:r1, c0:c1]
+    inside = shapely.contains_xy(geometry, (cols + 0.5) / xyscale - 180, 90 - (rows + 0.5) / xyscale)
+    interior = (rows[inside] * nx + cols[inside]).astype(np.int64)
+
+    #
+    # A boundary segmentized to half a cell has a vertex in or next to every
+    # cell it crosses, so the vertex cells and their neighbours cover them all
+    coords = shapely.get_coordinates(shapely.segmentize(geometry.boundary, 0.5 / xyscale))
+    row = np.clip(np.floor((90 - coords[:, 1]) * xyscale).astype(np.int64), 0, ny - 1)
+    col = np.clip(np.floor((coords[:, 0] + 180) * xyscale).astype(np.int64), 0, nx - 1)
+    boundary = [np.clip(row + dr, 0, ny - 1) * nx + (col + dc) % nx
+                for dr in (-1, 0, 1) for dc in (-1, 0, 1)]
+    return interior, np.unique(np.concatenate(boundary))
+
+
+def _layers(fao_variant, rfb_variant):
+    """
+    FAO area and RFB geometries of the chosen variants. RFBs without the
+    variant (or with an empty one) fall back to their full layer.
+    """
+    fao = load_geometries("fao", fao_variant)
+    rfb = dict(load_geometries("rfb", ""))
+    if rfb_variant:
+        rfb.update(load_geometries("rfb", rfb_variant))
+    return fao, dict(sorted(rfb.items()))
+
+
+class RegionGrid:
+    """
+    FAO area labels and RFB membership bits on a global grid, origin upper.
+    `fao` holds the index of the FAO area code (-1 outside all areas) and
+    `rfb` a bit per RFB code; `boundary` marks cells resolved exactly.
+    """
+
+    def __init__(self, xyscale, fao_codes, rfb_codes, fao, rfb, boundary, geometries):
+        """
+        :param xyscale: Integer, number of cells per degree
+        :param fao_codes: List of FAO area codes
+        :param rfb_codes: List of RFB codes
+        :param fao: numpy int16 grid of FAO area indices
+        :param rfb: numpy uint32 grid of RFB membership bits
+        :param boundary: numpy bool grid of cells crossed by a boundary
+        :param geometries: Tuple of (kind, index, geometry) for the exact test
+        """
+        self.xyscale = xyscale
+        self.fao_codes = list(fao_codes)
+        self.rfb_codes = list(rfb_codes)
+        self.fao = fao
+        self.rfb = rfb
+        self.boundary = boundary
+        self._kind = np.array([g[0] for g in geometries])
+        self._index = np.array([g[1] for g in geometries], dtype=np.int64)
+        self._geometries = [g[2] for g in geometries]
+        self._tree = shapely.STRtree(self._geometries)
+        shapely.prepare(self._geometries)
+
+    @classmethod
+    def build(cls, xyscale, fao_variant="", rfb_variant=""):
+        """
+        Rasterize the FAO area and RFB polygons
+
+        :param xyscale: Integer, number of cells per degree
+        :param fao_variant: String, "" or "simp"
+        :param rfb_variant: String, "", "adjusted" or "simplified"
+        :return: RegionGrid
+        """
+        fao_layer, rfb_layer = _layers(fao_variant, rfb_variant)
+        if len(rfb_layer) > 32:
+            raise ValueError("At most 32 RFBs fit in the membership bits")
+
+        ny, nx = _cells(xyscale)
+        fao = np.full(ny * nx, -1, dtype=np.int16)
+        rfb = np.zeros(ny * nx, dtype=np.uint32)
+        boundary = np.zeros(ny * nx, dtype=bool)
+        geometries = []
+
+        for i, (code, geoms) in enumerate(fao_layer.items()):
+            for g in geoms:
+                interior, edge = _rasterize(g, xyscale)
+                fao[interior] = i
+                boundary[edge] = True
+                geometries.append(("fao", i, g))
+
+        for i, (code, geoms) in enumerate(rfb_layer.items()):
+            for g in geoms:
+                interior, edge = _rasterize(g, xyscale)
+                rfb[interior] |= np.uint32(1 << i)
+                boundary[edge] = True
+                geometries.append(("rfb", i, g))
+
+        return cls(xyscale, fao_layer, rfb_layer, fao.reshape(ny, nx), rfb.reshape(ny, nx),
+                   boundary.reshape(ny, nx), geometries)
+
+    def tag(self, lat, lon):
+        """
+        FAO area index and RFB membership bits of each point
+
+        :param lat: Array-like of latitudes
+        :param lon: Array-like of longitudes
+        :return: Tuple of numpy arrays (FAO area index, RFB bits)
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        ny, nx = self.fao.shape
+        row = np.clip(np.floor((90 - lat) * self.xyscale).astype(np.int64), 0, ny - 1)
+        col = np.floor((lon + 180) * self.xyscale).astype(np.int64) % nx
+
+        fao = self.fao[row, col]
+        rfb = self.rfb[row, col]
+
+        #
+        # Points in boundary cells are tested against the polygons themselves:
+        # STRtree bounding box candidates, then one prepared test per polygon
+        exact = np.flatnonzero(self.boundary[row, col])
+        if len(exact):
+            fao[exact], rfb[exact] = -1, 0
+            point, geom = self._tree.query(shapely.points(lon[exact], lat[exact]))
+            point = exact[point]
+            for g in np.unique(geom):
+                candidates = point[geom == g]
+                hit = candidates[shapely.intersects_xy(
+                    self._geometries[g], lon[candidates], lat[candidates])]
+                if self._kind[g] == "fao":
+                    fao[hit] = self._index[g]
+                else:
+                    rfb[hit] |= np.uint32(1 << int(self._index[g]))
+        return fao, rfb
+
+    def fao_area(self, lat, lon):
+        """
+        FAO major fishing area code of each point (None outside all areas)
+
+        :return: numpy object array of codes
+        """
+        fao, _ = self.tag(lat, lon)
+        codes = np.array(self.fao_codes + [None], dtype=object)
+        return codes[fao]
+
+    def rfb_membership(self, lat, lon):
+        """
+        Whether each point lies in each RFB area
+
+        :return: DataFrame of booleans with one column per RFB code
+        """
+        _, rfb = self.tag(lat, lon)
+        bits = np.uint32(1) << np.arange(len(self.rfb_codes), dtype=np.uint32)
+        return pd.DataFrame((rfb[:, None] & bits) != 0, columns=self.rfb_codes)
+
+    def save(self, path):
+        """
+        Store the label grids (the geometries are reloaded from the store)
+
+        :param path: String, path of the .npz file
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez_compressed(path, fao=self.fao, rfb=self.rfb, boundary=self.boundary,
+                            fao_codes=np.array(self.fao_codes), rfb_codes=np.array(self.rfb_codes))
+
+
+def _source_mtime(fao_variant, rfb_variant):
+    """
+    Latest modification time of the shapefiles a grid is built from
+    """
+    paths = list(source_files("fao", fao_variant).values()) + list(source_files("rfb", "").values())
+    if rfb_variant:
+        paths += list(source_files("rfb", rfb_variant).values())
+    return max(os.path.getmtime(p) for p in paths)
+
+
+@lru_cache(maxsize=None)
+def region_grid(xyscale, fao_variant="", rfb_variant=""):
+    """
+    Region label grid at a resolution, from the local cache if it is newer
+    than the shapefiles, otherwise rasterized (and cached)
+
+    :param xyscale: Integer, number of cells per degree
+    :param fao_variant: String, "" or "simp"
+    :param rfb_variant: String, "", "adjusted" or "simplified"
+    :return: RegionGrid
+    """
+    name = f"fao{fao_variant or '_full'}_rfb{rfb_variant or '_full'}_{xyscale}.npz"
+    path = os.path.join(LABELS_DIR, name)
+    if os.path.exists(path) and os.path.getmtime(path) >= _source_mtime(fao_variant, rfb_variant):
+        fao_layer, rfb_layer = _layers(fao_variant, rfb_variant)
+        geometries = [("fao", i, g) for i, geoms in enumerate(fao_layer.values()) for g in geoms] + \
+                     [("rfb", i, g) for i, geoms in enumerate(rfb_layer.values()) for g in geoms]
+        with np.load(path) as f:
+            return RegionGrid(xyscale, f["fao_codes"].tolist(), f["rfb_codes"].tolist(),
+                              f["fao"], f["rfb"], f["boundary"], geometries)
+
+    grid = RegionGrid.build(xyscale, fao_variant, rfb_variant)
+    grid.save(path)
+    return grid
@@ -16,6 +16,7 @@ import pandas as pd
 from subprocess import check_output
 import json
 from config import PROJECT, VESSEL_DATABASE, DATASET, STAGING, VESSEL_INFO, SINGLE_MMSI_MATCHED_VESSELS
+from uvi_normalizer import write_sql
 
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -102,6 +103,10 @@ def run_queries (YYYYMMDD):
     :return: None
     """
 
+    #
+    # Regenerate the list_uvi normalizing function included by the list_uvi query
+    write_sql()
+
     #
     # Read all SQL file names in the directory
     sqlfiles = [
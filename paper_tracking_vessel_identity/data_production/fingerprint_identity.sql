@@ -0,0 +1,12 @@
+-------------------------------------------------------------------------------
+-- Canonical 64-bit key of an identity (ssvid, n_shipname, n_callsign, imo, flag),
+-- `identity_key` of the identity tables. NULL fields are kept as JSON null, so
+-- they neither collide with each other nor need to be replaced with "NULL"
+-- strings before joining.
+-- Single definition, included by every template that produces or joins on
+-- identity_key, here and in the analysis queries.
+-------------------------------------------------------------------------------
+CREATE TEMP FUNCTION fingerprint_identity (
+    ssvid STRING, n_shipname STRING, n_callsign STRING, imo STRING, flag STRING) AS (
+  FARM_FINGERPRINT (TO_JSON_STRING ([ssvid, n_shipname, n_callsign, imo, flag]))
+);
@@ -0,0 +1,198 @@
+#-------------------------------------------------------------
+#-- Point-in-time identity resolution
+#-- Answers "which identity did MMSI X have at time T?" for arrays
+#-- of (ssvid, timestamp) pairs, e.g. daily fishing effort rows,
+#-- without a range join. Identity time ranges are kept as sorted
+#-- interval arrays per ssvid and looked up with a single vectorized
+#-- `searchsorted`.
+#--
+#-- Example:
+#--   store = IdentityStore.from_snapshot("20220701")
+#--   resolver = IdentityResolver(store, by_date=True)
+#--   rows, n_matches = resolver.resolve(effort.mmsi, effort.date)
+#--   effort[["flag", "vessel_record_id"]] = resolver.attributes(rows, ["flag", "vessel_record_id"])
+#-------------------------------------------------------------
+import numpy as np
+import pandas as pd
+from identity_store import IdentityStore, NAT
+
+DAY_US = 24 * 3600 * 10**6
+
+
+def to_epoch_us(values):
+    """
+    Convert timestamps or dates to int64 epoch microseconds (UTC)
+
+    :param values: Array-like of datetimes, dates or date strings
+    :return: numpy int64 array, NAT where missing
+    """
+    ts = pd.to_datetime(pd.Series(values), utc=True)
+    out = ts.dt.tz_convert(None).to_numpy().astype("datetime64[us]").astype(np.int64)
+    out[ts.isna().to_numpy()] = NAT
+    return out
+
+
+class IdentityResolver:
+    """
+    Interval index of identity time ranges per ssvid.
+
+    Rows of the identity store are sorted by (ssvid, first_timestamp) and a
+    composite integer key is built from the ssvid code and the rank of
+    first_timestamp, so that the last identity starting at or before T for a
+    given ssvid is found with one `searchsorted` over all queries at once.
+
+    Identities of the same ssvid with overlapping time ranges are handled
+    explicitly: the number of identities covering each query is returned and
+    `overlap` decides which one is reported.
+    """
+
+    def __init__(self, store, by_date=False):
+        """
+        :param store: IdentityStore (or DataFrame) of the identity core table
+        :param by_date: Boolean, widen time ranges to whole days as the SQL
+            `date BETWEEN DATE(first_timestamp) AND DATE(last_timestamp)` joins do
+        """
+        if isinstance(store, pd.DataFrame):
+            store = IdentityStore.from_dataframe(store)
+        self.store = store
+
+        first = store["first_timestamp"].copy()
+        last = store["last_timestamp"].copy()
+        if by_date:
+            first = np.where(first == NAT, NAT, first - first % DAY_US)
+            last = np.where(last == NAT, NAT, last - last % DAY_US + DAY_US - 1)
+
+        #
+        # Identities without a valid ssvid or time range can never match
+        ssvid = store["ssvid"]
+        valid = (ssvid.codes >= 0) & (first != NAT) & (last != NAT)
+        rows = np.flatnonzero(valid)
+        order = np.lexsort((first[rows], ssvid.codes[rows]))
+        self.rows = rows[order]
+        self.ssvid_categories = ssvid.categories
+        self.code = ssvid.codes[self.rows].astype(np.int64)
+        self.first = first[self.rows]
+        self.last = last[self.rows]
+
+        #
+        # Composite sort key: ssvid code, then rank of first_timestamp
+        self.starts = np.unique(self.first)
+        self.stride = len(self.starts) + 1
+        self.key = self.code * self.stride + np.searchsorted(self.starts, self.first, side="right")
+
+        #
+        # Running maximum of last_timestamp within each ssvid: if it is before T
+        # no identity starting earlier can cover T either
+        group_start = np.r_[True, self.code[1:] != self.code[:-1]] if len(self.code) else np.array([], bool)
+        self.group_first = np.maximum.accumulate(np.where(group_start, np.arange(len(self.code)), 0)) \
+            if len(self.code) else np.array([], np.int64)
+        self.running_last = self._group_cummax(self.last, group_start)
+
+        #
+        # An identity overlaps if it starts before an earlier identity of the same ssvid ended
+        prev_running = np.r_[NAT, self.running_last[:-1]] if len(self.code) else self.running_last
+        self.overlapping = ~group_start & (self.first <= prev_running)
+        self.has_overlap = np.zeros(len(self.ssvid_categories), bool)
+        self.has_overlap[self.code[self.overlapping]] = True
+
+    @staticmethod
+    def _group_cummax(values, group_start):
+        """
+        Cumulative maximum of `values` restarting at every group start
+        """
+        group_id = np.cumsum(group_start)
+        return pd.Series(values).groupby(group_id).cummax().to_numpy()
+
+    def _codes(self, ssvid):
+        """
+        Map query ssvids to the ssvid codes of the store (-1 if unknown)
+        """
+        q_codes, uniques = pd.factorize(pd.Series(ssvid).astype(str))
+        mapped = self.ssvid_categories.get_indexer(uniques)
+        return np.where(q_codes >= 0, mapped[q_codes], -1).astype(np.int64)
+
+    def resolve(self, ssvid, timestamp, overlap="latest"):
+        """
+        Find the identity each (ssvid, timestamp) pair belonged to.
+
+        :param ssvid: Array-like of MMSI numbers (as in identity core `ssvid`)
+        :param timestamp: Array-like of timestamps or dates, same length as `ssvid`
+        :param overlap: How to report a query covered by several identities of the same ssvid:
+            "latest" reports the one that started last, "drop" reports no identity
+        :return: Tuple of (row positions in the store, -1 if unresolved;
+            number of identities covering each query)
+        """
+        if overlap not in ("latest", "drop"):
+            raise ValueError('overlap must be either "latest" or "drop"')
+
+        q_code = self._codes(ssvid)
+        q_ts = to_epoch_us(timestamp)
+        n = len(q_code)
+        result = np.full(n, -1, np.int64)
+        n_matches = np.zeros(n, np.int64)
+
+        known = (q_code >= 0) & (q_ts != NAT)
+        if len(self.key) == 0 or not known.any():
+            return result, n_matches
+
+        #
+        # Last identity of the same ssvid that started at or before T
+        q_key = q_code * self.stride + np.searchsorted(self.starts, q_ts, side="right")
+        pos = np.searchsorted(self.key, q_key, side="right") - 1
+        pos_clipped = np.maximum(pos, 0)
+        candidate = known & (pos >= 0) & (self.code[pos_clipped] == q_code)
+
+        #
+        # Fast path for ssvids without overlapping identities: at most one can cover T
+        simple = candidate & ~self.has_overlap[np.maximum(q_code, 0)]
+        hit = simple & (self.last[pos_clipped] >= q_ts)
+        result[hit] = pos_clipped[hit]
+        n_matches[hit] = 1
+
+        #
+        # Overlapping ssvids: walk back through earlier identities of the same ssvid
+        # while some of them may still cover T (running max of last_timestamp >= T)
+        idx = np.flatnonzero(candidate & ~simple)
+        cur = pos_clipped[idx]
+        t = q_ts[idx]
+        while len(idx):
+            covers = self.last[cur] >= t
+            first_cover = covers & (result[idx] < 0)
+            result[idx[first_cover]] = cur[first_cover]
+            n_matches[idx[covers]] += 1
+
+            more = (cur > self.group_first[cur]) & (self.running_last[np.maximum(cur - 1, 0)] >= t)
+            idx, cur, t = idx[more], cur[more] - 1, t[more]
+
+        if overlap == "drop":
+            result[n_matches > 1] = -1
+
+        #
+        # Translate sorted positions back to row positions in the store
+        found = result >= 0
+        result[found] = self.rows[result[found]]
+        return result, n_matches
+
+    def attributes(self, rows, columns):
+        """
+        Gather identity fields for resolved rows
+
+        :param rows: Row positions returned by `resolve`
+        :param columns: List of store columns, e.g. ["vessel_record_id", "flag"]
+        :return: DataFrame aligned with the queries, missing where unresolved
+        """
+        rows = np.asarray(rows)
+        found = rows >= 0
+        safe = np.where(found, rows, 0)
+        data = {}
+        for c in columns:
+            v = self.store[c]
+            if isinstance(v, pd.Categorical):
+                codes = np.where(found, v.codes[safe], -1)
+                data[c] = pd.Categorical.from_codes(codes, categories=v.categories)
+            elif c in self.store.timestamp_columns:
+                values = np.where(found, v[safe], NAT)
+                data[c] = IdentityStore({c: values}, [c]).timestamps(c)
+            else:
+                data[c] = pd.Series(v[safe]).where(found).to_numpy()
+        return pd.DataFrame(data)
@@ -0,0 +1,155 @@
+#-------------------------------------------------------------
+#-- Export the published identity tables to local Parquet snapshots
+#-- This script downloads each identity table of a given version
+#-- (core, owner, authorization, ais_activity) once and stores it
+#-- as a partitioned Parquet dataset so that analysis notebooks
+#-- can read them locally with `load_identity()` instead of
+#-- pulling the whole tables from BigQuery every session.
+#--
+#-- Run the following command (with date version as YYYYMMDD):
+#-- `python identity_snapshot.py YYYYMMDD`
+#--
+#-- Destination folder:
+#-- `data/identity_snapshot/v{YYYYMMDD}/identity_{CAT}/`
+#-------------------------------------------------------------
+import sys
+import os
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from config import PROJECT, DATASET
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+SNAPSHOT_DIR = os.path.join(ROOT_DIR, "..", "..", "data", "identity_snapshot")
+
+#
+# Sort key and partition source column per table. The partition is
+# the year of the given timestamp column, and rows are sorted within
+# each partition so that row-group statistics on the sort key are tight.
+TABLES = {
+    "core": {"sort_by": ["vessel_record_id", "first_timestamp"],
+             "partition_by": "first_timestamp"},
+    "owner": {"sort_by": ["vessel_record_id", "ssvid"],
+              "partition_by": None},
+    "authorization": {"sort_by": ["vessel_record_id", "ssvid", "source_code", "authorized_from"],
+                      "partition_by": "authorized_from"},
+    "ais_activity": {"sort_by": ["ssvid"],
+                     "partition_by": None},
+}
+
+ROW_GROUP_SIZE = 100000
+
+
+def snapshot_path(YYYYMMDD, cat="core"):
+    """
+    Return the local folder of the Parquet snapshot for a given table
+
+    :param YYYYMMDD: vessel identity data version
+    :param cat: data table category (core, owner, authorization, ais_activity)
+    :return: String, path to the Parquet dataset
+    """
+    return os.path.join(SNAPSHOT_DIR, f"v{YYYYMMDD}", f"identity_{cat}")
+
+
+def export_table(cat, YYYYMMDD):
+    """
+    Download one identity table from BigQuery and write it as a Parquet dataset
+    partitioned by year (if the table has a partition column) and sorted by
+    `vessel_record_id`, with row-group statistics.
+
+    :param cat: data table category
+    :param YYYYMMDD: vessel identity data version
+    :return: None
+    """
+    q = f"""
+    SELECT *
+    FROM `{PROJECT}.{DATASET}.identity_{cat}_v{YYYYMMDD}`
+    """
+    df = pd.read_gbq(q, project_id=PROJECT, dialect='standard')
+
+    spec = TABLES[cat]
+    partition_cols = None
+    if spec["partition_by"] is not None:
+        #
+        # Rows without the timestamp are kept in their own partition
+        df["year"] = df[spec["partition_by"]].dt.year.fillna(0).astype("int32")
+        partition_cols = ["year"]
+        df = df.sort_values(["year"] + spec["sort_by"])
+    else:
+        df = df.sort_values(spec["sort_by"])
+
+    path = snapshot_path(YYYYMMDD, cat)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_to_dataset(
+        table, root_path=path, partition_cols=partition_cols,
+        row_group_size=ROW_GROUP_SIZE, write_statistics=True,
+        compression="snappy")
+
+    print(f"identity_{cat}_v{YYYYMMDD} exported to {path} ({len(df)} rows)")
+
+
+def load_identity(YYYYMMDD, cat="core", columns=None, filters=None):
+    """
+    Read an identity table from its local Parquet snapshot. Only the requested
+    columns are read (projection pushdown) and the filters are applied on
+    partitions and row-group statistics before decoding (predicate pushdown).
+
+    Example:
+        load_identity("20220701", columns=["vessel_record_id", "ssvid", "flag"],
+                      filters=[("year", ">=", 2018), ("flag", "=", "RUS")])
+
+    :param YYYYMMDD: vessel identity data version
+    :param cat: data table category (core, owner, authorization, ais_activity)
+    :param columns: List of columns to read, all columns if None
+    :param filters: Filters in pyarrow DNF format, e.g. [("flag", "in", ["RUS", "PAN"])]
+    :return: DataFrame
+    """
+    path = snapshot_path(YYYYMMDD, cat)
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"No local snapshot for identity_{cat}_v{YYYYMMDD}. "
+            f"Run `python identity_snapshot.py {YYYYMMDD}` first.")
+
+    table = pq.read_table(path, columns=columns, filters=filters)
+
+    #
+    # The year partition is a storage detail, drop it unless requested
+    if columns is None and "year" in table.column_names:
+        table = table.drop(["year"])
+
+    return table.to_pandas()
+
+
+def run_export(YYYYMMDD):
+    """
+    Export all published identity tables of a given version
+
+    :param YYYYMMDD: vessel identity data version
+    :return: None
+    """
+    for cat in TABLES.keys():
+        print(f"identity_{cat}_v{YYYYMMDD} is now being exported...")
+        export_table(cat, YYYYMMDD)
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) != 2:
+        print("Use example: python identity_snapshot.py YYYYMMDD")
+        raise ValueError('Version date is supposed to be passed as "YYYYMMDD"')
+
+    #
+    # Setting
+    YYYYMMDD = sys.argv[1]
+    if len(YYYYMMDD) != 8:
+        raise ValueError("Version date is supposed to be passed as YYYYMMDD")
+
+    #
+    # Run
+    run_export(YYYYMMDD)
+    print("\nAll tables exported.\n")
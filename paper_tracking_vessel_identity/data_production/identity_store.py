@@ -0,0 +1,247 @@
+#-------------------------------------------------------------
+#-- Compact in-memory store for the identity tables
+#-- Identity core loaded as plain pandas keeps every string field
+#-- (ssvid, names, call signs, flags, long "|"-joined vessel_record_id)
+#-- as Python objects. This store keeps them dictionary-encoded,
+#-- timestamps as int64 epoch microseconds, and exposes integer
+#-- surrogate keys for vessel_record_id and the 5-field identity key
+#-- (ssvid, n_shipname, n_callsign, imo, flag).
+#--
+#-- Example:
+#--   store = IdentityStore.from_snapshot("20220701")
+#--   store.record_key, store.identity_key
+#--   table = store.to_arrow()
+#-------------------------------------------------------------
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from identity_snapshot import snapshot_path
+
+#
+# Fields kept dictionary-encoded whenever present in the table
+STRING_COLUMNS = [
+    "vessel_record_id", "ssvid", "shipname", "n_shipname", "n_callsign",
+    "imo", "flag", "geartype", "source_code", "owner", "owner_flag"]
+TIMESTAMP_COLUMNS = [
+    "first_timestamp", "last_timestamp", "authorized_from", "authorized_to"]
+IDENTITY_KEY_COLUMNS = ["ssvid", "n_shipname", "n_callsign", "imo", "flag"]
+
+#
+# Missing timestamps are stored with the same sentinel pandas uses for NaT
+NAT = np.iinfo(np.int64).min
+TIMESTAMP_TYPE = pa.timestamp("us", tz="UTC")
+
+
+class IdentityStore:
+    """
+    Columnar, dictionary-encoded identity table.
+
+    String fields are held as `pandas.Categorical` (int32 codes + unique values),
+    timestamps as int64 epoch microseconds, and all other fields as numpy arrays.
+    `record_key` and `identity_key` are dense int32 surrogate keys that can be
+    used for joins and group-bys instead of the original strings.
+    """
+
+    def __init__(self, columns, timestamp_columns=None):
+        """
+        :param columns: Dict of column name to Categorical / numpy array, all of the same length
+        :param timestamp_columns: List of int64 columns holding epoch microseconds,
+            defaults to the known timestamp fields present in `columns`
+        """
+        lengths = set(len(v) for v in columns.values())
+        if len(lengths) > 1:
+            raise ValueError("All columns must have the same length")
+
+        self.columns = dict(columns)
+        if timestamp_columns is None:
+            timestamp_columns = [c for c in TIMESTAMP_COLUMNS if c in self.columns]
+        self.timestamp_columns = list(timestamp_columns)
+        self._identity_key = None
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @property
+    def nbytes(self):
+        """
+        Approximate memory footprint of the store in bytes
+        """
+        total = 0
+        for v in self.columns.values():
+            if isinstance(v, pd.Categorical):
+                total += v.codes.nbytes + v.categories.memory_usage(deep=True)
+            else:
+                total += v.nbytes
+        return total
+
+    @property
+    def record_key(self):
+        """
+        int32 surrogate key of vessel_record_id (-1 where missing)
+        """
+        return self.columns["vessel_record_id"].codes.astype(np.int32)
+
+    @property
+    def identity_key(self):
+        """
+        int32 surrogate key of the 5-field identity (ssvid, n_shipname, n_callsign, imo, flag).
+        Missing values in any field are treated as a value on their own, the same way
+        the 64-bit `identity_key` of the identity tables does. If the table carries
+        `identity_key`, it is factorized directly instead of the five fields.
+        """
+        if self._identity_key is None and "identity_key" in self.columns:
+            codes, _ = pd.factorize(self.columns["identity_key"])
+            self._identity_key = codes.astype(np.int32)
+        elif self._identity_key is None:
+            codes = np.stack(
+                [self.columns[c].codes for c in IDENTITY_KEY_COLUMNS], axis=1)
+            _, inverse = np.unique(codes, axis=0, return_inverse=True)
+            self._identity_key = inverse.reshape(-1).astype(np.int32)
+        return self._identity_key
+
+    def timestamps(self, name):
+        """
+        Decode an int64 timestamp column to a pandas DatetimeIndex (UTC)
+
+        :param name: String, timestamp column name
+        :return: DatetimeIndex
+        """
+        values = self.columns[name]
+        missing = values == NAT
+        ts = pd.to_datetime(np.where(missing, 0, values), unit="us", utc=True)
+        return ts.where(~missing)
+
+    def take(self, indices):
+        """
+        Return a new store with the rows at the given positions (or boolean mask)
+
+        :param indices: Integer positions or boolean mask
+        :return: IdentityStore
+        """
+        return IdentityStore({k: v[indices] for k, v in self.columns.items()},
+                             self.timestamp_columns)
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """
+        Build a store from a DataFrame as returned by `pd.read_gbq` or `load_identity`
+
+        :param df: DataFrame of an identity table
+        :return: IdentityStore
+        """
+        columns = {}
+        timestamp_columns = []
+        for c in df.columns:
+            s = df[c]
+            if c in TIMESTAMP_COLUMNS or pd.api.types.is_datetime64_any_dtype(s):
+                ts = pd.to_datetime(s, utc=True)
+                values = ts.dt.tz_convert(None).to_numpy().astype("datetime64[us]").astype(np.int64)
+                values[ts.isna().to_numpy()] = NAT
+                columns[c] = values
+                timestamp_columns.append(c)
+            elif c in STRING_COLUMNS or s.dtype == object or isinstance(s.dtype, pd.CategoricalDtype):
+                columns[c] = pd.Categorical(s)
+            else:
+                columns[c] = s.to_numpy()
+        return cls(columns, timestamp_columns)
+
+    @classmethod
+    def from_arrow(cls, table):
+        """
+        Build a store from an Arrow table. Dictionary-encoded columns keep their
+        dictionary, and indices and timestamp buffers without nulls are used
+        without copying.
+
+        :param table: pyarrow.Table
+        :return: IdentityStore
+        """
+        table = table.unify_dictionaries().combine_chunks()
+        columns = {}
+        timestamp_columns = []
+        for name, col in zip(table.column_names, table.columns):
+            arr = col.chunk(0) if col.num_chunks else pa.array([], type=col.type)
+            if pa.types.is_timestamp(arr.type):
+                arr = arr.cast(pa.timestamp("us", tz=arr.type.tz)).view(pa.int64())
+                columns[name] = arr.fill_null(NAT).to_numpy() if arr.null_count \
+                    else arr.to_numpy(zero_copy_only=True)
+                timestamp_columns.append(name)
+            elif pa.types.is_string(arr.type) or pa.types.is_large_string(arr.type) \
+                    or pa.types.is_dictionary(arr.type):
+                if not pa.types.is_dictionary(arr.type):
+                    arr = arr.dictionary_encode()
+                indices = arr.indices.cast(pa.int32())
+                codes = indices.fill_null(-1).to_numpy() if indices.null_count \
+                    else indices.to_numpy(zero_copy_only=True)
+                columns[name] = pd.Categorical.from_codes(
+                    codes, categories=pd.Index(arr.dictionary.to_pylist(), dtype=object))
+            else:
+                columns[name] = arr.to_numpy(zero_copy_only=False)
+        return cls(columns, timestamp_columns)
+
+    @classmethod
+    def from_snapshot(cls, YYYYMMDD, cat="core", columns=None, filters=None):
+        """
+        Read a local Parquet snapshot (see identity_snapshot.py) directly into a store,
+        decoding the Parquet dictionary pages straight into Arrow dictionary arrays.
+
+        :param YYYYMMDD: vessel identity data version
+        :param cat: data table category (core, owner, authorization, ais_activity)
+        :param columns: List of columns to read, all columns if None
+        :param filters: Filters in pyarrow DNF format
+        :return: IdentityStore
+        """
+        path = snapshot_path(YYYYMMDD, cat)
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                f"No local snapshot for identity_{cat}_v{YYYYMMDD}. "
+                f"Run `python identity_snapshot.py {YYYYMMDD}` first.")
+
+        table = pq.read_table(path, columns=columns, filters=filters,
+                              read_dictionary=STRING_COLUMNS)
+        if columns is None and "year" in table.column_names:
+            table = table.drop(["year"])
+        return cls.from_arrow(table)
+
+    def to_arrow(self):
+        """
+        Convert the store to an Arrow table. Categorical codes become dictionary
+        indices and int64 timestamps become timestamp[us, UTC] views; only
+        validity bitmaps are built for columns with missing values.
+
+        :return: pyarrow.Table
+        """
+        arrays = []
+        for name, v in self.columns.items():
+            if isinstance(v, pd.Categorical):
+                codes = v.codes.astype(np.int32, copy=False)
+                missing = codes < 0
+                indices = pa.array(codes, mask=missing) if missing.any() else pa.array(codes)
+                arrays.append(pa.DictionaryArray.from_arrays(
+                    indices, pa.array(v.categories.to_numpy(dtype=object), type=pa.string())))
+            elif name in self.timestamp_columns:
+                missing = v == NAT
+                ints = pa.array(v, mask=missing) if missing.any() else pa.array(v)
+                arrays.append(ints.view(TIMESTAMP_TYPE))
+            else:
+                arrays.append(pa.array(v))
+        return pa.Table.from_arrays(arrays, names=list(self.columns.keys()))
+
+    def to_dataframe(self, decode_timestamps=True):
+        """
+        Convert the store to a DataFrame keeping string fields as categoricals
+
+        :param decode_timestamps: Boolean, convert int64 timestamps to datetimes
+        :return: DataFrame
+        """
+        data = {}
+        for name, v in self.columns.items():
+            if decode_timestamps and name in self.timestamp_columns:
+                data[name] = self.timestamps(name)
+            else:
+                data[name] = v
+        return pd.DataFrame(data)
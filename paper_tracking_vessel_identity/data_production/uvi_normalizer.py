@@ -0,0 +1,375 @@
+#-------------------------------------------------------------
+#-- Registry UVI normalizer
+#-- Turns each registry `list_uvi` (e.g. WCPFC2-1069312) into the
+#-- registry ID used to build vessel_record_id. The per-registry
+#-- treatments are kept as a table of rules (match prefix + steps),
+#-- from which both a memoized Python normalizer (local engine)
+#-- and the SQL function used by staging_identity_core_list_uvi
+#-- are generated, so adding a registry means adding a rule.
+#--
+#-- Run the following command to regenerate the SQL function:
+#-- `python uvi_normalizer.py`
+#-- Check both versions against the corpus of known UVIs:
+#-- `python uvi_normalizer.py check` (local)
+#-- `python uvi_normalizer.py check-sql` (BigQuery)
+#-------------------------------------------------------------
+import sys
+import os
+import re
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from config import PROJECT
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+SQL_FILE = os.path.join(ROOT_DIR, "uvi_normalizer.sql")
+CORPUS_FILE = os.path.join(ROOT_DIR, "uvi_normalizer_corpus.csv")
+
+UDFS = "`world-fishing-827`.udfs"
+
+#
+# Replacements cleaning SPRFMO country registration numbers (mostly Chinese
+# vessel numbers with province characters lost in encoding as "?")
+SPRFMO_REPLACEMENTS = [
+    (r"(BU)", ""),
+    (r"HAO", ""),
+    (r"\s+", ""),
+    (r"(.+\?)(\d+)(\?.+)", r"\1(\2)\3"),
+    (r"(.+\?)(JI)(\?.+)", r"\1(\2)\3"),
+    (r"(.+\?)(HU)(\?.+)", r"\1(\2)\3"),
+    (r"(.+\?)(LU)(\?.+)", r"\1(\2)\3"),
+    (r"(.+\?)(ZHE)(\?.+)", r"\1(\2)\3"),
+    (r"(.+\()(ZHE)(\?.+)", r"\1(\2)\3"),
+    (r"(.+\?)(LU)(\).+)", r"\1(\2)\3"),
+    (r"\?", r""),
+    (r"\(\(", r"("),
+    (r"\)\)", r")"),
+    (r"‐", "-"),
+    (r"-ESP-ESP", r"-EU-ESP"),
+    (r"-LTU-LTU", r"-EU-LTU"),
+]
+
+#
+# Rules applied in order; the first rule whose prefix matches is used and
+# the rule without prefixes applies to all other registries.
+# Steps:
+#   ("extract", name)        starting value, see EXTRACTORS
+#   ("split", sep, i, safe)  i-th part after splitting (NULL if missing and safe)
+#   ("replace", regex, rep)  regular expression replacement of all matches
+#   ("trim",)                strip leading/trailing whitespace
+#   ("prepend", text)        add a fixed prefix
+RULES = [
+    #
+    # IMO: ID includes "-" so simple SPLIT does not work
+    {"name": "IMO", "prefixes": ["IMO"],
+     "steps": [("extract", "regcode_id"),
+               ("split", "(", 0, False),
+               ("split", "/", 0, False)]},
+    #
+    # CRC: only include those that are assigned national IDs,
+    # otherwise, their IDs are simple name/callsign
+    {"name": "CRC", "prefixes": ["CRC"],
+     "steps": [("extract", "list_uvi"),
+               ("split", "NACIONALES/", 1, True),
+               ("prepend", "CRC-")]},
+    #
+    # TWN: some ID include characters like "-" or "(", so simple SPLIT does not work
+    {"name": "TWN", "prefixes": ["TWN-", "TWN2-"],
+     "steps": [("extract", "without_suffix"),
+               ("split", " (", 0, False),
+               ("replace", r"\s+", "")]},
+    #
+    # TWN3: TWN3 includes some other flagged vessels, so treat it differently from TWN
+    {"name": "TWN3", "prefixes": ["TWN3-"],
+     "steps": [("extract", "reg_uvi"),
+               ("split", " (", 0, False),
+               ("replace", r"\s+", "")]},
+    #
+    # SPRFMO: IMO based list_uvi to be excluded, otherwise it's country registration
+    {"name": "SPRFMO", "prefixes": ["SPRFMO-"],
+     "steps": [("extract", "reg_uvi")]
+              + [("replace", p, r) for p, r in SPRFMO_REPLACEMENTS]},
+    #
+    # SIOFA: country registration number
+    {"name": "SIOFA", "prefixes": ["SIOFA-"],
+     "steps": [("extract", "reg_uvi"),
+               ("replace", r"\s+", " "),
+               ("replace", "‐", "-")]},
+    #
+    # All others: Simply get the ID without suffix number (e.g. WCPFC2-1069312 -> WCPFC-1069312)
+    {"name": "DEFAULT", "prefixes": [],
+     "steps": [("extract", "without_suffix"),
+               ("split", "(", 0, False),
+               ("trim",),
+               ("replace", r"\s+", " ")]},
+]
+
+
+#
+# Python mirrors of the `world-fishing-827.udfs` functions used by the rules
+def extract_regcode_with_suffix(list_uvi):
+    return list_uvi.split("-")[0]
+
+
+def extract_regcode(list_uvi):
+    return re.sub(r"\d+$", "", extract_regcode_with_suffix(list_uvi), flags=re.ASCII)
+
+
+def extract_reg_uvi(list_uvi):
+    parts = list_uvi.split("-", 1)
+    return parts[1] if len(parts) > 1 else ""
+
+
+def extract_list_uvi_without_suffix(list_uvi):
+    return extract_regcode(list_uvi) + "-" + extract_reg_uvi(list_uvi)
+
+
+def _regcode_id(list_uvi):
+    parts = list_uvi.split("-")
+    if len(parts) < 2:
+        raise IndexError(f"list_uvi without registry number: {list_uvi}")
+    return extract_regcode(list_uvi) + "-" + parts[1]
+
+
+#
+# Starting value of each rule: (Python function, SQL template)
+EXTRACTORS = {
+    "list_uvi": (lambda u: u, "{x}"),
+    "reg_uvi": (extract_reg_uvi, UDFS + ".extract_reg_uvi ({x})"),
+    "without_suffix": (extract_list_uvi_without_suffix,
+                       UDFS + ".extract_list_uvi_without_suffix ({x})"),
+    "regcode_id": (_regcode_id,
+                   UDFS + '.extract_regcode ({x}) || "-" || SPLIT ({x}, "-")[OFFSET(1)]'),
+}
+
+
+def _compile_step(step):
+    """
+    Compile one rule step into a Python function of a string (or None)
+    """
+    op = step[0]
+    if op == "extract":
+        return EXTRACTORS[step[1]][0]
+    if op == "split":
+        _, sep, i, safe = step
+
+        def split(v):
+            parts = v.split(sep)
+            if i < len(parts):
+                return parts[i]
+            if safe:
+                return None
+            raise IndexError(f"Array index {i} is out of bounds for {v!r}")
+        return split
+    if op == "replace":
+        #
+        # ASCII classes (\s, \d) as in BigQuery's RE2
+        pattern = re.compile(step[1], re.ASCII)
+        repl = step[2]
+        return lambda v: pattern.sub(repl, v)
+    if op == "trim":
+        return str.strip
+    if op == "prepend":
+        text = step[1]
+        return lambda v: text + v
+    raise ValueError(f"Unknown rule step: {op}")
+
+
+def compile_rules(rules=RULES):
+    """
+    Compile the rule table into a single normalizing function. The regular
+    expressions are compiled once and each UVI goes through one prefix
+    dispatch and one pipeline of steps.
+
+    :param rules: List of rules (see RULES)
+    :return: Function of a list_uvi string returning the normalized UVI (or None)
+    """
+    dispatch = []
+    default = None
+    for rule in rules:
+        steps = [_compile_step(s) for s in rule["steps"]]
+        if rule["prefixes"]:
+            dispatch.append((tuple(rule["prefixes"]), steps))
+        else:
+            default = steps
+    if default is None:
+        raise ValueError("A rule without prefixes is required for all other registries")
+
+    def normalize(list_uvi):
+        steps = default
+        for prefixes, rule_steps in dispatch:
+            if list_uvi.startswith(prefixes):
+                steps = rule_steps
+                break
+        value = list_uvi
+        for step in steps:
+            if value is None:
+                return None
+            value = step(value)
+        return value
+
+    return normalize
+
+
+_normalize = compile_rules()
+
+
+@lru_cache(maxsize=2**18)
+def normalize_uvi(list_uvi):
+    """
+    Normalize one registry list_uvi (memoized)
+
+    :param list_uvi: String, e.g. "WCPFC2-1069312"
+    :return: String, e.g. "WCPFC-1069312", or None if the UVI has no usable ID
+    """
+    if list_uvi is None:
+        return None
+    return _normalize(list_uvi)
+
+
+def normalize_uvis(values):
+    """
+    Normalize an array of list_uvi, computing each distinct UVI only once
+
+    :param values: Array-like of strings
+    :return: numpy object array of normalized UVIs
+    """
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+    #
+    # Missing values get code -1, which picks the trailing None
+    normalized = np.array([normalize_uvi(u) for u in uniques] + [None], dtype=object)
+    return normalized[codes]
+
+
+def _sql_literal(text):
+    if '"' in text or text.endswith("\\"):
+        raise ValueError(f"Cannot render {text!r} as a SQL raw string")
+    return f'r"{text}"'
+
+
+def _sql_step(step, x):
+    """
+    Render one rule step as a SQL expression of `x`
+    """
+    op = step[0]
+    if op == "extract":
+        return EXTRACTORS[step[1]][1].format(x=x)
+    if op == "split":
+        _, sep, i, safe = step
+        return f'SPLIT ({x}, {_sql_literal(sep)})[{"SAFE_OFFSET" if safe else "OFFSET"}({i})]'
+    if op == "replace":
+        return f"REGEXP_REPLACE ({x}, {_sql_literal(step[1])}, {_sql_literal(step[2])})"
+    if op == "trim":
+        return f"TRIM ({x})"
+    if op == "prepend":
+        return f"{_sql_literal(step[1])} || {x}"
+    raise ValueError(f"Unknown rule step: {op}")
+
+
+def _sql_rule(rule):
+    x = "list_uvi"
+    for step in rule["steps"]:
+        x = _sql_step(step, x)
+    return x
+
+
+def to_sql(rules=RULES, name="normalize_list_uvi"):
+    """
+    Generate the SQL temporary function equivalent to `normalize_uvi`
+
+    :param rules: List of rules (see RULES)
+    :param name: String, SQL function name
+    :return: String, CREATE TEMP FUNCTION statement
+    """
+    lines = [
+        "-------------------------------------------------------------------------------",
+        "-- Normalize registry list_uvi to the registry ID used for vessel_record_id.",
+        "-- Generated by uvi_normalizer.py from its rule table, do not edit by hand.",
+        "-------------------------------------------------------------------------------",
+        f"CREATE TEMP FUNCTION {name} (list_uvi STRING) AS (",
+        "  CASE"]
+    default = None
+    for rule in rules:
+        if not rule["prefixes"]:
+            default = rule
+            continue
+        cond = " OR ".join(f'list_uvi LIKE "{p}%"' for p in rule["prefixes"])
+        lines += [f"    -- {rule['name']}",
+                  f"    WHEN {cond}",
+                  f"    THEN {_sql_rule(rule)}"]
+    lines += [f"    -- {default['name']}",
+              f"    ELSE {_sql_rule(default)}",
+              "  END",
+              ");"]
+    return "\n".join(lines) + "\n"
+
+
+def write_sql(path=SQL_FILE):
+    """
+    Write the generated SQL function included by staging_identity_core_list_uvi.sql.j2
+
+    :param path: String, destination file
+    :return: None
+    """
+    with open(path, "w") as f:
+        f.write(to_sql())
+
+
+def load_corpus(path=CORPUS_FILE):
+    """
+    Read the corpus of known list_uvi and their expected normalized values
+
+    :param path: String, corpus CSV with columns list_uvi, expected
+    :return: DataFrame
+    """
+    return pd.read_csv(path, dtype=str, keep_default_na=False).replace({"expected": {"": None}})
+
+
+def check_corpus(path=CORPUS_FILE):
+    """
+    Compare the Python normalizer with the corpus
+
+    :param path: String, corpus CSV
+    :return: DataFrame of mismatching rows (empty if all match)
+    """
+    corpus = load_corpus(path)
+    corpus["normalized"] = normalize_uvis(corpus["list_uvi"])
+    return corpus[corpus["normalized"].fillna("<NULL>") != corpus["expected"].fillna("<NULL>")]
+
+
+def check_corpus_sql(path=CORPUS_FILE):
+    """
+    Compare the generated SQL function, run on BigQuery, with the corpus
+
+    :param path: String, corpus CSV
+    :return: DataFrame of mismatching rows (empty if all match)
+    """
+    corpus = load_corpus(path)
+    uvis = ", ".join(_sql_literal(u) for u in corpus["list_uvi"])
+    q = f"""
+    {to_sql()}
+    SELECT list_uvi, normalize_list_uvi (list_uvi) AS normalized
+    FROM UNNEST ([{uvis}]) AS list_uvi
+    """
+    df = pd.read_gbq(q, project_id=PROJECT, dialect='standard')
+    corpus = corpus.merge(df, on="list_uvi", how="left")
+    return corpus[corpus["normalized"].fillna("<NULL>") != corpus["expected"].fillna("<NULL>")]
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 2 or (len(sys.argv) == 2 and sys.argv[1] not in ("check", "check-sql")):
+        print("Use example: python uvi_normalizer.py [check | check-sql]")
+        raise ValueError('The only accepted arguments are "check" and "check-sql"')
+
+    #
+    # Run
+    if len(sys.argv) == 1:
+        write_sql()
+        print(f"SQL function written to {SQL_FILE}")
+    else:
+        mismatches = check_corpus() if sys.argv[1] == "check" else check_corpus_sql()
+        if len(mismatches):
+            print(mismatches.to_string())
+            raise AssertionError(f"{len(mismatches)} list_uvi do not match the corpus")
+        print("All list_uvi in the corpus match.")
@@ -0,0 +1,28 @@
+-------------------------------------------------------------------------------
+-- Normalize registry list_uvi to the registry ID used for vessel_record_id.
+-- Generated by uvi_normalizer.py from its rule table, do not edit by hand.
+-------------------------------------------------------------------------------
+CREATE TEMP FUNCTION normalize_list_uvi (list_uvi STRING) AS (
+  CASE
+    -- IMO
+    WHEN list_uvi LIKE "IMO%"
+    THEN SPLIT (SPLIT (`world-fishing-827`.udfs.extract_regcode (list_uvi) || "-" || SPLIT (list_uvi, "-")[OFFSET(1)], r"(")[OFFSET(0)], r"/")[OFFSET(0)]
+    -- CRC
+    WHEN list_uvi LIKE "CRC%"
+    THEN r"CRC-" || SPLIT (list_uvi, r"NACIONALES/")[SAFE_OFFSET(1)]
+    -- TWN
+    WHEN list_uvi LIKE "TWN-%" OR list_uvi LIKE "TWN2-%"
+    THEN REGEXP_REPLACE (SPLIT (`world-fishing-827`.udfs.extract_list_uvi_without_suffix (list_uvi), r" (")[OFFSET(0)], r"\s+", r"")
+    -- TWN3
+    WHEN list_uvi LIKE "TWN3-%"
+    THEN REGEXP_REPLACE (SPLIT (`world-fishing-827`.udfs.extract_reg_uvi (list_uvi), r" (")[OFFSET(0)], r"\s+", r"")
+    -- SPRFMO
+    WHEN list_uvi LIKE "SPRFMO-%"
+    THEN REGEXP_REPLACE (REGEXP_REPLACE (REGEXP_REPLACE (REGEXP_REPLACE (REGEXP_REPLACE (REGEXP_REPLACE (REGEXP_REPLACE (REGEXP_REPLACE (REGEXP_REPLACE (REGEXP_REPLACE (REGEXP_REPLACE (REGEXP_REPLACE (REGEXP_REPLACE (REGEXP_REPLACE (REGEXP_REPLACE (REGEXP_REPLACE (`world-fishing-827`.udfs.extract_reg_uvi (list_uvi), r"(BU)", r""), r"HAO", r""), r"\s+", r""), r"(.+\?)(\d+)(\?.+)", r"\1(\2)\3"), r"(.+\?)(JI)(\?.+)", r"\1(\2)\3"), r"(.+\?)(HU)(\?.+)", r"\1(\2)\3"), r"(.+\?)(LU)(\?.+)", r"\1(\2)\3"), r"(.+\?)(ZHE)(\?.+)", r"\1(\2)\3"), r"(.+\()(ZHE)(\?.+)", r"\1(\2)\3"), r"(.+\?)(LU)(\).+)", r"\1(\2)\3"), r"\?", r""), r"\(\(", r"("), r"\)\)", r")"), r"‐", r"-"), r"-ESP-ESP", r"-EU-ESP"), r"-LTU-LTU", r"-EU-LTU")
+    -- SIOFA
+    WHEN list_uvi LIKE "SIOFA-%"
+    THEN REGEXP_REPLACE (REGEXP_REPLACE (`world-fishing-827`.udfs.extract_reg_uvi (list_uvi), r"\s+", r" "), r"‐", r"-")
+    -- DEFAULT
+    ELSE REGEXP_REPLACE (TRIM (SPLIT (`world-fishing-827`.udfs.extract_list_uvi_without_suffix (list_uvi), r"(")[OFFSET(0)]), r"\s+", r" ")
+  END
+);
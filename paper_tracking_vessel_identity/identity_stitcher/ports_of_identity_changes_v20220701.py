@@ -28,7 +28,9 @@ import pyseas.props
 import imp
 # import matplotlib.colors as colors
 from cartopy import crs
-from mpl_toolkits.axes_grid1.inset_locator import inset_axes
+import matplotlib.colors as mcolors
+from matplotlib.collections import PatchCollection
+from matplotlib.patches import Wedge
 
 
 # -
@@ -55,19 +57,41 @@ def reload():
 colors_for_data = ['#d73b68', '#204280']
 text_color = '#363c4c'
 
-def plot_pie_inset(data, ilon, ilat, ax, width, colors, lw):
-    ax_sub= inset_axes(ax, width=width, height=width, loc=10, 
-                       bbox_to_anchor=(ilon, ilat),
-                       bbox_transform=ax.transData, 
-                       borderpad=0)
-    wedges,texts= ax_sub.pie(data, colors=colors)
-    for w in wedges:
-        w.set_edgecolor('black')
-        w.set_linewidth(lw)
-        w.set_alpha(0.6)
-        w.set_zorder(1)
-
-    ax_sub.set_aspect("equal")
+def plot_pie_glyphs(ax, x, y, data, widths, colors, lw):
+    """
+    Draw all pie charts as Wedge patches of a single PatchCollection on the map
+    
+    ax: GeoAxes, Map with its final extent
+    x, y: Arrays, Projected centers of the pies
+    data: List, Values of each pie
+    widths: Array, Width of the former inset axes of each pie in inches
+    colors: List, Colors of the wedges of each pie
+    lw: Array, Edge line width of each pie
+    
+    Return: PatchCollection
+    """
+    #
+    # Pie sizes are in inches as for the former inset axes; convert them
+    # to data units once the map aspect is applied. `ax.pie` set the inset
+    # limits to +-1.25, so the former pies were 1 / 1.25 of the inset width
+    ax.apply_aspect()
+    x0, x1 = ax.get_xlim()
+    units_per_inch = abs(x1 - x0) / (ax.get_window_extent().width / ax.figure.dpi)
+
+    patches, facecolors, linewidths = [], [], []
+    for xi, yi, values, width, pie_colors, w in zip(x, y, data, widths, colors, lw):
+        values = np.asarray(values, dtype=float)
+        theta = 360 * np.r_[0, np.cumsum(values)] / values.sum()
+        for t1, t2, color in zip(theta[:-1], theta[1:], pie_colors):
+            if t2 > t1:
+                patches.append(Wedge((xi, yi), width / 2 / 1.25 * units_per_inch, t1, t2))
+                facecolors.append(mcolors.to_rgba(color, 0.6))
+                linewidths.append(w)
+
+    pies = PatchCollection(patches, facecolors=facecolors, edgecolors=[(0, 0, 0, 0.6)],
+                           linewidths=linewidths, zorder=2)
+    ax.add_collection(pies, autolim=False)
+    return pies
 
 
 # -
@@ -91,83 +115,46 @@ def plot_identity_change_ports(df, max_count, position_adjust, title):
         maps.add_land(ax)
         maps.add_countries(ax)
 
-        for n in range(max_count):
-            temp = df.iloc[n]
-            if temp.port_label == "Outside ports":
-                lonr, latr =  crs.EqualEarth().transform_point(
-                    0 + position_adjust[temp.port_label][0], 
-                    0 + position_adjust[temp.port_label][1], 
-                    crs.PlateCarree())
-                plot_pie_inset([temp.foreign_both, temp.total - temp.foreign_both],
-                               lonr, latr, ax, np.log(temp.total) * 0.07, colors_for_data, 0)
-
-
-                lonr, latr =  crs.EqualEarth().transform_point(
-                    0 + position_adjust[temp.port_label][0] + position_adjust[temp.port_label][2], 
-                    0 + position_adjust[temp.port_label][1] + position_adjust[temp.port_label][3] - 5.5, 
-                    crs.PlateCarree())
-                ax.text(lonr, latr, "Reflagging taking place\noutside any port (>10 km)",
-                         color=text_color, fontsize=6, #fontweight='bold', 
-                         zorder=3) #, horizontalalignment='center')
-                
-            else:
-                lonr, latr =  crs.EqualEarth().transform_point(
-                    temp.lon + position_adjust[temp.port_label][0], 
-                    temp.lat + position_adjust[temp.port_label][1], 
-                    crs.PlateCarree())
-                plot_pie_inset([temp.foreign_both, temp.total - temp.foreign_both],
-                               lonr, latr, ax, np.log(temp.total) * 0.07, colors_for_data, 0)
-
-
-                lonr, latr =  crs.EqualEarth().transform_point(
-                    temp.lon + position_adjust[temp.port_label][0] + position_adjust[temp.port_label][2], 
-                    temp.lat + position_adjust[temp.port_label][1] + position_adjust[temp.port_label][3] - 5.5, 
-                    crs.PlateCarree())
-                ax.text(lonr, latr, temp.port_label.title() + ", " + temp.port_iso3, 
-                         color=text_color, fontsize=6, #fontweight='bold', 
-                         zorder=3) #, horizontalalignment='center')
-
         #
-        # A dummy pie chart for the legend
-        llon, llat = 5, -55
-        lonr, latr =  crs.EqualEarth().transform_point(
-            llon + position_adjust['100'][0], 
-            llat + position_adjust['100'][1], 
-            crs.PlateCarree())
-        plot_pie_inset([1], lonr, latr, ax, np.log(100) * 0.07, ['none'], 0.5)
-        lonr, latr =  crs.EqualEarth().transform_point(
-            llon + position_adjust['100'][0] + position_adjust['100'][2], 
-            llat + position_adjust['100'][1] + position_adjust['100'][3],
-            crs.PlateCarree())
-        ax.text(lonr, latr, '100 Events', color=text_color, fontsize=6, zorder=3)
-        lonr, latr =  crs.EqualEarth().transform_point(
-            llon + position_adjust['10'][0], 
-            llat + position_adjust['10'][1],
-            crs.PlateCarree())
-        plot_pie_inset([1], lonr, latr, ax, np.log(10) * 0.07, ['none'], 0.5)
-        lonr, latr =  crs.EqualEarth().transform_point(
-            llon + position_adjust['10'][0] + position_adjust['10'][2], 
-            llat + position_adjust['10'][1] + position_adjust['10'][3],
-            crs.PlateCarree())
-        ax.text(lonr, latr, '10 Events', color=text_color, fontsize=6, zorder=3)
+        # Pie and label positions of the top ports (reflagging outside ports
+        # is placed from 0, 0), then the legend entries
+        top = df.iloc[:max_count]
+        outside = (top.port_label == "Outside ports").to_numpy()
+        adjust = np.array([position_adjust[l] for l in top.port_label], dtype=float).reshape(-1, 4)
+        lon = np.where(outside, 0, top.lon.to_numpy(dtype=float)) + adjust[:, 0]
+        lat = np.where(outside, 0, top.lat.to_numpy(dtype=float)) + adjust[:, 1]
+        labels = np.where(outside, "Reflagging taking place\noutside any port (>10 km)",
+                          top.port_label.str.title() + ", " + top.port_iso3)
+
+        pie_lon = list(lon) + [5 + position_adjust['100'][0], 5 + position_adjust['10'][0], 20, 21]
+        pie_lat = list(lat) + [-55 + position_adjust['100'][1], -55 + position_adjust['10'][1], -52, -58]
+        pie_data = [[f, t - f] for f, t in zip(top.foreign_both, top.total)] + [[1]] * 4
+        pie_widths = list(np.log(top.total.to_numpy(dtype=float)) * 0.07) + \
+            [np.log(100) * 0.07, np.log(10) * 0.07, np.log(4) * 0.07, np.log(4) * 0.07]
+        pie_colors = [colors_for_data] * len(top) + \
+            [['none'], ['none'], [colors_for_data[0]], [colors_for_data[1]]]
+        pie_lw = [0] * len(top) + [0.5, 0.5, 0, 0]
+
+        text_lon = list(lon + adjust[:, 2]) + [
+            5 + position_adjust['100'][0] + position_adjust['100'][2],
+            5 + position_adjust['10'][0] + position_adjust['10'][2], 23.5, 25]
+        text_lat = list(lat + adjust[:, 3] - 5.5) + [
+            -55 + position_adjust['100'][1] + position_adjust['100'][3],
+            -55 + position_adjust['10'][1] + position_adjust['10'][3], -52.7, -58.9]
+        texts = list(labels) + ['100 Events', '10 Events',
+                                'Foreign-to-foreign reflagging with respect to port State',
+                                'Domestic-to-foreign or foreign-to-domestic reflagging']
+        text_sizes = [6] * (len(top) + 2) + [8, 8]
 
         #
-        # A dummy color patch for the legend
-        llon, llat = 20, -52
-        lonr, latr =  crs.EqualEarth().transform_point(llon, llat, crs.PlateCarree())
-        plot_pie_inset([1], lonr, latr, ax, np.log(4) * 0.07, [colors_for_data[0]], 0)
-        llon, llat = 23.5, -52.7
-        lonr, latr =  crs.EqualEarth().transform_point(llon, llat, crs.PlateCarree())
-        ax.text(lonr, latr, 'Foreign-to-foreign reflagging with respect to port State', 
-                color=text_color, fontsize=8, zorder=3)
-        llon, llat = 21, -58
-        lonr, latr =  crs.EqualEarth().transform_point(llon, llat, crs.PlateCarree())
-        plot_pie_inset([1], lonr, latr, ax, np.log(4) * 0.07, [colors_for_data[1]], 0)
-        llon, llat = 25, -58.9
-        lonr, latr =  crs.EqualEarth().transform_point(llon, llat, crs.PlateCarree())
-        ax.text(lonr, latr, 'Domestic-to-foreign or foreign-to-domestic reflagging', 
-                color=text_color, fontsize=8, zorder=3)
-
+        # Project all pie and label positions at once
+        n = len(pie_lon)
+        xy = crs.EqualEarth().transform_points(
+            crs.PlateCarree(), np.array(pie_lon + text_lon), np.array(pie_lat + text_lat))
+
+        plot_pie_glyphs(ax, xy[:n, 0], xy[:n, 1], pie_data, pie_widths, pie_colors, pie_lw)
+        for (x, y), text, size in zip(xy[n:, :2], texts, text_sizes):
+            ax.text(x, y, text, color=text_color, fontsize=size, zorder=3)
 
         ax.set_title(title, pad=5, fontsize=9)
 
@@ -1,3 +1,6 @@
+import os
+from jinja2 import Environment, FileSystemLoader
+
 PROJECT = 'world-fishing-827'
 PROJECT_PUBLIC = 'global-fishing-watch'
 VERSION = '20220701'
@@ -7,4 +10,13 @@ EEZ_INFO_TABLE = 'gfw_research.eez_info'
 REFLAGGING_TABLE = 'vessel_identity.reflagging_flag_in_out_v'
 OWNERSHIP_BY_MMSI_TABLE = 'vessel_identity_staging.ownership_by_mmsi_v'
 PUBLIC_FISHING_EFFORT_TABLE = 'gfw_public_data.fishing_effort_byvessel_v2'
-FLAGS_OF_CONVENIENCE_TABLE = 'gfw_research.flags_of_convenience_v20211013'
\ No newline at end of file
+FLAGS_OF_CONVENIENCE_TABLE = 'gfw_research.flags_of_convenience_v20211013'
+REGIONS_TABLE = 'pipe_static.regions'
+GRIDCODE_EEZ_DIM_TABLE = 'vessel_identity_staging.gridcode_eez_dim_v'
+
+#
+# Jinja environment of the query templates. `{% include %}` reads the SQL shared
+# with the identity dataset templates in data_production (e.g. the identity_key
+# definition in `fingerprint_identity.sql`)
+QUERY_ENV = Environment(loader=FileSystemLoader(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data_production')))
@@ -0,0 +1,355 @@
+#-------------------------------------------------------------
+#-- Vessel x cell fishing effort matrix
+#-- This module pulls gridded fishing effort once by year, MMSI
+#-- and covering identities (`queries/public_fishing_effort_by_identity.sql.j2`)
+#-- and stores it locally as one CSR matrix per year (rows = an
+#-- MMSI and the set of its identity time ranges covering the
+#-- effort, columns = grid cells) in NPY files read back as
+#-- memmaps. The raster of any fleet is then a mask vector x matrix
+#-- product over the rows of that fleet, so the foreign, unknown
+#-- and total fleets, or any new ownership slice, come from the
+#-- same local data instead of one warehouse query each.
+#--
+#-- Rows are described by `rows.parquet` (mmsi, identity_ranges,
+#-- empty for effort outside every identity of the MMSI) and their
+#-- identities by `members.parquet`: one line per row and ownership
+#-- by MMSI line of a covering range. A row is in a fleet when ANY
+#-- of its members qualifies, as in the fishing effort queries.
+#-- Cells follow `pyseas.maps.rasters.df2raster` at 1/DEGREE cells
+#-- per degree: global extent, origin upper.
+#--
+#-- Run the following command (with date version as YYYYMMDD)
+#-- to build the matrix once:
+#-- `python effort_matrix.py YYYYMMDD`
+#--
+#-- Example:
+#--   matrix = EffortMatrix.load(VERSION, DEGREE)
+#--   grid_foreign = matrix.raster(foreign_rows(matrix))
+#--   grid_total = matrix.raster()
+#-------------------------------------------------------------
+import sys
+import os
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+from jinja2 import Template
+from config import PROJECT, PROJECT_PUBLIC, OWNERSHIP_BY_MMSI_TABLE, PUBLIC_FISHING_EFFORT_TABLE
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+MATRIX_DIR = os.path.join(ROOT_DIR, "..", "..", "data", "effort_matrix")
+
+EARTH_RADIUS_KM = 6371.0088
+
+#
+# Ownership by MMSI attributes kept for the members of a row. Flags keep
+# their NULLs (nullable booleans), so member conditions follow SQL logic
+IDENTITY = ["identity_key", "vessel_record_id", "n_shipname", "n_callsign", "flag", "geartype",
+            "first_timestamp", "last_timestamp"]
+FLAGS = ["is_fishing", "is_foreign", "is_domestic", "is_foreign_and_domestic", "is_unknown",
+         "overlapping_identities_for_mmsi"]
+
+#
+# Fishing identities that first appear after this date are left out of the
+# foreign and unknown fleets, as in the fishing effort queries
+LAST_IDENTITY_DATE = "2020-12-31"
+
+
+def matrix_dir(YYYYMMDD, degree):
+    """
+    Return the local folder of a matrix
+
+    :param YYYYMMDD: vessel identity data version
+    :param degree: Number, size of the grid cells in degrees
+    :return: String, path to the folder
+    """
+    return os.path.join(MATRIX_DIR, f"v{YYYYMMDD}", f"degree_{degree:g}")
+
+
+def cell_area_km2(degree):
+    """
+    Area of the grid cells of each raster row, origin upper
+
+    :param degree: Number, size of the grid cells in degrees
+    :return: numpy array of km2 per cell
+    """
+    rows = np.arange(int(round(180 / degree)))
+    lat1 = np.radians(90 - rows * degree)
+    lat0 = np.radians(90 - (rows + 1) * degree)
+    return EARTH_RADIUS_KM ** 2 * np.radians(degree) * (np.sin(lat1) - np.sin(lat0))
+
+
+def fetch_effort_by_identity(YYYYMMDD, degree):
+    """
+    Read gridded fishing effort by year, MMSI and covering identities from BigQuery
+
+    :param YYYYMMDD: vessel identity data version
+    :param degree: Number, size of the grid cells in degrees
+    :return: DataFrame with year, mmsi, identity_ranges, cell_ll_lat, cell_ll_lon
+             (in cells of `degree`) and fishing_hours
+    """
+    with open(os.path.join(ROOT_DIR, 'queries', 'public_fishing_effort_by_identity.sql.j2')) as f:
+        sql_template = Template(f.read())
+
+    q = sql_template.render(
+        PROJECT=PROJECT,
+        PROJECT_PUBLIC=PROJECT_PUBLIC,
+        VERSION=YYYYMMDD,
+        OWNERSHIP_BY_MMSI_TABLE=OWNERSHIP_BY_MMSI_TABLE,
+        PUBLIC_FISHING_EFFORT_TABLE=PUBLIC_FISHING_EFFORT_TABLE,
+        DEGREE=degree,
+    )
+    return pd.read_gbq(q, project_id=PROJECT, dialect='standard')
+
+
+def fetch_ownership_by_mmsi(YYYYMMDD):
+    """
+    Read the ownership by MMSI table from BigQuery
+
+    :param YYYYMMDD: vessel identity data version
+    :return: DataFrame
+    """
+    q = f'''
+    SELECT *
+    FROM {OWNERSHIP_BY_MMSI_TABLE}{YYYYMMDD}
+    '''
+    return pd.read_gbq(q, project_id=PROJECT, dialect='standard')
+
+
+def _micros(timestamps):
+    """
+    UNIX microseconds of timestamps, as `UNIX_MICROS` in BigQuery
+    """
+    epoch = pd.Timestamp(0, tz="UTC")
+    return (pd.to_datetime(timestamps, utc=True) - epoch) // pd.Timedelta(microseconds=1)
+
+
+def identity_rows(df_effort):
+    """
+    One row per (mmsi, identity_ranges) of the effort, in matrix row order
+
+    :param df_effort: DataFrame from `fetch_effort_by_identity`
+    :return: DataFrame with mmsi and identity_ranges
+    """
+    keys = ["mmsi", "identity_ranges"]
+    rows = df_effort[keys].fillna({"identity_ranges": ""}).drop_duplicates()
+    return rows.sort_values(keys).reset_index(drop=True)
+
+
+def identity_members(rows, df_ownership_by_mmsi):
+    """
+    Ownership by MMSI lines of the identity ranges covering each row
+
+    :param rows: DataFrame from `identity_rows`
+    :param df_ownership_by_mmsi: DataFrame of the ownership by MMSI table
+    :return: DataFrame with row, mmsi, the `IDENTITY` fields and the `FLAGS`
+    """
+    ranges = rows["identity_ranges"].str.split(",").explode()
+    ranges = ranges[ranges != ""]
+    parts = ranges.str.split("/", expand=True).astype("int64") if len(ranges) \
+        else pd.DataFrame(columns=[0, 1, 2], dtype="int64")
+    members = pd.DataFrame({"row": ranges.index.to_numpy(),
+                            "mmsi": rows["mmsi"].to_numpy()[ranges.index],
+                            "identity_key": parts[0].to_numpy(),
+                            "first_us": parts[1].to_numpy(),
+                            "last_us": parts[2].to_numpy()})
+
+    owners = df_ownership_by_mmsi.dropna(subset=["identity_key", "first_timestamp", "last_timestamp"])
+    owners = owners[["mmsi"] + IDENTITY + FLAGS].assign(
+        identity_key=owners["identity_key"].astype("int64"),
+        first_us=_micros(owners["first_timestamp"]),
+        last_us=_micros(owners["last_timestamp"]))
+    members = members.merge(owners, on=["mmsi", "identity_key", "first_us", "last_us"])
+    members[FLAGS] = members[FLAGS].astype("boolean")
+    return members.drop(columns=["first_us", "last_us"]).sort_values("row").reset_index(drop=True)
+
+
+class EffortMatrix:
+    """
+    Fishing hours by row (MMSI and covering identities) and grid cell, one
+    CSR matrix per year. All years share the rows of `rows` and the cells of
+    the global grid; `members` lists the identities covering each row.
+    """
+
+    def __init__(self, rows, members, matrices, degree):
+        """
+        :param rows: DataFrame describing the matrix rows
+        :param members: DataFrame from `identity_members`
+        :param matrices: Dict of year to scipy.sparse.csr_matrix
+        :param degree: Number, size of the grid cells in degrees
+        """
+        self.rows = rows
+        self.members = members
+        self.matrices = matrices
+        self.degree = degree
+
+    @property
+    def shape(self):
+        return int(round(180 / self.degree)), int(round(360 / self.degree))
+
+    @property
+    def years(self):
+        return sorted(self.matrices)
+
+    @classmethod
+    def build(cls, df_effort, df_ownership_by_mmsi, YYYYMMDD, degree):
+        """
+        Lay out the effort as one CSR matrix per year and store the matrices
+        and their rows locally
+
+        :param df_effort: DataFrame from `fetch_effort_by_identity`
+        :param df_ownership_by_mmsi: DataFrame of the ownership by MMSI table
+        :param YYYYMMDD: vessel identity data version
+        :param degree: Number, size of the grid cells in degrees
+        :return: EffortMatrix read back from the stored files
+        """
+        rows = identity_rows(df_effort)
+        members = identity_members(rows, df_ownership_by_mmsi)
+        ny, nx = int(round(180 / degree)), int(round(360 / degree))
+
+        #
+        # Matrix row of each effort row, and its cell as a flat index of the
+        # global grid (origin upper)
+        keys = pd.MultiIndex.from_frame(rows[["mmsi", "identity_ranges"]])
+        row = keys.get_indexer(pd.MultiIndex.from_frame(
+            df_effort[["mmsi", "identity_ranges"]].fillna({"identity_ranges": ""})))
+        lat = ny - 1 - (df_effort["cell_ll_lat"].to_numpy(np.int64) + ny // 2)
+        lon = (df_effort["cell_ll_lon"].to_numpy(np.int64) + nx // 2) % nx
+        valid = (lat >= 0) & (lat < ny)
+        cell = lat * nx + lon
+        year = df_effort["year"].to_numpy(np.int64)
+        hours = df_effort["fishing_hours"].to_numpy(np.float64)
+
+        out_dir = matrix_dir(YYYYMMDD, degree)
+        os.makedirs(out_dir, exist_ok=True)
+        for y in np.unique(year):
+            sel = valid & (year == y)
+            m = sparse.csr_matrix((hours[sel], (row[sel], cell[sel])), shape=(len(rows), ny * nx))
+            m.sum_duplicates()
+            np.save(os.path.join(out_dir, f"{y}_indptr.npy"), m.indptr)
+            np.save(os.path.join(out_dir, f"{y}_indices.npy"), m.indices)
+            np.save(os.path.join(out_dir, f"{y}_data.npy"), m.data.astype(np.float32))
+        rows.to_parquet(os.path.join(out_dir, "rows.parquet"), index=False)
+        members.to_parquet(os.path.join(out_dir, "members.parquet"), index=False)
+        return cls.load(YYYYMMDD, degree)
+
+    @classmethod
+    def load(cls, YYYYMMDD, degree):
+        """
+        Open a stored matrix; the arrays are memory-mapped, not read
+
+        :param YYYYMMDD: vessel identity data version
+        :param degree: Number, size of the grid cells in degrees
+        :return: EffortMatrix
+        """
+        path = matrix_dir(YYYYMMDD, degree)
+        if not os.path.exists(os.path.join(path, "rows.parquet")):
+            raise FileNotFoundError(
+                f"No local effort matrix for v{YYYYMMDD} at {degree:g} degree. "
+                f"Run `python effort_matrix.py {YYYYMMDD}` first.")
+
+        rows = pd.read_parquet(os.path.join(path, "rows.parquet"))
+        members = pd.read_parquet(os.path.join(path, "members.parquet"))
+        ny, nx = int(round(180 / degree)), int(round(360 / degree))
+        years = sorted(int(f.split("_")[0]) for f in os.listdir(path) if f.endswith("_indptr.npy"))
+        matrices = {}
+        for y in years:
+            arrays = [np.load(os.path.join(path, f"{y}_{a}.npy"), mmap_mode="r")
+                      for a in ("data", "indices", "indptr")]
+            matrices[y] = sparse.csr_matrix(tuple(arrays), shape=(len(rows), ny * nx), copy=False)
+        return cls(rows, members, matrices, degree)
+
+    def covered(self, condition):
+        """
+        Rows with at least one member meeting a condition (NULL counts as
+        False, as in a SQL WHERE)
+
+        :param condition: Boolean (nullable) array over `members`
+        :return: numpy bool array over `rows`
+        """
+        hit = pd.array(condition, dtype="boolean").fillna(False).to_numpy(bool)
+        out = np.zeros(len(self.rows), dtype=bool)
+        out[self.members["row"].to_numpy()[hit]] = True
+        return out
+
+    def raster(self, mask=None, years=None, per_km2=True):
+        """
+        Fishing hours of a fleet on the global grid, like `df2raster` of the
+        fleet's gridded effort
+
+        :param mask: Boolean (or weight) array over `rows`, all rows if None
+        :param years: Integer or list of years, all years if None
+        :param per_km2: Boolean, divide by the cell area
+        :return: numpy array (rows, cols), origin upper
+        """
+        years = self.years if years is None else [years] if np.isscalar(years) else list(years)
+        ny, nx = self.shape
+
+        if mask is None:
+            weights = np.ones(len(self.rows))
+        else:
+            weights = np.asarray(mask, dtype=np.float64)
+        selected = sparse.csr_matrix(weights[None, :])
+
+        grid = np.zeros(ny * nx)
+        for y in years:
+            if y in self.matrices:
+                grid += (selected @ self.matrices[y]).toarray().ravel()
+        grid = grid.reshape(ny, nx)
+        if per_km2:
+            grid /= cell_area_km2(self.degree)[:, None]
+        return grid
+
+
+def _first_seen_by(members, date):
+    """
+    Whether the identity of each member first appears on or before a date
+    """
+    first = pd.to_datetime(members["first_timestamp"], utc=True)
+    return first < pd.Timestamp(date, tz="UTC") + pd.Timedelta(days=1)
+
+
+def foreign_rows(matrix, last_identity_date=LAST_IDENTITY_DATE):
+    """
+    Rows covered by a fishing identity with foreign ownership, as selected by
+    `public_fishing_effort_foreign.sql.j2`
+
+    :param matrix: EffortMatrix
+    :return: numpy bool array
+    """
+    m = matrix.members
+    return matrix.covered(m["is_fishing"] & m["is_foreign"] & ~m["overlapping_identities_for_mmsi"]
+                          & _first_seen_by(m, last_identity_date))
+
+
+def unknown_rows(matrix, last_identity_date=LAST_IDENTITY_DATE):
+    """
+    Rows with unknown ownership, as selected by `public_fishing_effort_unknown.sql.j2`:
+    all rows except those covered by a fishing identity with known owners or
+    of an MMSI shared by overlapping identities
+
+    :param matrix: EffortMatrix
+    :return: numpy bool array
+    """
+    m = matrix.members
+    return ~matrix.covered(m["is_fishing"] & (~m["is_unknown"] | m["overlapping_identities_for_mmsi"])
+                           & _first_seen_by(m, last_identity_date))
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) not in (2, 3):
+        print("Use example: python effort_matrix.py YYYYMMDD [DEGREE]")
+        raise ValueError('Version date is supposed to be passed as "YYYYMMDD"')
+
+    #
+    # Setting
+    YYYYMMDD = sys.argv[1]
+    if len(YYYYMMDD) != 8:
+        raise ValueError("Version date is supposed to be passed as YYYYMMDD")
+    DEGREE = float(sys.argv[2]) if len(sys.argv) == 3 else 1
+
+    #
+    # Run
+    matrix = EffortMatrix.build(fetch_effort_by_identity(YYYYMMDD, DEGREE),
+                                fetch_ownership_by_mmsi(YYYYMMDD), YYYYMMDD, DEGREE)
+    print(f"{matrix_dir(YYYYMMDD, DEGREE)} written: {len(matrix.rows)} rows, years {matrix.years}")
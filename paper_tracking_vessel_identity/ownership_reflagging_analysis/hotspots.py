@@ -0,0 +1,677 @@
+# -------------------------------------------------------------
+# -- Local hotspot engine
+# -- This module answers the "which vessels fish in this region"
+# -- questions of `identity_paper_fishing_effort.py` (bounding box
+# -- or list of EEZs) locally, instead of one warehouse query per
+# -- region rescanning the public fishing effort and re-joining
+# -- `pipe_static.regions` on gridcode.
+# --
+# -- Fishing effort by identity at the public data resolution
+# -- (`effort_matrix.py`, 0.1 degree) is re-indexed by grid cell:
+# -- cells are sorted row-major, so a bounding box is one contiguous
+# -- slice per latitude row (two for lon_start > lon_end), and an
+# -- EEZ is the list of its cells from the gridcode to EEZ dimension
+# -- table (`queries/gridcode_eez_dim.sql.j2`, materialized once per
+# -- version from the regions and EEZ info tables). Fishing
+# -- hours by matrix row are summed with one `np.bincount`; EEZ
+# -- hours go to every identity covering a row (`EffortMatrix.members`),
+# -- as the per-identity joins of the EEZ query did.
+# --
+# -- Run the following command (with date version as YYYYMMDD)
+# -- to build the index once (after the effort matrix):
+# -- `python hotspots.py YYYYMMDD`
+# --
+# -- Where the local index is not available, `fetch_vessels_in_regions`
+# -- answers many regions with one warehouse query
+# -- (`queries/vessels_fishing_in_regions.sql.j2`) scanning the
+# -- public fishing effort once. Regions are given the same way to
+# -- both: a list of EEZ ISO3 codes or a (lon_start, lat_start,
+# -- lon_end, lat_end) bounding box.
+# --
+# -- Example:
+# --   hotspots = HotspotIndex.load(VERSION)
+# --   hotspots.vessels_in_bbox(124.9, -30.4, -81.2, 13.8, ownership_type='is_foreign')
+# --   hotspots.vessels_in_eezs(['KEN', 'SYC'], ownership_type='is_foreign')
+# --   regions = {'SPacific': (124.9, -30.4, -81.2, 13.8), 'KEN_SYC': ['KEN', 'SYC']}
+# --   hotspots.vessels_in_regions(regions, ownership_type='is_foreign')
+# --   fetch_vessels_in_regions(regions, VERSION, ownership_type='is_foreign')
+# -------------------------------------------------------------
+import sys
+import os
+import numpy as np
+import pandas as pd
+from jinja2 import Template
+from google.api_core.exceptions import NotFound
+from google.cloud import bigquery
+from config import (
+    PROJECT,
+    PROJECT_PUBLIC,
+    OWNER_TABLE,
+    EEZ_INFO_TABLE,
+    OWNERSHIP_BY_MMSI_TABLE,
+    PUBLIC_FISHING_EFFORT_TABLE,
+    REGIONS_TABLE,
+    GRIDCODE_EEZ_DIM_TABLE,
+    QUERY_ENV,
+)
+from effort_matrix import EffortMatrix, matrix_dir, fetch_ownership_by_mmsi
+
+#
+# Resolution of the public fishing effort data
+HOTSPOT_DEGREE = 0.1
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+#
+# Result columns of each kind of region
+BBOX_COLUMNS = [
+    "vessel_record_id",
+    "ssvid",
+    "n_shipname",
+    "n_callsign",
+    "imo",
+    "flag",
+    "owner",
+    "owner_flag",
+    "source_code",
+    "fishing_hours",
+    "is_domestic",
+    "is_foreign",
+    "is_foreign_and_domestic",
+    "is_unknown",
+    "geartype",
+    "first_timestamp",
+    "last_timestamp",
+    "is_fishing",
+    "is_carrier",
+    "is_bunker",
+    "overlapping_identities_for_mmsi",
+]
+EEZ_COLUMNS = [
+    "ssvid",
+    "identity_key",
+    "vessel_record_id",
+    "n_shipname",
+    "n_callsign",
+    "flag",
+    "geartype",
+    "eez",
+    "eez_iso3",
+    "eez_name",
+    "fishing_hours",
+    "imo",
+    "owner",
+    "owner_flag",
+    "source_code",
+]
+
+
+def region_kind(region):
+    """
+    Kind of a region of interest: "eez" for a list of EEZ ISO3 codes,
+    "bbox" for a (lon_start, lat_start, lon_end, lat_end) tuple
+    """
+    if isinstance(region, list):
+        return "eez"
+    if isinstance(region, tuple) and len(region) == 4:
+        return "bbox"
+    raise ValueError(
+        f"A region is a list of EEZ ISO3 codes or a bounding box tuple, not {region!r}"
+    )
+
+
+def create_gridcode_eez_dim(YYYYMMDD, overwrite=False):
+    """
+    Materialize the gridcode to EEZ dimension table of a version
+    (`queries/gridcode_eez_dim.sql.j2`) once: an existing table is kept
+    unless `overwrite` is set
+
+    :param YYYYMMDD: vessel identity data version
+    :param overwrite: Boolean, rebuild the table if it exists
+    :return: String, the table
+    """
+    table = f"{PROJECT}.{GRIDCODE_EEZ_DIM_TABLE}{YYYYMMDD}"
+    client = bigquery.Client()
+    if not overwrite:
+        try:
+            client.get_table(table)
+            return table
+        except NotFound:
+            pass
+
+    with open(os.path.join(ROOT_DIR, "queries", "gridcode_eez_dim.sql.j2")) as f:
+        sql_template = Template(f.read())
+
+    q = sql_template.render(
+        EEZ_INFO_TABLE=EEZ_INFO_TABLE,
+        REGIONS_TABLE=REGIONS_TABLE,
+    )
+
+    job_config = bigquery.QueryJobConfig(
+        destination=table,
+        write_disposition="WRITE_TRUNCATE",
+        clustering_fields=["eez_iso3", "gridcode"],
+    )
+    client.query(q, job_config=job_config).result()
+    return table
+
+
+def gridcode_eez_dict(YYYYMMDD, eez_list=None):
+    """
+    Gridcode to EEZs lookup for local use, read from the dimension table
+
+    :param YYYYMMDD: vessel identity data version
+    :param eez_list: List of EEZ ISO3 codes to read, all EEZs if None
+    :return: Dict of gridcode to a list of (eez_id, eez_iso3, eez_name, sovereign_iso3)
+    """
+    where = (
+        f"WHERE eez_iso3 IN UNNEST({list(eez_list)})" if eez_list is not None else ""
+    )
+    q = f"""
+    SELECT gridcode, eez_id, eez_iso3, eez_name, sovereign_iso3
+    FROM `{PROJECT}.{GRIDCODE_EEZ_DIM_TABLE}{YYYYMMDD}`
+    {where}
+    """
+    df = pd.read_gbq(q, project_id=PROJECT, dialect="standard")
+
+    lookup = {}
+    for gridcode, eez in zip(
+        df["gridcode"],
+        df[["eez_id", "eez_iso3", "eez_name", "sovereign_iso3"]].itertuples(
+            index=False, name=None
+        ),
+    ):
+        lookup.setdefault(gridcode, []).append(eez)
+    return lookup
+
+
+def fetch_eez_cells(YYYYMMDD, degree=HOTSPOT_DEGREE):
+    """
+    EEZs of the grid cells from the gridcode to EEZ dimension table, taken at
+    the gridcode of each cell's lower left corner as in the EEZ queries
+
+    :param YYYYMMDD: vessel identity data version
+    :param degree: Number, size of the grid cells in degrees
+    :return: DataFrame with cell_ll_lat, cell_ll_lon (in cells of `degree`),
+             eez, eez_iso3 and eez_name
+    """
+    step = int(round(degree * 100))
+    q = f"""
+    WITH
+      gridcodes AS (
+        SELECT
+          CAST (ROUND (
+            CAST (REGEXP_EXTRACT (gridcode, r"lat:([-+0-9.]+)") AS FLOAT64) * 100
+          ) AS INT64) AS lat,
+          CAST (ROUND (
+            CAST (REGEXP_EXTRACT (gridcode, r"lon:([-+0-9.]+)") AS FLOAT64) * 100
+          ) AS INT64) AS lon,
+          CAST (eez_id AS STRING) AS eez,
+          eez_iso3,
+          eez_name
+        FROM `{PROJECT}.{GRIDCODE_EEZ_DIM_TABLE}{YYYYMMDD}`
+        WHERE eez_id IS NOT NULL
+      )
+
+    SELECT DISTINCT
+      DIV (lat, {step}) AS cell_ll_lat,
+      DIV (lon, {step}) AS cell_ll_lon,
+      eez,
+      eez_iso3,
+      eez_name
+    FROM gridcodes
+    WHERE MOD (lat, {step}) = 0
+    AND MOD (lon, {step}) = 0
+    """
+    return pd.read_gbq(q, project_id=PROJECT, dialect="standard")
+
+
+def fetch_owner_identities(YYYYMMDD):
+    """
+    Owners of each identity, keyed by `identity_key`
+
+    :param YYYYMMDD: vessel identity data version
+    :return: DataFrame
+    """
+    q = f"""
+    {QUERY_ENV.get_template('fingerprint_identity.sql').render()}
+
+    SELECT
+    fingerprint_identity(ssvid, n_shipname, n_callsign, imo, flag) AS identity_key,
+    vessel_record_id, ssvid, n_shipname, n_callsign, imo, flag,
+    owner, owner_flag, source_code
+    FROM `{OWNER_TABLE}{YYYYMMDD}`
+    """
+    return pd.read_gbq(q, project_id=PROJECT, dialect="standard")
+
+
+def fetch_vessels_in_regions(
+    regions, YYYYMMDD, ownership_type=None, fishing_min=24, dry_run=False
+):
+    """
+    Vessels fishing in each region of interest, from one warehouse query
+    scanning the public fishing effort once. With `dry_run`, the query is only
+    validated and planned by BigQuery and the bytes it would process returned.
+
+    :param regions: Dict of region name to a list of EEZ ISO3 codes or a
+                    (lon_start, lat_start, lon_end, lat_end) bounding box
+    :param YYYYMMDD: vessel identity data version
+    :param ownership_type: String, ownership flag to keep (e.g. is_foreign), all if None
+    :param fishing_min: Number, minimum fishing hours of an MMSI in a box or
+                        of an identity in an EEZ
+    :param dry_run: Boolean, plan the query without running it
+    :return: Dict of region name to a DataFrame sorted by fishing hours, with
+             the columns of `HotspotIndex.vessels_in_bbox` or `vessels_in_eezs`
+             (Integer, bytes processed, with `dry_run`)
+    """
+    rows = []
+    for name, region in regions.items():
+        if region_kind(region) == "eez":
+            rows += [
+                dict(
+                    region=name,
+                    kind="eez",
+                    eez_iso3=e,
+                    lon_start=None,
+                    lat_start=None,
+                    lon_end=None,
+                    lat_end=None,
+                )
+                for e in region
+            ]
+        else:
+            lon_start, lat_start, lon_end, lat_end = region
+            rows.append(
+                dict(
+                    region=name,
+                    kind="bbox",
+                    eez_iso3=None,
+                    lon_start=lon_start,
+                    lat_start=lat_start,
+                    lon_end=lon_end,
+                    lat_end=lat_end,
+                )
+            )
+
+    with open(
+        os.path.join(ROOT_DIR, "queries", "vessels_fishing_in_regions.sql.j2")
+    ) as f:
+        sql_template = QUERY_ENV.from_string(f.read())
+
+    q = sql_template.render(
+        PROJECT=PROJECT,
+        PROJECT_PUBLIC=PROJECT_PUBLIC,
+        VERSION=YYYYMMDD,
+        OWNER_TABLE=OWNER_TABLE,
+        GRIDCODE_EEZ_DIM_TABLE=GRIDCODE_EEZ_DIM_TABLE,
+        OWNERSHIP_BY_MMSI_TABLE=OWNERSHIP_BY_MMSI_TABLE,
+        PUBLIC_FISHING_EFFORT_TABLE=PUBLIC_FISHING_EFFORT_TABLE,
+        REGIONS=rows,
+        OWNERSHIP_CHECK=ownership_type or "TRUE",
+        FISHING_MIN=fishing_min,
+    )
+    if dry_run:
+        job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+        job = bigquery.Client(project=PROJECT).query(q, job_config=job_config)
+        return job.total_bytes_processed
+
+    df = pd.read_gbq(q, project_id=PROJECT, dialect="standard")
+
+    out = {}
+    for name, region in regions.items():
+        columns = EEZ_COLUMNS if region_kind(region) == "eez" else BBOX_COLUMNS
+        out[name] = (
+            df[df["region"] == name][columns]
+            .sort_values("fishing_hours", ascending=False)
+            .reset_index(drop=True)
+        )
+    return out
+
+
+def _ranges(starts, ends):
+    """
+    Concatenated positions of several [start, end) ranges
+    """
+    lengths = ends - starts
+    offsets = np.repeat(
+        starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths
+    )
+    return offsets + np.arange(lengths.sum())
+
+
+class HotspotIndex:
+    """
+    Fishing hours by matrix row (see `EffortMatrix.rows`), all years summed,
+    in cell-major order: the effort of cell `c` is `hours[cell_ptr[c]:cell_ptr[c + 1]]`
+    for the rows `row[...]`. EEZs map to their cells in the same way through
+    `eez_ptr` and `eez_cell`.
+    """
+
+    def __init__(
+        self,
+        rows,
+        members,
+        cell_ptr,
+        row,
+        hours,
+        eezs,
+        eez_ptr,
+        eez_cell,
+        ownership_by_mmsi,
+        owners,
+        degree=HOTSPOT_DEGREE,
+    ):
+        """
+        :param rows: DataFrame of matrix rows
+        :param members: DataFrame of the identities covering each row
+        :param cell_ptr: numpy int64 array, start of each cell's effort
+        :param row: numpy int32 array, matrix row of each effort entry
+        :param hours: numpy float32 array, fishing hours of each effort entry
+        :param eezs: DataFrame with eez, eez_iso3 and eez_name, one per EEZ id
+        :param eez_ptr: numpy int64 array, start of each EEZ's cells
+        :param eez_cell: numpy int64 array, cells of the EEZs
+        :param ownership_by_mmsi: DataFrame of the ownership by MMSI table
+        :param owners: DataFrame from `fetch_owner_identities`
+        :param degree: Number, size of the grid cells in degrees
+        """
+        self.rows = rows
+        self.members = members
+        self.cell_ptr = cell_ptr
+        self.row = row
+        self.hours = hours
+        self.eezs = eezs
+        self.eez_ptr = eez_ptr
+        self.eez_cell = eez_cell
+        self.ownership_by_mmsi = ownership_by_mmsi
+        self.owners = owners
+        self.degree = degree
+        self.ny, self.nx = int(round(180 / degree)), int(round(360 / degree))
+
+    @classmethod
+    def build(
+        cls, YYYYMMDD, eez_cells, ownership_by_mmsi, owners, degree=HOTSPOT_DEGREE
+    ):
+        """
+        Re-index the effort matrix of a version by cell and store the index
+        next to it
+
+        :param YYYYMMDD: vessel identity data version
+        :param eez_cells: DataFrame from `fetch_eez_cells`
+        :param ownership_by_mmsi: DataFrame of the ownership by MMSI table
+        :param owners: DataFrame from `fetch_owner_identities`
+        :param degree: Number, size of the grid cells in degrees
+        :return: HotspotIndex
+        """
+        matrix = EffortMatrix.load(YYYYMMDD, degree)
+        ny, nx = matrix.shape
+        effort = sum(matrix.matrices.values()).tocsc()
+        effort.sum_duplicates()
+
+        eez_cells = eez_cells[eez_cells["eez"].notna()]
+        cell = (
+            ny - 1 - (eez_cells["cell_ll_lat"].to_numpy(np.int64) + ny // 2)
+        ) * nx + (eez_cells["cell_ll_lon"].to_numpy(np.int64) + nx // 2) % nx
+        eez = eez_cells["eez"].astype(str).to_numpy()
+        codes, index = np.unique(eez, return_inverse=True)
+        order = np.lexsort((cell, index))
+        eez_ptr = np.concatenate(
+            [[0], np.cumsum(np.bincount(index, minlength=len(codes)))]
+        )
+
+        names = eez_cells.assign(eez=eez).drop_duplicates("eez")[
+            ["eez", "eez_iso3", "eez_name"]
+        ]
+        eezs = pd.DataFrame({"eez": codes}).merge(names, on="eez", how="left")
+
+        path = matrix_dir(YYYYMMDD, degree)
+        np.save(os.path.join(path, "cell_ptr.npy"), effort.indptr.astype(np.int64))
+        np.save(os.path.join(path, "cell_row.npy"), effort.indices.astype(np.int32))
+        np.save(os.path.join(path, "cell_hours.npy"), effort.data.astype(np.float32))
+        np.savez(
+            os.path.join(path, "eez_cells.npz"), eez_ptr=eez_ptr, eez_cell=cell[order]
+        )
+        eezs.to_parquet(os.path.join(path, "eezs.parquet"), index=False)
+        ownership_by_mmsi.to_parquet(
+            os.path.join(path, "ownership_by_mmsi.parquet"), index=False
+        )
+        owners.to_parquet(os.path.join(path, "owners.parquet"), index=False)
+        return cls.load(YYYYMMDD, degree)
+
+    @classmethod
+    def load(cls, YYYYMMDD, degree=HOTSPOT_DEGREE):
+        """
+        Open a stored index; the effort arrays are memory-mapped
+
+        :param YYYYMMDD: vessel identity data version
+        :param degree: Number, size of the grid cells in degrees
+        :return: HotspotIndex
+        """
+        path = matrix_dir(YYYYMMDD, degree)
+        if not os.path.exists(os.path.join(path, "cell_ptr.npy")):
+            raise FileNotFoundError(
+                f"No local hotspot index for v{YYYYMMDD}. "
+                f"Run `python effort_matrix.py {YYYYMMDD} {degree:g}` and "
+                f"`python hotspots.py {YYYYMMDD}` first."
+            )
+
+        with np.load(os.path.join(path, "eez_cells.npz")) as f:
+            eez_ptr, eez_cell = f["eez_ptr"], f["eez_cell"]
+        return cls(
+            pd.read_parquet(os.path.join(path, "rows.parquet")),
+            pd.read_parquet(os.path.join(path, "members.parquet")),
+            *[
+                np.load(os.path.join(path, f"cell_{a}.npy"), mmap_mode="r")
+                for a in ("ptr", "row", "hours")
+            ],
+            pd.read_parquet(os.path.join(path, "eezs.parquet")),
+            eez_ptr,
+            eez_cell,
+            pd.read_parquet(os.path.join(path, "ownership_by_mmsi.parquet")),
+            pd.read_parquet(os.path.join(path, "owners.parquet")),
+            degree,
+        )
+
+    def bbox_cells(self, lon_start, lat_start, lon_end, lat_end):
+        """
+        Cell ranges of the cells whose lower left corner is in a bounding box
+        (bounds included). Boxes with lon_start > lon_end wrap across the
+        antimeridian: they are searched over lon_start..180 and -180..lon_end.
+        The former bounding box query searched 0..lon_end instead, so such
+        boxes now also find the effort between -180 and min(lon_end, 0).
+
+        :return: Tuple of numpy arrays of the first and last + 1 cell of each range
+        """
+        scale = 1 / self.degree
+        r_top = self.ny - 1 - (int(np.floor(lat_end * scale + 1e-6)) + self.ny // 2)
+        r_bottom = self.ny - 1 - (int(np.ceil(lat_start * scale - 1e-6)) + self.ny // 2)
+        rows = np.arange(max(r_top, 0), min(r_bottom, self.ny - 1) + 1)
+
+        c0 = int(np.ceil(lon_start * scale - 1e-6)) + self.nx // 2
+        c1 = int(np.floor(lon_end * scale + 1e-6)) + self.nx // 2
+        if lon_start > lon_end:
+            spans = [(c0, self.nx), (0, min(c1, self.nx - 1) + 1)]
+        else:
+            spans = [(max(c0, 0), min(c1, self.nx - 1) + 1)]
+
+        starts = np.concatenate([rows * self.nx + a for a, b in spans if b > a] or [[]])
+        ends = np.concatenate([rows * self.nx + b for a, b in spans if b > a] or [[]])
+        return starts.astype(np.int64), ends.astype(np.int64)
+
+    def bbox_hours(self, lon_start, lat_start, lon_end, lat_end):
+        """
+        Fishing hours of each matrix row in a bounding box
+
+        :return: numpy array, one value per matrix row
+        """
+        starts, ends = self.bbox_cells(lon_start, lat_start, lon_end, lat_end)
+        positions = _ranges(self.cell_ptr[starts], self.cell_ptr[ends])
+        return np.bincount(
+            self.row[positions], weights=self.hours[positions], minlength=len(self.rows)
+        )
+
+    def eez_hours(self, eez_list):
+        """
+        Fishing hours of each matrix row in each EEZ of a list of ISO3 codes
+
+        :param eez_list: List of EEZ ISO3 codes
+        :return: DataFrame with row, eez, eez_iso3, eez_name and fishing_hours
+        """
+        eezs = self.eezs[self.eezs["eez_iso3"].isin(eez_list)]
+        out = []
+        for i in eezs.index:
+            cells = self.eez_cell[self.eez_ptr[i] : self.eez_ptr[i + 1]]
+            positions = _ranges(self.cell_ptr[cells], self.cell_ptr[cells + 1])
+            hours = np.bincount(
+                self.row[positions],
+                weights=self.hours[positions],
+                minlength=len(self.rows),
+            )
+            row = np.flatnonzero(hours)
+            out.append(
+                pd.DataFrame({"row": row, "fishing_hours": hours[row]}).assign(
+                    **eezs.loc[i, ["eez", "eez_iso3", "eez_name"]].to_dict()
+                )
+            )
+        columns = ["row", "eez", "eez_iso3", "eez_name", "fishing_hours"]
+        return (
+            pd.concat(out, ignore_index=True)[columns]
+            if out
+            else pd.DataFrame(columns=columns)
+        )
+
+    def vessels_in_bbox(
+        self,
+        lon_start,
+        lat_start,
+        lon_end,
+        lat_end,
+        ownership_type=None,
+        fishing_min=24,
+    ):
+        """
+        Owner identities of the MMSI fishing more than `fishing_min` hours in a
+        bounding box, as `get_vessels_fishing_in_bbox`
+
+        :param ownership_type: String, ownership flag to keep (e.g. is_foreign),
+                               all if None
+        :param fishing_min: Number, minimum fishing hours of an MMSI in the box
+        :return: DataFrame sorted by fishing hours
+        """
+        hours = self.bbox_hours(lon_start, lat_start, lon_end, lat_end)
+        by_mmsi = (
+            pd.Series(hours).groupby(self.rows["mmsi"].astype(str).to_numpy()).sum()
+        )
+        by_mmsi = by_mmsi[by_mmsi > fishing_min].rename("fishing_hours")
+
+        owners = self.owners.assign(ssvid=self.owners["ssvid"].astype(str))
+        df = owners.merge(by_mmsi, left_on="ssvid", right_index=True)
+        attributes = self.ownership_by_mmsi.drop(
+            columns=["vessel_record_id", "mmsi", "n_shipname", "n_callsign", "flag"]
+        )
+        df = df.merge(attributes, on="identity_key", how="left").drop(
+            columns="identity_key"
+        )
+
+        keep = df["is_fishing"].isna() | df["is_fishing"].fillna(False).astype(bool)
+        if ownership_type:
+            keep &= df[ownership_type].fillna(False).astype(bool)
+        return (
+            df[keep]
+            .sort_values("fishing_hours", ascending=False)
+            .reset_index(drop=True)
+        )
+
+    def vessels_in_eezs(self, eez_list, ownership_type=None, fishing_min=24):
+        """
+        Fishing identities with more than `fishing_min` hours in each EEZ of a
+        list, with their owners, as `get_vessels_fishing_in_eezs`
+
+        :param eez_list: List of EEZ ISO3 codes
+        :param ownership_type: String, ownership flag to keep (e.g. is_foreign),
+                               all if None
+        :param fishing_min: Number, minimum fishing hours of an identity in an EEZ
+        :return: DataFrame sorted by fishing hours
+        """
+        if not isinstance(eez_list, list):
+            raise ValueError("EEZs must be given as a list")
+
+        #
+        # Identities of interest covering each row, once per identity time range
+        # as the DISTINCT of the EEZ query
+        m = self.members
+        keep = m["is_fishing"] & ~m["overlapping_identities_for_mmsi"]
+        if ownership_type:
+            keep &= m[ownership_type]
+        identity = [
+            "mmsi",
+            "identity_key",
+            "vessel_record_id",
+            "n_shipname",
+            "n_callsign",
+            "flag",
+            "geartype",
+        ]
+        covering = m[keep.fillna(False).to_numpy(bool)][
+            ["row"] + identity + ["first_timestamp", "last_timestamp"]
+        ].drop_duplicates()
+
+        df = self.eez_hours(eez_list).merge(covering, on="row")
+        df = df.groupby(
+            identity + ["eez", "eez_iso3", "eez_name"], dropna=False, as_index=False
+        )["fishing_hours"].sum()
+        df = df[df["fishing_hours"] > fishing_min].rename(columns={"mmsi": "ssvid"})
+
+        owners = self.owners[
+            ["identity_key", "imo", "owner", "owner_flag", "source_code"]
+        ]
+        df = df.merge(owners, on="identity_key", how="left")
+        return df.sort_values("fishing_hours", ascending=False).reset_index(drop=True)
+
+    def vessels_in_regions(self, regions, ownership_type=None, fishing_min=24):
+        """
+        Vessels fishing in each region of interest, as `fetch_vessels_in_regions`
+
+        :param regions: Dict of region name to a list of EEZ ISO3 codes or a
+                        (lon_start, lat_start, lon_end, lat_end) bounding box
+        :param ownership_type: String, ownership flag to keep (e.g. is_foreign),
+                               all if None
+        :param fishing_min: Number, see `vessels_in_bbox` and `vessels_in_eezs`
+        :return: Dict of region name to a DataFrame sorted by fishing hours
+        """
+        return {
+            name: (
+                self.vessels_in_eezs(region, ownership_type, fishing_min)
+                if region_kind(region) == "eez"
+                else self.vessels_in_bbox(
+                    *region, ownership_type=ownership_type, fishing_min=fishing_min
+                )
+            )
+            for name, region in regions.items()
+        }
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) != 2:
+        print("Use example: python hotspots.py YYYYMMDD")
+        raise ValueError('Version date is supposed to be passed as "YYYYMMDD"')
+
+    #
+    # Setting
+    YYYYMMDD = sys.argv[1]
+    if len(YYYYMMDD) != 8:
+        raise ValueError("Version date is supposed to be passed as YYYYMMDD")
+
+    #
+    # Run
+    create_gridcode_eez_dim(YYYYMMDD)
+    hotspots = HotspotIndex.build(
+        YYYYMMDD,
+        fetch_eez_cells(YYYYMMDD),
+        fetch_ownership_by_mmsi(YYYYMMDD),
+        fetch_owner_identities(YYYYMMDD),
+    )
+    print(
+        f"{matrix_dir(YYYYMMDD, HOTSPOT_DEGREE)} indexed: {len(hotspots.row)} entries, "
+        f"{len(hotspots.eezs)} EEZs"
+    )
@@ -40,7 +40,9 @@ pd.set_option("max_rows", 20)
 # All tables are passed in as parameters so that changing here changes everywhere.
 
 # + tags=[]
-from config import PROJECT, PROJECT_PUBLIC, VERSION, EEZ_INFO_TABLE, IDENTITY_TABLE, OWNER_TABLE, OWNERSHIP_BY_MMSI_TABLE, PUBLIC_FISHING_EFFORT_TABLE
+from config import PROJECT, PROJECT_PUBLIC, VERSION, EEZ_INFO_TABLE, IDENTITY_TABLE, OWNER_TABLE, OWNERSHIP_BY_MMSI_TABLE, PUBLIC_FISHING_EFFORT_TABLE, GRIDCODE_EEZ_DIM_TABLE, QUERY_ENV
+from effort_matrix import EffortMatrix, matrix_dir, fetch_effort_by_identity, foreign_rows, unknown_rows
+from hotspots import HotspotIndex, HOTSPOT_DEGREE, create_gridcode_eez_dim, fetch_eez_cells, fetch_owner_identities, fetch_vessels_in_regions
 
 # Set raster resolution.
 DEGREE = 1
@@ -81,7 +83,7 @@ run_ownership_by_mmsi = True
 if run_ownership_by_mmsi:
     # Open ownership_by_mmsi.sql.j2 file
     with open('queries/ownership_by_mmsi.sql.j2') as f:
-        sql_template = Template(f.read())
+        sql_template = QUERY_ENV.from_string(f.read())
 
     # Format the query according to the desired features
     q = sql_template.render(
@@ -119,82 +121,72 @@ df_ownership_by_mmsi = pd.read_gbq(q, project_id='world-fishing-827', dialect='s
 
 df_ownership_by_mmsi
 
-# + [markdown] tags=[]
-# ### Get gridded fishing effort for all identities with foreign ownership
+# The EEZs of each gridcode, with their ISO3 codes and names, are precomputed once
+# in a dimension table (see `queries/gridcode_eez_dim.sql.j2`) that the EEZ
+# hotspot lookups join on gridcode.
 
 # +
-with open('queries/public_fishing_effort_foreign.sql.j2') as f:
-    sql_template = Template(f.read())
-    
-q = sql_template.render(
-    PROJECT=PROJECT,
-    PROJECT_PUBLIC=PROJECT_PUBLIC,
-    VERSION=VERSION,
-    OWNERSHIP_BY_MMSI_TABLE=OWNERSHIP_BY_MMSI_TABLE,
-    PUBLIC_FISHING_EFFORT_TABLE=PUBLIC_FISHING_EFFORT_TABLE,
-    DEGREE=DEGREE,
-)
+# The gridcode to EEZ dimension table of this version is built only if it does
+# not exist yet; set to True to rebuild it (e.g. after a regions table update)
+rebuild_gridcode_eez_dim = False
 
-# Uncomment `print(q)` to get the query being run for QA purposes
-# print(q)
-df_public_fishing_effort_foreign = pd.read_gbq(q, project_id='world-fishing-827', dialect='standard')
+table = create_gridcode_eez_dim(VERSION, overwrite=rebuild_gridcode_eez_dim)
+print(f"Gridcode to EEZ dimension table: {table}")
 # -
 
-# ### Get gridded fishing effort for all identities with unknown ownership
-#
-# This includes matched vessels without known ownership flag AND all fishing
-# effort in the public data set not attributed to a matched vessel.
-
 # +
-with open('queries/public_fishing_effort_unknown.sql.j2') as f:
-    sql_template = Template(f.read())
-    
-q = sql_template.render(
-    PROJECT=PROJECT,
-    PROJECT_PUBLIC=PROJECT_PUBLIC,
-    VERSION=VERSION,
-    OWNERSHIP_BY_MMSI_TABLE=OWNERSHIP_BY_MMSI_TABLE,
-    PUBLIC_FISHING_EFFORT_TABLE=PUBLIC_FISHING_EFFORT_TABLE,
-    DEGREE=DEGREE,
-)
+# Set to True to check once that the dimension table gives the same EEZ ISO3 codes
+# as `udfs.eez_id_to_iso3`, used by the former EEZ query
+check_gridcode_eez_dim = False
 
-# Uncomment `print(q)` to get the query being run for QA purposes
-# print(q)
-df_public_fishing_effort_unknown = pd.read_gbq(q, project_id='world-fishing-827', dialect='standard')
+if check_gridcode_eez_dim:
+    with open('queries/util/check_gridcode_eez_dim.sql.j2') as f:
+        sql_template = QUERY_ENV.from_string(f.read())
+
+    q = sql_template.render(
+        PROJECT=PROJECT,
+        VERSION=VERSION,
+        GRIDCODE_EEZ_DIM_TABLE=GRIDCODE_EEZ_DIM_TABLE,
+    )
+    df_eez_mismatch = pd.read_gbq(q, project_id='world-fishing-827', dialect='standard')
+    print(f"{len(df_eez_mismatch)} EEZ ids with an ISO3 code different from udfs.eez_id_to_iso3")
+    print(df_eez_mismatch.to_string(index=False))
 # -
 
-# ### Get total gridded fishing effort in public data
+# + [markdown] tags=[]
+# ### Get gridded fishing effort by identity
 #
-# Needed to calulate the ratio of foreign and unknown fishing to total fishing
-# IN ADDITION TO being the y-axis in the bivariate map. Thus why it was queried 
-# separately and ratio was not calculated in the previous fishing effort queries 
-# for identities with foreign or unknown ownership.
+# Fishing effort is pulled once by year, MMSI and covering identities and kept locally as a
+# memory-mapped vessel x cell matrix (see `effort_matrix.py`). Set to True to
+# (re)build it; otherwise the local copy is used.
 
 # +
-with open('queries/public_fishing_effort_total.sql.j2') as f:
-    sql_template = Template(f.read())
-    
-q = sql_template.render(
-    PROJECT=PROJECT,
-    PROJECT_PUBLIC=PROJECT_PUBLIC,
-    PUBLIC_FISHING_EFFORT_TABLE=PUBLIC_FISHING_EFFORT_TABLE,
-    DEGREE=DEGREE,
-)
+build_effort_matrix = not os.path.exists(os.path.join(matrix_dir(VERSION, DEGREE), 'rows.parquet'))
 
-# Uncomment `print(q)` to get the query being run for QA purposes
-# print(q)
-df_public_fishing_effort_total = pd.read_gbq(q, project_id='world-fishing-827', dialect='standard')
+if build_effort_matrix:
+    df_effort_by_identity = fetch_effort_by_identity(VERSION, DEGREE)
+    effort_matrix = EffortMatrix.build(df_effort_by_identity, df_ownership_by_mmsi, VERSION, DEGREE)
+else:
+    effort_matrix = EffortMatrix.load(VERSION, DEGREE)
+# -
 
-# + [markdown] tags=[]
-# ### Rasterize and calculate ratios
+# ### Rasterize fleets and calculate ratios
+#
+# Each fleet is a selection of matrix rows, by the identities covering them:
+# - foreign: fishing identities with foreign ownership (`public_fishing_effort_foreign.sql.j2`)
+# - unknown: matched vessels without known ownership flag AND all fishing effort
+#   in the public data set not attributed to a matched vessel (`public_fishing_effort_unknown.sql.j2`)
+# - total: all fishing effort in the public data, needed to calculate the ratio of
+#   foreign and unknown fishing to total fishing IN ADDITION TO being the y-axis in
+#   the bivariate map (`public_fishing_effort_total.sql.j2`)
+#
+# Any other ownership slice is a condition over `effort_matrix.members` passed to
+# `effort_matrix.covered`, without a new query.
 
 # +
-grid_foreign = psm.rasters.df2raster(df_public_fishing_effort_foreign, 'cell_ll_lon', 'cell_ll_lat', 
-                                     'fishing_hours', xyscale=1/DEGREE, per_km2=True)
-grid_unknown = psm.rasters.df2raster(df_public_fishing_effort_unknown, 'cell_ll_lon', 'cell_ll_lat', 
-                                     'fishing_hours', xyscale=1/DEGREE, per_km2=True)
-grid_total = psm.rasters.df2raster(df_public_fishing_effort_total, 'cell_ll_lon', 'cell_ll_lat', 
-                                     'total_fishing_in_cell', xyscale=1/DEGREE, per_km2=True)
+grid_foreign = effort_matrix.raster(foreign_rows(effort_matrix))
+grid_unknown = effort_matrix.raster(unknown_rows(effort_matrix))
+grid_total = effort_matrix.raster()
 
 grid_foreign_ratio = np.divide(grid_foreign, grid_total, out=np.zeros_like(grid_foreign), where=grid_total!=0)
 grid_unknown_ratio = np.divide(grid_unknown, grid_total, out=np.zeros_like(grid_unknown), where=grid_total!=0)
@@ -309,161 +301,56 @@ with psm.context(psm.styles.dark):
 
 # ## Exploring hotspots of fishing by foreign-owned vessels
 
-def get_vessels_fishing_in_eezs(eez_list, eez_info_table, version, owner_table, ownership_by_mmsi_table, public_fishing_effort_table, ownership_type=None, fishing_min=24):
+# Regions of interest, as lists of EEZ ISO3 codes or (lon_start, lat_start, lon_end, lat_end)
+# bounding boxes. Boxes with lon_start > lon_end wrap across the antimeridian and are
+# searched over lon_start..180 and -180..lon_end (the former bounding box query searched
+# 0..lon_end, which left out e.g. the eastern part of SPacific).
 
-    if not isinstance(eez_list, list):
-        print("ERROR: must give eezs as a list")
-        return
+WA_eez = ['SEN', 'GMB', 'GNB', 'SLE', 'LIB', 'CIV', 'GHA', 'TGO', 'BEN', 'NGA', 'CMR', 'GNQ', 'GAB', 'STP', 'COG', 'COD', 'AGO']
+hotspot_regions = {
+    'SPacific': (124.9, -30.4, -81.2, 13.8),
+    'KEN_SYC': ['KEN', 'SYC'],
+    'NWIO': (38.2, -14.8, 81.7, 12.13),
+    'ARG': ['ARG'],
+    'FLK': ['FLK'],
+    'WA_EEZ': WA_eez,
+}
+
+# Fishing effort by identity at the public data resolution (0.1 degree) is indexed
+# by grid cell once (see `hotspots.py`), so each region is a local lookup.
+# Set `use_local_hotspots` to False to get all regions from one warehouse query instead.
 
-    if not ownership_type:
-        ownership_check = 'TRUE'
+# +
+use_local_hotspots = True
+
+if use_local_hotspots:
+    build_hotspot_index = not os.path.exists(os.path.join(matrix_dir(VERSION, HOTSPOT_DEGREE), 'cell_ptr.npy'))
+    if build_hotspot_index:
+        EffortMatrix.build(fetch_effort_by_identity(VERSION, HOTSPOT_DEGREE), df_ownership_by_mmsi,
+                           VERSION, HOTSPOT_DEGREE)
+        hotspots = HotspotIndex.build(VERSION, fetch_eez_cells(VERSION),
+                                      df_ownership_by_mmsi, fetch_owner_identities(VERSION))
     else:
-        ownership_check = ownership_type
-
-    q = f'''
-    CREATE TEMP FUNCTION eez_id_to_name(_eez_id ANY TYPE) AS ((
-      WITH
-        mapped AS (
-          SELECT ARRAY_AGG (DISTINCT territory1 IGNORE NULLS) AS name_agg
-          FROM `{eez_info_table}`
-          WHERE SAFE_CAST (_eez_id AS INT64) = eez_id
-        )
-
-      SELECT
-        CASE
-          WHEN ARRAY_LENGTH (name_agg) > 1
-            THEN ERROR ("Multiple names match to the given EEZ ID.")
-          WHEN ARRAY_LENGTH (name_agg) = 1
-            THEN name_agg[OFFSET(0)]
-          ELSE NULL
-        END
-      FROM mapped
-    ));
-
-    WITH 
-
-    ## Get the fishing vessels of interest (i.e. foreign owned, domestic owned, etc)
-    ## Remove MMSI that have identities with overlapping time ranges
-    fishing_identities_of_interest AS (
-        SELECT 
-        mmsi,
-        vessel_record_id,
-        n_shipname,
-        n_callsign,
-        flag,
-        geartype,
-        first_timestamp,
-        last_timestamp,
-        FROM `{ownership_by_mmsi_table}{version}`
-        WHERE is_fishing
-        AND is_foreign
-        AND TRUE
-        AND NOT overlapping_identities_for_mmsi
-    ),
-
-    ## Get the fishing activity for each mmsi and their time ranges
-    ## The DISTINCT is crucial as it prevent duplication of fishing activity
-    ## When multiple identities are attached to one MMSI and have
-    ## overlapping time ranges.
-    fishing_of_interest_by_mmsi AS (
-        SELECT DISTINCT
-        a.*, b.* EXCEPT (mmsi),
-        FORMAT ("lon:%+07.2f_lat:%+07.2f", 
-            ROUND (cell_ll_lon/0.01)*0.01, 
-            ROUND (cell_ll_lat/0.01)*0.01) AS gridcode,
-        FROM fishing_identities_of_interest a
-        LEFT JOIN `{public_fishing_effort_table}` b
-        ON a.mmsi = b.mmsi
-        AND b.date BETWEEN DATE(a.first_timestamp) AND DATE(a.last_timestamp)
-        WHERE b.fishing_hours IS NOT NULL
-    ),
-
-    fishing_of_interest_by_mmsi_with_eez AS (
-        SELECT 
-          *, 
-          udfs.eez_id_to_iso3 (eez) AS eez_iso3,
-          eez_id_to_name(eez) AS eez_name,
-        FROM fishing_of_interest_by_mmsi 
-        INNER JOIN (
-          SELECT gridcode, eez
-          FROM `pipe_static.regions`
-          LEFT JOIN UNNEST(regions.eez) AS eez )
-        USING (gridcode)
-    ),
-
-    ## Group fishing effort for all identities in each EEZ
-    fishing_effort_by_eez AS (
-        SELECT 
-        mmsi AS ssvid, vessel_record_id, n_shipname, n_callsign, flag, geartype,
-        eez, eez_iso3, eez_name,
-        SUM(fishing_hours) AS fishing_hours
-        FROM fishing_of_interest_by_mmsi_with_eez
-        GROUP BY mmsi, vessel_record_id, n_shipname, n_callsign, flag, geartype, eez, eez_iso3, eez_name
-    )
-
-    SELECT *
-    FROM fishing_effort_by_eez
-    LEFT JOIN `{owner_table}{version}`
-    USING(ssvid, vessel_record_id, n_shipname, n_callsign, flag)
-    WHERE eez_iso3 IN UNNEST({eez_list})
-    AND fishing_hours > {fishing_min}
-    ORDER BY fishing_hours DESC
-    '''
-
-    return pd.read_gbq(q, project_id='world-fishing-827', dialect='standard')
-
-
-def get_vessels_fishing_in_bbox(lon_start, lat_start, lon_end, lat_end, version, owner_table, ownership_by_mmsi_table, ownership_type=None, fishing_min=24):
+        hotspots = HotspotIndex.load(VERSION)
+    foreign_fishing = hotspots.vessels_in_regions(hotspot_regions, ownership_type='is_foreign')
+else:
+    foreign_fishing = fetch_vessels_in_regions(hotspot_regions, VERSION, ownership_type='is_foreign')
+# -
 
-    ## Handle date line crossings for longitude
-    if lon_start > lon_end:
-        ## Then we're crossing the date line and we have to query a little differently.
-        lon_search = f'((cell_ll_lon BETWEEN {lon_start} AND 180) OR (cell_ll_lon BETWEEN 0 AND {lon_end}))'
-    else:
-        lon_search = f'cell_ll_lon BETWEEN {lon_start} AND {lon_end}'
-        
-    
-    if not ownership_type:
-        ownership_check = 'TRUE'
-    else:
-        ownership_check = ownership_type
-        
-    q = f'''
-    WITH 
-
-    mmsi_in_bbox AS (
-        SELECT
-        mmsi as ssvid,
-        SUM(fishing_hours) as fishing_hours
-        FROM `global-fishing-watch.gfw_public_data.fishing_effort_byvessel_v2`
-        -- lon_start, lat_start, lon_end, lat_end
-        -- EXAMPLE
-        -- -26.07,-17.92,14.61,9.48
-        -- WHERE cell_ll_lat BETWEEN -17.92 AND 9.48
-        -- AND cell_ll_lon BETWEEN -26.07 AND 14.61
-        WHERE cell_ll_lat BETWEEN {lat_start} AND {lat_end}
-        AND {lon_search}
-        GROUP BY mmsi
-        HAVING fishing_hours > {fishing_min}
-    )
+# Set `check_hotspot_sources` to True to plan the warehouse query (bytes it would process)
+# and compare its results with the local index, region by region, before relying on either.
 
-    SELECT a.*, b.fishing_hours, c.* EXCEPT(vessel_record_id, mmsi, n_shipname, n_callsign, flag)
-    FROM `{owner_table}{version}` a
-    JOIN mmsi_in_bbox b
-    USING (ssvid)
-    LEFT JOIN `{ownership_by_mmsi_table}{version}` c
-    ON a.ssvid = c.mmsi
-    AND a.vessel_record_id = c.vessel_record_id
-    AND a.n_shipname = c.n_shipname
-    AND a.n_callsign = c.n_callsign
-    AND a.flag = c.flag
-    WHERE {ownership_check}
-    AND (is_fishing OR is_fishing IS NULL)
-    AND fishing_hours > {fishing_min}
-    ORDER BY fishing_hours DESC
-    '''
-
-    return pd.read_gbq(q, project_id='world-fishing-827', dialect='standard')
+# +
+check_hotspot_sources = False
+
+if check_hotspot_sources:
+    print(f"{fetch_vessels_in_regions(hotspot_regions, VERSION, ownership_type='is_foreign', dry_run=True) / 1e9:.1f} GB processed")
+    local = HotspotIndex.load(VERSION).vessels_in_regions(hotspot_regions, ownership_type='is_foreign')
+    warehouse = fetch_vessels_in_regions(hotspot_regions, VERSION, ownership_type='is_foreign')
+    for region in hotspot_regions:
+        print(region, len(local[region]), len(warehouse[region]),
+              f"{local[region].fishing_hours.sum():.1f}", f"{warehouse[region].fishing_hours.sum():.1f}")
+# -
 
 # Parameters used for visualizations
 color_dark_pink = '#d73b68'
@@ -509,7 +396,7 @@ def plot_stats_for_vessels(df):
 # ## South Pacific
 # -
 
-foreign_fishing_SPacific = get_vessels_fishing_in_bbox(124.9, -30.4, -81.2, 13.8, VERSION, OWNER_TABLE, OWNERSHIP_BY_MMSI_TABLE, ownership_type='is_foreign')
+foreign_fishing_SPacific = foreign_fishing['SPacific']
 
 foreign_fishing_SPacific[['flag', 'owner_flag', 'geartype']].value_counts()
 
@@ -521,7 +408,7 @@ fig, (ax0, ax1, ax2) = plot_stats_for_vessels(foreign_fishing_SPacific)
 # ### Kenya and Seychelles EEZs (KEN and SYC)
 # -
 
-foreign_fishing_KEN_SYC = get_vessels_fishing_in_eezs(['KEN', 'SYC'], EEZ_INFO_TABLE, VERSION, OWNER_TABLE, OWNERSHIP_BY_MMSI_TABLE, f"{PROJECT_PUBLIC}.{PUBLIC_FISHING_EFFORT_TABLE}", 'is_foreign')
+foreign_fishing_KEN_SYC = foreign_fishing['KEN_SYC']
 
 
 # + tags=[]
@@ -532,7 +419,7 @@ fig, (ax0, ax1, ax2) = plot_stats_for_vessels(foreign_fishing_KEN_SYC)
 
 # ### Full Region (by bounding box)
 
-foreign_fishing_NWIO = foreign_fishing_IO = get_vessels_fishing_in_bbox(38.2, -14.8, 81.7, 12.13, VERSION, OWNER_TABLE, OWNERSHIP_BY_MMSI_TABLE, ownership_type='is_foreign')
+foreign_fishing_NWIO = foreign_fishing_IO = foreign_fishing['NWIO']
 
 foreign_fishing_NWIO[['flag', 'owner_flag', 'geartype']].value_counts()
 
@@ -540,7 +427,7 @@ fig, (ax0, ax1, ax2) = plot_stats_for_vessels(foreign_fishing_NWIO)
 
 # ## Argentina EEZ
 
-foreign_fishing_ARG = get_vessels_fishing_in_eezs(['ARG'], EEZ_INFO_TABLE, VERSION, OWNER_TABLE, OWNERSHIP_BY_MMSI_TABLE, f"{PROJECT_PUBLIC}.{PUBLIC_FISHING_EFFORT_TABLE}", 'is_foreign')
+foreign_fishing_ARG = foreign_fishing['ARG']
 
 foreign_fishing_ARG[['flag', 'owner_flag']].value_counts()
 
@@ -548,7 +435,7 @@ fig, (ax0, ax1, ax2) = plot_stats_for_vessels(foreign_fishing_ARG)
 
 # ## Falkland/Malvinas Islands EEZ (FLK)
 
-foreign_fishing_FLK = get_vessels_fishing_in_eezs(['FLK'], EEZ_INFO_TABLE, VERSION, OWNER_TABLE, OWNERSHIP_BY_MMSI_TABLE, f"{PROJECT_PUBLIC}.{PUBLIC_FISHING_EFFORT_TABLE}", 'is_foreign')
+foreign_fishing_FLK = foreign_fishing['FLK']
 
 foreign_fishing_FLK[['flag', 'owner_flag']].value_counts()
 
@@ -558,8 +445,7 @@ fig, (ax0, ax1, ax2) = plot_stats_for_vessels(foreign_fishing_FLK)
 # ## West Africa EEZs
 # -
 
-WA_eez = ['SEN', 'GMB', 'GNB', 'SLE', 'LIB', 'CIV', 'GHA', 'TGO', 'BEN', 'NGA', 'CMR', 'GNQ', 'GAB', 'STP', 'COG', 'COD', 'AGO']
-foreign_fishing_WA_EEZ = get_vessels_fishing_in_eezs(WA_eez, EEZ_INFO_TABLE, VERSION, OWNER_TABLE, OWNERSHIP_BY_MMSI_TABLE, f"{PROJECT_PUBLIC}.{PUBLIC_FISHING_EFFORT_TABLE}", 'is_foreign')
+foreign_fishing_WA_EEZ = foreign_fishing['WA_EEZ']
 
 
 foreign_fishing_WA_EEZ.owner_flag.value_counts()
@@ -575,8 +461,8 @@ fig, (ax0, ax1, ax2) = plot_stats_for_vessels(foreign_fishing_WA_EEZ)
 print(f"About two-thirds of the identities in our dataset have at least one owner with a known flag state.")
 print(df_ownership_by_mmsi[~df_ownership_by_mmsi.is_unknown].shape[0]/df_ownership_by_mmsi.shape[0])
 
-unknown_fishing_hours = df_public_fishing_effort_unknown.fishing_hours.sum()
-total_fishing_hours = df_public_fishing_effort_total.total_fishing_in_cell.sum()
+unknown_fishing_hours = effort_matrix.raster(unknown_rows(effort_matrix), per_km2=False).sum()
+total_fishing_hours = effort_matrix.raster(per_km2=False).sum()
 known_fishing_hours = total_fishing_hours - unknown_fishing_hours
 print(f"These vessels account for {known_fishing_hours/total_fishing_hours*100:0.2f}% of total fishing activity since 2012.")
 
@@ -584,7 +470,7 @@ print(f"These vessels account for {known_fishing_hours/total_fishing_hours*100:0
 # +
 # Open prop_single_owner_flag_identities.sql.j2 file
 with open('queries/util/prop_single_owner_flag_identities.sql.j2') as f:
-    sql_template = Template(f.read())
+    sql_template = QUERY_ENV.from_string(f.read())
     
 # Format the query according to the desired features
 q = sql_template.render(
@@ -55,7 +55,7 @@ color_yellow = '#ebe55d'
 #
 # All tables are passed in as parameters so that changing in `queries/config.py` changes everywhere.
 
-from config import PROJECT, VERSION, IDENTITY_TABLE, OWNER_TABLE, EEZ_INFO_TABLE, REFLAGGING_TABLE, FLAGS_OF_CONVENIENCE_TABLE
+from config import PROJECT, VERSION, IDENTITY_TABLE, OWNER_TABLE, EEZ_INFO_TABLE, REFLAGGING_TABLE, FLAGS_OF_CONVENIENCE_TABLE, QUERY_ENV
 
 # ## Figures folder setup
 #
@@ -86,7 +86,7 @@ if not os.path.exists(figures_folder):
 # +
 # Open ownership_by_flag.sql.j2 file
 with open('queries/ownership_by_flag.sql.j2') as f:
-    sql_template = Template(f.read())
+    sql_template = QUERY_ENV.from_string(f.read())
     
 # Format the query according to the desired features
 q = sql_template.render(
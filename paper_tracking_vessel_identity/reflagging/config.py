@@ -3,8 +3,26 @@ PROJECT = "world-fishing-827"
 DATASET = "vessel_identity"
 STAGING = "vessel_identity_staging"
 IDENTITY_CORE_DATA = "identity_core_v"
+REFLAGGING_CORE = "reflagging_core_v"
 REFLAGGING_CORE_ALL = "reflagging_core_all_v"
 REFLAGGING_CORE_FISHING = "reflagging_core_fishing_v"
 REFLAGGING_CORE_SUPPORT = "reflagging_core_support_v"
+REFLAGGING_TRANSITION_CUBE = "reflagging_transition_cube_v"
+IDENTITY_STITCHER_CORE_FILTERED = "identity_stitcher_core_filtered_v"
 ALL_FLAGGING_SUPPORT = "all_flagging_support"
+FLAG_GROUPING = "flag_grouping_v"
+FLAGS_OF_CONVENIENCE = "gfw_research.flags_of_convenience_v20211013"
+EEZ_INFO = "gfw_research.eez_info"
+#
+# Flags grouped as "EU" (EU member states and GBR), the single list used by
+# `create_flag_grouping.sql.j2` and `flag_grouping.py`
+EU_FLAGS = [
+    'AUT', 'BEL', 'BGR', 'HRV', 'CYP',
+    'CZE', 'DNK', 'EST', 'FIN', 'FRA',
+    'DEU', 'GRC', 'HUN', 'IRL', 'ITA',
+    'LVA', 'LTU', 'LUX', 'MLT', 'NLD',
+    'POL', 'PRT', 'ROU', 'SVK', 'SVN',
+    'ESP', 'SWE', 'GBR']  # 'CYM', 'GIB', 'GRL'
+END_DATE = "2022-01-01"
+TOP_N = 15
 
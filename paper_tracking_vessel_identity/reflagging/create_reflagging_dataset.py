@@ -12,16 +12,18 @@
 import sys
 import os
 import re
-from config import PROJECT, DATASET, STAGING, IDENTITY_CORE_DATA, \
-    REFLAGGING_CORE_ALL, REFLAGGING_CORE_FISHING, REFLAGGING_CORE_SUPPORT, ALL_FLAGGING_SUPPORT
+from config import PROJECT, DATASET, STAGING, IDENTITY_CORE_DATA, REFLAGGING_CORE, \
+    REFLAGGING_CORE_ALL, REFLAGGING_CORE_FISHING, REFLAGGING_CORE_SUPPORT, ALL_FLAGGING_SUPPORT, END_DATE, TOP_N, \
+    REFLAGGING_TRANSITION_CUBE, IDENTITY_STITCHER_CORE_FILTERED, FLAG_GROUPING, FLAGS_OF_CONVENIENCE, EEZ_INFO, EU_FLAGS
 
 
-def j2_command (sf, table_name, YYYYMMDD, category=None):
+def j2_command (sf, table_name, YYYYMMDD, category=None, clustering_fields=None):
     """
     This module returns a command that runs the corresponding Jinja2 file.
 
     :param sf: String, the sql file name
     :param category: String, if there's any parameter about category to pass
+    :param clustering_fields: String, comma-separated fields to cluster the destination table by
     :return: String, j2 command
     """
 
@@ -30,6 +32,11 @@ def j2_command (sf, table_name, YYYYMMDD, category=None):
     else:
         param_cat = ""
 
+    if clustering_fields is not None:
+        param_cluster = f"--clustering_fields={clustering_fields}"
+    else:
+        param_cluster = ""
+
     command = f"""jinja2 {sf} \
         -D PROJECT={PROJECT}\
         -D DATASET={DATASET}\
@@ -40,15 +47,43 @@ def j2_command (sf, table_name, YYYYMMDD, category=None):
         -D REFLAGGING_CORE_FISHING={REFLAGGING_CORE_FISHING}\
         -D REFLAGGING_CORE_SUPPORT={REFLAGGING_CORE_SUPPORT}\
         -D ALL_FLAGGING_SUPPORT={ALL_FLAGGING_SUPPORT}\
+        -D REFLAGGING_CORE={REFLAGGING_CORE}\
+        -D IDENTITY_STITCHER_CORE_FILTERED={IDENTITY_STITCHER_CORE_FILTERED}\
+        -D FLAG_GROUPING={FLAG_GROUPING}\
+        -D FLAGS_OF_CONVENIENCE={FLAGS_OF_CONVENIENCE}\
+        -D EEZ_INFO={EEZ_INFO}\
+        -D EU_FLAGS={",".join(EU_FLAGS)}\
         {param_cat}\
-        -D END_DATE=2022-01-01\
+        -D END_DATE={END_DATE}\
+        -D TOP_N={TOP_N}\
         | bq query \
         --destination_table={table_name} \
+        {param_cluster} \
         --replace --use_legacy_sql=false"""
 
     return command
 
 
+def view_command (view_name, table_name, category, YYYYMMDD):
+    """
+    This module returns a command that creates (or replaces) a view
+    showing only one vessel category of a table clustered by category.
+
+    :param view_name: String, the view name without version (e.g. reflagging_core_fishing_v)
+    :param table_name: String, the source table name without version (e.g. reflagging_core_v)
+    :param category: String, vessel category to keep (all, fishing, support)
+    :return: String, bq command
+    """
+
+    command = f"""bq query --use_legacy_sql=false \
+        'CREATE OR REPLACE VIEW `{PROJECT}.{DATASET}.{view_name}{YYYYMMDD}` AS
+        SELECT * EXCEPT (category)
+        FROM `{PROJECT}.{DATASET}.{table_name}{YYYYMMDD}`
+        WHERE category = "{category}"'"""
+
+    return command
+
+
 def run_queries (YYYYMMDD):
     """
     This module runs all the query scripts in the directory
@@ -60,8 +95,10 @@ def run_queries (YYYYMMDD):
     #
     # Read all SQL file names in the directory
     sqlfiles = [
+        "create_flag_grouping.sql.j2",
         "create_reflagging_core.sql.j2",
         "create_reflagging_flag_in_out.sql.j2",
+        "create_reflagging_transition_cube.sql.j2",
         "create_reflagging_history_map_top15.sql.j2",
         "staging_all_flagging_support.sql.j2",
         "create_all_flagging_support.sql.j2",
@@ -75,20 +112,25 @@ def run_queries (YYYYMMDD):
         # NEW SCRIPT TO RUN QUERIES VIA JINJA2 TEMPLATE
         if sf == "create_reflagging_core.sql.j2":
             #
-            # Core reflagging dataset
+            # Core reflagging dataset, all categories computed in one pass
+            # and stored in a single table clustered by category
+            table_name = f"{PROJECT}:{DATASET}.{REFLAGGING_CORE}{YYYYMMDD}"
+            command = j2_command(sf, table_name, YYYYMMDD, clustering_fields="category")
+            assert os.system(command) == 0, "Query failed"
+            print(f"{table_name} is now available...\n")
+
+            #
+            # Per-category views keep the previous table names for downstream queries
             category_map = {
-                "all": '"is_fishing OR is_carrier OR is_bunker"',
-                "fishing": "is_fishing",
-                "support": '"is_carrier OR is_bunker"'
+                "all": REFLAGGING_CORE_ALL,
+                "fishing": REFLAGGING_CORE_FISHING,
+                "support": REFLAGGING_CORE_SUPPORT
             }
 
             for cat in category_map.keys():
-                table_name = f"{PROJECT}:{DATASET}." + \
-                             re.sub(r"(.sql.j2|create_)", "", sf) + \
-                             f"_{cat}_v{YYYYMMDD}"
-                command = j2_command(sf, table_name, YYYYMMDD, category_map[cat])
+                command = view_command(category_map[cat], REFLAGGING_CORE, cat, YYYYMMDD)
                 assert os.system(command) == 0, "Query failed"
-                print(f"{table_name} is now available...\n")
+                print(f"{PROJECT}:{DATASET}.{category_map[cat]}{YYYYMMDD} is now available...\n")
         #
         # Reflagging history map data and byyear plot data
         elif sf in ("create_reflagging_history_map_top15.sql.j2",
@@ -106,6 +148,13 @@ def run_queries (YYYYMMDD):
                 assert os.system(command) == 0, "Query failed"
                 print(f"{table_name} is now available...\n")
         #
+        # Flag transition cube, clustered for slicing by source and category
+        elif sf == "create_reflagging_transition_cube.sql.j2":
+            table_name = f"{PROJECT}:{DATASET}.{REFLAGGING_TRANSITION_CUBE}{YYYYMMDD}"
+            command = j2_command(sf, table_name, YYYYMMDD, clustering_fields="source,category")
+            assert os.system(command) == 0, "Query failed"
+            print(f"{table_name} is now available...\n")
+        #
         # All support figure staging data
         elif "staging" in sf:
             table_name = f"{PROJECT}:{STAGING}." + \
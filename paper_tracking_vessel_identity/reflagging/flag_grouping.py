@@ -0,0 +1,104 @@
+#-------------------------------------------------------------
+#-- Flag grouping registry
+#-- This module loads the versioned flag grouping table
+#-- (`flag_grouping_v{YYYYMMDD}`, created by
+#-- `create_flag_grouping.sql.j2`) into cached in-memory lookups
+#-- and remaps flags under any grouping (eu, foc, sovereign) with
+#-- one vectorized take over the distinct flags. Reflagging blocks
+#-- can then be regrouped from the same base blocks without
+#-- re-running the reflagging core.
+#--
+#-- Example:
+#--   blocks = flag_blocks(load_identity_core(YYYYMMDD), only_reflagging=False)
+#--   foc_blocks = regroup_blocks(blocks, "foc", YYYYMMDD)
+#-------------------------------------------------------------
+import os
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from config import PROJECT, DATASET, FLAG_GROUPING, EU_FLAGS
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(ROOT_DIR, "..", "..", "data", "flag_grouping")
+
+GROUPINGS = ["eu", "foc", "sovereign"]
+
+
+@lru_cache(maxsize=None)
+def load_flag_grouping(YYYYMMDD):
+    """
+    Read the flag grouping table of a version, from the local cache if present,
+    otherwise from BigQuery (and cache it)
+
+    :param YYYYMMDD: vessel identity data version
+    :return: DataFrame with grouping_name, flag and flag_group
+    """
+    path = os.path.join(CACHE_DIR, f"{FLAG_GROUPING}{YYYYMMDD}.csv")
+    if os.path.exists(path):
+        return pd.read_csv(path, keep_default_na=False)
+
+    q = f"""
+    SELECT grouping_name, flag, flag_group
+    FROM `{PROJECT}.{DATASET}.{FLAG_GROUPING}{YYYYMMDD}`
+    """
+    df = pd.read_gbq(q, project_id=PROJECT, dialect='standard')
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    df.to_csv(path, index=False)
+    return df
+
+
+@lru_cache(maxsize=None)
+def group_map(grouping, YYYYMMDD=None):
+    """
+    Mapping of flag to its group under a grouping. Flags not in the mapping
+    keep their own flag. The EU grouping is built in and needs no version.
+
+    :param grouping: String, eu, foc or sovereign
+    :param YYYYMMDD: vessel identity data version of the flag grouping table
+    :return: Dict of flag to group
+    """
+    if grouping not in GROUPINGS:
+        raise ValueError(f"grouping must be one of {GROUPINGS}")
+    if YYYYMMDD is None:
+        if grouping != "eu":
+            raise ValueError(f'A version is required for the "{grouping}" grouping')
+        return {flag: "EU" for flag in EU_FLAGS}
+
+    df = load_flag_grouping(YYYYMMDD)
+    df = df[df["grouping_name"] == grouping]
+    return dict(zip(df["flag"], df["flag_group"]))
+
+
+def remap_flags(flags, grouping, YYYYMMDD=None):
+    """
+    Remap flags to their group. Only the distinct flags are looked up in the
+    dictionary; every row is then remapped with one take on the codes.
+
+    :param flags: Array-like of flags (missing values stay missing)
+    :param grouping: String, eu, foc or sovereign
+    :param YYYYMMDD: vessel identity data version of the flag grouping table
+    :return: numpy object array of groups
+    """
+    mapping = group_map(grouping, YYYYMMDD)
+    codes, uniques = pd.factorize(pd.Series(flags))
+    groups = np.array([mapping.get(f, f) for f in uniques] + [None], dtype=object)
+    return groups[codes]
+
+
+def regroup_blocks(blocks, grouping, YYYYMMDD=None, column="flag_group"):
+    """
+    Regroup flag blocks (see `reflagging_blocks.flag_blocks`) under another
+    grouping and mark the vessels that changed groups, the equivalent of
+    `flag_eu` and `reflag_outside_eu` for the EU grouping.
+
+    :param blocks: DataFrame with vessel_record_id and flag
+    :param grouping: String, eu, foc or sovereign
+    :param YYYYMMDD: vessel identity data version of the flag grouping table
+    :param column: String, name of the group column to add
+    :return: DataFrame with `column` and `reflag_outside_group`
+    """
+    out = blocks.copy()
+    out[column] = remap_flags(out["flag"], grouping, YYYYMMDD)
+    out["reflag_outside_group"] = out.groupby("vessel_record_id")[column] \
+        .transform("nunique").to_numpy() > 1
+    return out
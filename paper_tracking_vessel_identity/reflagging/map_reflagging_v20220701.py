@@ -16,6 +16,8 @@
 # # Vessel Reflagging History and Ranking By Year
 
 import matplotlib.pyplot as plt
+import matplotlib.colors as mpcolors
+import matplotlib.dates as mdates
 import pandas as pd
 import numpy as np
 
@@ -23,6 +25,11 @@ import numpy as np
 # Version of the data 
 YYYYMMDD = '20220701'
 
+#
+# Draw the activity of reflagging history figures as one image (imshow)
+# instead of one scatter marker per 5-day window
+RASTER = True
+
 # ## Reflagging History of Fishing and Support Vessels
 
 # +
@@ -76,12 +83,60 @@ colors_for_flag = {
 }
 
 def color_mapping (flags):
-    col = flags.apply(lambda x: colors_for_flag[x] 
-                      if x in colors_for_flag.keys() 
-                      else colors_for_flag['OTHERS'])
+    col = flags.map(colors_for_flag).fillna(colors_for_flag['OTHERS'])
     return col
 
 
+#
+# Lookup table from flag code to RGBA, the last row (code -1) is transparent
+flag_codes = pd.Index(list(colors_for_flag.keys()))
+flag_lut = np.vstack([mpcolors.to_rgba_array(list(colors_for_flag.values())),
+                      [[0, 0, 0, 0]]])
+
+def activity_raster (df, start=pd.Timestamp("2012-01-01"), end=pd.Timestamp("2022-01-01"), bin_days=5):
+    """
+    Bin activity rows into a (vessel x time bin) image of flag codes.
+    Vessels keep their order of first appearance, the same order a scatter
+    plot on a categorical y-axis uses, and empty cells are -1.
+    
+    :param df: DataFrame with vessel_record_id, timestamp and flag
+    :param start: Timestamp, start of the first time bin
+    :param end: Timestamp, end of the last time bin
+    :param bin_days: Integer, width of a time bin in days
+    :return: Tuple of (int16 image, time extent as matplotlib date numbers)
+    """
+    vessel, vessels = pd.factorize(df['vessel_record_id'], sort=False)
+    ts = pd.to_datetime(df['timestamp']).dt.tz_localize(None)
+    n_bins = int(np.ceil((end - start) / pd.Timedelta(days=bin_days)))
+    tbin = ((ts - start) // pd.Timedelta(days=bin_days)).to_numpy()
+    
+    flag = flag_codes.get_indexer(df['flag'])
+    flag = np.where(flag < 0, flag_codes.get_loc('OTHERS'), flag)
+    
+    image = np.full((len(vessels), n_bins), -1, np.int16)
+    inside = (tbin >= 0) & (tbin < n_bins)
+    image[vessel[inside], tbin[inside]] = flag[inside]
+    
+    extent = mdates.date2num([start, start + pd.Timedelta(days=bin_days * n_bins)])
+    return image, extent
+
+def plot_activity_raster (ax, df, **kwargs):
+    """
+    Draw the activity of each vessel as one image colored by flag, with one
+    row per vessel (y = 0, 1, ... as in a categorical scatter plot)
+    
+    :param ax: matplotlib Axes
+    :param df: DataFrame with vessel_record_id, timestamp and flag
+    :param kwargs: Passed to `activity_raster`
+    :return: AxesImage
+    """
+    image, extent = activity_raster(df, **kwargs)
+    im = ax.imshow(flag_lut[image], aspect='auto', interpolation='nearest', origin='lower',
+                   extent=[extent[0], extent[1], -0.5, image.shape[0] - 0.5])
+    ax.xaxis_date()
+    return im
+
+
 # -
 
 # ## Reflagging History of Fishing Vessels
@@ -102,10 +157,13 @@ top_fishing = pd.read_gbq(q, project_id='world-fishing-827', dialect='standard')
 df_reflag_fishing = top_fishing[top_fishing['rank_1'] <= 15].copy()
 fig = plt.figure(figsize=(8, 10), dpi=500, facecolor='#f7f7f7')
 ax = fig.add_subplot(111)
-ax.scatter(df_reflag_fishing.timestamp,
-           df_reflag_fishing.vessel_record_id,
-           facecolor=color_mapping(df_reflag_fishing.flag),
-           s=1.1, edgecolor='none', alpha=1)
+if RASTER:
+    plot_activity_raster(ax, df_reflag_fishing)
+else:
+    ax.scatter(df_reflag_fishing.timestamp,
+               df_reflag_fishing.vessel_record_id,
+               facecolor=color_mapping(df_reflag_fishing.flag),
+               s=1.1, edgecolor='none', alpha=1)
 
 #
 # Add current flag information on y-axis on the right side
@@ -200,10 +258,13 @@ top_support = pd.read_gbq(q, project_id='world-fishing-827', dialect='standard')
 df_reflag_support = top_support[top_support['rank_1'] <= 15].copy()
 fig = plt.figure(figsize=(8, 10), dpi=500, facecolor='#f7f7f7')
 ax = fig.add_subplot(111)
-ax.scatter(df_reflag_support.timestamp, 
-           df_reflag_support.vessel_record_id, 
-           facecolor=color_mapping(df_reflag_support.flag), 
-           s=0.9, edgecolor='none', alpha=1)
+if RASTER:
+    plot_activity_raster(ax, df_reflag_support)
+else:
+    ax.scatter(df_reflag_support.timestamp, 
+               df_reflag_support.vessel_record_id, 
+               facecolor=color_mapping(df_reflag_support.flag), 
+               s=0.9, edgecolor='none', alpha=1)
 
 #
 # Add current flag information on y-axis on the right side
@@ -301,10 +362,13 @@ all_flagging_support = pd.read_gbq(q, project_id='world-fishing-827', dialect='s
 df_all_support = all_flagging_support[all_flagging_support['rank_1'] <= 15].copy()
 fig = plt.figure(figsize=(10, 12), dpi=500, facecolor='white')
 ax = fig.add_subplot(111)
-ax.scatter(df_all_support.timestamp, 
-           df_all_support.vessel_record_id, 
-           facecolor=color_mapping(df_all_support.flag), 
-           s=0.8, edgecolor='none', alpha=1)
+if RASTER:
+    plot_activity_raster(ax, df_all_support)
+else:
+    ax.scatter(df_all_support.timestamp, 
+               df_all_support.vessel_record_id, 
+               facecolor=color_mapping(df_all_support.flag), 
+               s=0.8, edgecolor='none', alpha=1)
 
 #
 # Add current flag information on y-axis on the right side
@@ -0,0 +1,371 @@
+#-------------------------------------------------------------
+#-- Local flag-block engine for reflagging analysis
+#-- This module reproduces the core steps of
+#-- `create_reflagging_core.sql.j2` (collapsing MMSI-only changes
+#-- into flag blocks, cutting to end date and keeping vessels that
+#-- changed flags) with NumPy run-length operations, so that
+#-- whole-fleet reflagging blocks can be recomputed locally for
+#-- ad-hoc EU-grouping or end-date variants.
+#--
+#-- Each step sorts once, detects boundaries by comparing shifted
+#-- arrays and reduces with `ufunc.reduceat`/`accumulate` instead of
+#-- window functions.
+#--
+#-- Run the following command (with date version as YYYYMMDD):
+#-- `python reflagging_blocks.py YYYYMMDD [category] [end_date]`
+#-------------------------------------------------------------
+import sys
+import heapq
+import numpy as np
+import pandas as pd
+from config import PROJECT, DATASET, IDENTITY_CORE_DATA, END_DATE, TOP_N, EU_FLAGS
+
+CORE_COLUMNS = [
+    "vessel_record_id", "ssvid", "n_shipname", "n_callsign", "flag",
+    "is_fishing", "is_carrier", "is_bunker",
+    "first_timestamp", "last_timestamp", "timestamp_overlap"]
+
+#
+# Missing timestamps are encoded with the smallest int64 so that they sort
+# first, the same way NULLs do in ascending BigQuery ORDER BY
+NAT = np.iinfo(np.int64).min
+
+
+def load_identity_core(YYYYMMDD):
+    """
+    Pull the fields of the identity core table needed to build flag blocks
+
+    :param YYYYMMDD: vessel identity data version
+    :return: DataFrame
+    """
+    q = f"""
+    SELECT {", ".join(CORE_COLUMNS)}
+    FROM `{PROJECT}.{DATASET}.{IDENTITY_CORE_DATA}{YYYYMMDD}`
+    WHERE is_fishing OR is_carrier OR is_bunker
+    """
+    return pd.read_gbq(q, project_id=PROJECT, dialect='standard')
+
+
+def category_mask(df, category="all"):
+    """
+    Select identities of a vessel category as `create_reflagging_dataset.py` does
+
+    :param df: DataFrame of identity core
+    :param category: String, all, fishing or support
+    :return: Boolean numpy array
+    """
+    is_fishing = df["is_fishing"].fillna(False).to_numpy(bool)
+    is_support = df["is_carrier"].fillna(False).to_numpy(bool) | \
+        df["is_bunker"].fillna(False).to_numpy(bool)
+    if category == "all":
+        return is_fishing | is_support
+    elif category == "fishing":
+        return is_fishing
+    elif category == "support":
+        return is_support
+    raise ValueError('category must be one of "all", "fishing" or "support"')
+
+
+def _codes(values):
+    """
+    Integer codes of a column, -1 where missing
+    """
+    codes, uniques = pd.factorize(pd.Series(values), sort=True)
+    return codes.astype(np.int64), uniques
+
+
+def _epoch_us(values):
+    """
+    Timestamps as int64 epoch microseconds, NAT where missing
+    """
+    ts = pd.to_datetime(pd.Series(values), utc=True)
+    out = ts.dt.tz_convert(None).to_numpy().astype("datetime64[us]").astype(np.int64)
+    out[ts.isna().to_numpy()] = NAT
+    return out
+
+
+def _starts(*keys):
+    """
+    Boolean array marking the first row of each run of identical keys
+    (keys are already sorted)
+    """
+    n = len(keys[0])
+    start = np.zeros(n, bool)
+    if n:
+        start[0] = True
+    for k in keys:
+        start[1:] |= k[1:] != k[:-1]
+    return start
+
+
+def _same_as_neighbour(order, group, fields, step):
+    """
+    For rows in `order`, whether all `fields` equal those of the previous
+    (step=1) or next (step=-1) row of the same group. As with SQL `=`,
+    missing values (-1) never compare equal.
+    """
+    n = len(order)
+    same = np.zeros(n, bool)
+    if n < 2:
+        return same
+    g = group[order]
+    cur = slice(1, None) if step == 1 else slice(None, -1)
+    nbr = slice(None, -1) if step == 1 else slice(1, None)
+    eq = g[cur] == g[nbr]
+    for f in fields:
+        v = f[order]
+        eq &= (v[cur] == v[nbr]) & (v[cur] >= 0)
+    same_sorted = np.zeros(n, bool)
+    same_sorted[cur] = eq
+    same[order] = same_sorted
+    return same
+
+
+def _segmented_running(group, values, reverse=False):
+    """
+    Running maximum (or, with reverse=True, running minimum taken from the end)
+    of int64 values within each group, ignoring NAT. Rows must be sorted by group.
+
+    Values are replaced by their rank and offset by the group index, so a single
+    `np.maximum.accumulate` (or `np.minimum.accumulate`) can never carry a value
+    across a group boundary.
+    """
+    valid = values != NAT
+    uniq = np.unique(values[valid])
+    m = len(uniq) + 1
+    rank = np.where(valid, np.searchsorted(uniq, values) + 1, 0 if not reverse else m)
+    key = group.astype(np.int64) * (m + 1) + rank
+    if not reverse:
+        acc = np.maximum.accumulate(key)
+    else:
+        acc = np.minimum.accumulate(key[::-1])[::-1]
+    acc_rank = acc - group.astype(np.int64) * (m + 1)
+    out = np.full(len(values), NAT, np.int64)
+    found = (acc_rank > 0) & (acc_rank < m)
+    out[found] = uniq[acc_rank[found] - 1]
+    return out
+
+
+def _rank_desc(counts, tie_break=None):
+    """
+    SQL RANK () OVER (ORDER BY counts DESC[, tie_break ASC])
+    """
+    s = pd.DataFrame({"cnt": -counts})
+    if tie_break is not None:
+        s["tie"] = tie_break
+        keys = list(s.columns)
+        order = s.sort_values(keys, kind="mergesort").index.to_numpy()
+        sorted_keys = [s[k].to_numpy()[order] for k in keys]
+        first_pos = np.maximum.accumulate(
+            np.where(_starts(*sorted_keys), np.arange(len(order)), 0))
+        rank = np.empty(len(order), np.int64)
+        rank[order] = first_pos + 1
+        return rank
+    return s["cnt"].rank(method="min").to_numpy().astype(np.int64)
+
+
+def flag_blocks(df, end_date=END_DATE, eu_flags=EU_FLAGS, category="all", only_reflagging=True):
+    """
+    Build reflagging blocks from identity core rows, following
+    `create_reflagging_core.sql.j2` step by step.
+
+    :param df: DataFrame of identity core (see `load_identity_core`)
+    :param end_date: String or Timestamp, time ranges are cut to this date
+    :param eu_flags: List of flags grouped as "EU" in `flag_eu`
+    :param category: String, all, fishing or support
+    :param only_reflagging: Boolean, keep only vessels that changed their flag at least once
+    :return: DataFrame with the same fields as the reflagging core table
+    """
+    df = df.loc[category_mask(df, category), CORE_COLUMNS].reset_index(drop=True)
+
+    rec, rec_values = _codes(df["vessel_record_id"])
+    ssvid, ssvid_values = _codes(df["ssvid"])
+    name, name_values = _codes(df["n_shipname"])
+    callsign, callsign_values = _codes(df["n_callsign"])
+    flag, flag_values = _codes(df["flag"])
+    is_fishing, is_fishing_values = _codes(df["is_fishing"])
+    is_carrier, is_carrier_values = _codes(df["is_carrier"])
+    is_bunker, is_bunker_values = _codes(df["is_bunker"])
+    overlap, overlap_values = _codes(df["timestamp_overlap"])
+    first = _epoch_us(df["first_timestamp"])
+    last = _epoch_us(df["last_timestamp"])
+
+    #
+    # Null the start (end) of an identity if the previous (next) identity of
+    # the same vessel has the same name, call sign and flag, i.e. only MMSI changed
+    fields = [name, callsign, flag]
+    by_first = np.lexsort((first, rec))
+    by_last = np.lexsort((last, rec))
+    block_start = np.where(_same_as_neighbour(by_first, rec, fields, 1), NAT, first)
+    block_end = np.where(_same_as_neighbour(by_last, rec, fields, -1), NAT, last)
+
+    #
+    # SELECT DISTINCT over the identity rows with their block start and end
+    rows = np.stack([rec, ssvid, name, callsign, flag, first, last,
+                     is_fishing, is_carrier, is_bunker, overlap,
+                     block_start, block_end], axis=1)
+    rows = np.unique(rows, axis=0)
+    (rec, ssvid, name, callsign, flag, first, last,
+     is_fishing, is_carrier, is_bunker, overlap, block_start, block_end) = rows.T
+
+    #
+    # Carry the last known block start forward (ordered by first_timestamp)
+    # and the next known block end backward (ordered by last_timestamp)
+    order = np.lexsort((first, rec))
+    block_start[order] = _segmented_running(rec[order] + 1, block_start[order])
+    order = np.lexsort((last, rec))
+    block_end[order] = _segmented_running(rec[order] + 1, block_end[order], reverse=True)
+
+    #
+    # Collapse into blocks: one run per (vessel, name, call sign, flag, category flags,
+    # block start, block end), aggregating the distinct MMSIs of the run
+    block_keys = [rec, name, callsign, flag, is_fishing, is_carrier, is_bunker,
+                  overlap, block_start, block_end]
+    order = np.lexsort([ssvid] + block_keys[::-1])
+    sorted_keys = [k[order] for k in block_keys]
+    start = _starts(*sorted_keys)
+    block_id = np.cumsum(start) - 1
+    head = np.flatnonzero(start)
+
+    ssvid_sorted = ssvid[order]
+    new_ssvid = _starts(block_id, ssvid_sorted) & (ssvid_sorted >= 0)
+    ssvid_str = np.asarray(ssvid_values, dtype=object)[np.maximum(ssvid_sorted[new_ssvid], 0)]
+    ssvids_associated = pd.Series(ssvid_str).groupby(block_id[new_ssvid]).agg("|".join) \
+        .reindex(np.arange(len(head))).to_numpy()
+
+    rec, name, callsign, flag, is_fishing, is_carrier, is_bunker, \
+        overlap, first, last = [k[head] for k in sorted_keys]
+
+    #
+    # Cut to end date (blocks without a start are dropped as in SQL `<`)
+    end_us = _epoch_us([end_date])[0]
+    keep = (first != NAT) & (first < end_us)
+    last = np.where(last > end_us, end_us, last)
+    rec, name, callsign, flag, is_fishing, is_carrier, is_bunker, overlap, \
+        first, last, ssvids_associated = [
+            a[keep] for a in (rec, name, callsign, flag, is_fishing, is_carrier,
+                              is_bunker, overlap, first, last, ssvids_associated)]
+
+    flag_str = np.asarray(flag_values, dtype=object)
+    flag_name = np.where(flag >= 0, flag_str[np.maximum(flag, 0)], None)
+    flag_eu_name = np.where(np.isin(flag_name, eu_flags), "EU", flag_name)
+    flag_eu, _ = _codes(flag_eu_name)
+
+    #
+    # Per vessel: number of non-missing flags and distinct flags (and EU-grouped flags)
+    def distinct_per_vessel(values):
+        order = np.lexsort((values, rec))
+        r, v = rec[order], values[order]
+        vessel_start = np.flatnonzero(_starts(r))
+        new_value = _starts(r, v) & (v >= 0)
+        per_vessel = np.add.reduceat(new_value.astype(np.int64), vessel_start) \
+            if len(vessel_start) else np.zeros(0, np.int64)
+        out = np.empty(len(values), np.int64)
+        out[order] = np.repeat(per_vessel, np.diff(np.r_[vessel_start, len(r)]))
+        return out
+
+    n_flags = distinct_per_vessel(flag)
+    n_flags_eu = distinct_per_vessel(flag_eu)
+    num_events = pd.Series(flag >= 0).groupby(rec).transform("sum").to_numpy()
+
+    result = pd.DataFrame({
+        "vessel_record_id": np.where(rec >= 0, np.asarray(rec_values, dtype=object)[np.maximum(rec, 0)], None),
+        "n_shipname": np.where(name >= 0, np.asarray(name_values, dtype=object)[np.maximum(name, 0)], None),
+        "n_callsign": np.where(callsign >= 0, np.asarray(callsign_values, dtype=object)[np.maximum(callsign, 0)], None),
+        "ssvids_associated": ssvids_associated,
+        "flag": flag_name,
+        "flag_eu": flag_eu_name,
+        "first_timestamp": pd.to_datetime(first, unit="us", utc=True),
+        "last_timestamp": pd.to_datetime(np.where(last == NAT, 0, last), unit="us", utc=True)
+            .where(last != NAT),
+        "num_events": num_events,
+        "reflag_outside_eu": n_flags_eu > 1,
+        "is_fishing": np.where(is_fishing >= 0, np.asarray(is_fishing_values, dtype=object)[np.maximum(is_fishing, 0)], None),
+        "is_carrier": np.where(is_carrier >= 0, np.asarray(is_carrier_values, dtype=object)[np.maximum(is_carrier, 0)], None),
+        "is_bunker": np.where(is_bunker >= 0, np.asarray(is_bunker_values, dtype=object)[np.maximum(is_bunker, 0)], None),
+        "timestamp_overlap": np.where(overlap >= 0, np.asarray(overlap_values, dtype=object)[np.maximum(overlap, 0)], None),
+    })
+
+    if only_reflagging:
+        #
+        # At least once their flag changed
+        result = result[n_flags > 1]
+
+    #
+    # Ranking of flags by the number of reflagging blocks
+    top_flags = result.groupby("flag").size().rename("cnt").reset_index()
+    top_flags["rank"] = _rank_desc(top_flags["cnt"].to_numpy())
+    top_flags_eu = result[result["reflag_outside_eu"]].groupby("flag_eu").size() \
+        .rename("cnt_eu").reset_index()
+    top_flags_eu["rank_eu"] = _rank_desc(top_flags_eu["cnt_eu"].to_numpy(),
+                                         top_flags_eu["flag_eu"].to_numpy())
+
+    result = result.merge(top_flags, on="flag", how="left") \
+        .merge(top_flags_eu, on="flag_eu", how="left")
+    return result.sort_values(["vessel_record_id", "first_timestamp"]).reset_index(drop=True)
+
+
+def latest_flags(blocks):
+    """
+    Latest flag of each vessel, i.e. the flag of its block with the latest
+    `last_timestamp`, taken with one sort instead of a window per vessel
+
+    :param blocks: DataFrame of flag blocks (see `flag_blocks`)
+    :return: Series of latest flag indexed by vessel_record_id
+    """
+    latest = blocks.sort_values(["vessel_record_id", "last_timestamp"]) \
+        .drop_duplicates("vessel_record_id", keep="last")
+    return latest.set_index("vessel_record_id")["flag_eu"].rename("latest_flag")
+
+
+def top_latest_flags(blocks, n=TOP_N):
+    """
+    The n latest flags with the most vessels, ordered as `rank_1` of the
+    history map query (number of vessels descending, then flag ascending).
+    Only the n best flags are kept in a heap, no global ranking is built.
+
+    :param blocks: DataFrame of flag blocks (see `flag_blocks`)
+    :param n: Integer, number of flags
+    :return: List of (latest_flag, number of vessels)
+    """
+    counts = latest_flags(blocks).value_counts()
+    return heapq.nsmallest(n, counts.items(), key=lambda item: (-item[1], item[0]))
+
+
+def top_candidate_blocks(blocks, n=TOP_N):
+    """
+    Keep the blocks of vessels whose latest flag is among the top n, the same
+    pre-filter the history map query applies before its per-vessel window logic
+
+    :param blocks: DataFrame of flag blocks (see `flag_blocks`)
+    :param n: Integer, number of flags
+    :return: DataFrame of flag blocks with `latest_flag` and `rank_1`
+    """
+    rank_1 = {flag: i + 1 for i, (flag, _) in enumerate(top_latest_flags(blocks, n))}
+    latest = latest_flags(blocks)
+    latest = latest[latest.isin(rank_1.keys())]
+    out = blocks.merge(latest.reset_index(), on="vessel_record_id")
+    out["rank_1"] = out["latest_flag"].map(rank_1)
+    return out
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) not in (2, 3, 4):
+        print("Use example: python reflagging_blocks.py YYYYMMDD [all|fishing|support] [END_DATE]")
+        raise ValueError("Incorrect number of parameters")
+
+    #
+    # Setting
+    YYYYMMDD = sys.argv[1]
+    if len(YYYYMMDD) != 8:
+        raise ValueError("Version date is supposed to be passed as YYYYMMDD")
+    category = sys.argv[2] if len(sys.argv) > 2 else "all"
+    end_date = sys.argv[3] if len(sys.argv) > 3 else END_DATE
+
+    #
+    # Run
+    blocks = flag_blocks(load_identity_core(YYYYMMDD), end_date=end_date, category=category)
+    print(f"{blocks['vessel_record_id'].nunique()} reflagged {category} vessels, "
+          f"{len(blocks)} flag blocks as of {end_date}\n")
+    print(blocks.groupby("flag_eu")["vessel_record_id"].nunique().sort_values(ascending=False).head(15))
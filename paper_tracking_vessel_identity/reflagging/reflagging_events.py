@@ -0,0 +1,192 @@
+#-------------------------------------------------------------
+#-- Reflagging event stream
+#-- This module exports the reflagging core table to a local
+#-- Parquet file sorted by (category, vessel_record_id,
+#-- first_timestamp) and streams flag changes from it row group by
+#-- row group, so that notebooks and downstream jobs can walk all
+#-- historical flag changes with constant memory instead of
+#-- materializing `reflagging_core_*` as a DataFrame.
+#--
+#-- Run the following command (with date version as YYYYMMDD)
+#-- to export the table once:
+#-- `python reflagging_events.py YYYYMMDD`
+#--
+#-- Example:
+#--   for change in iter_flag_changes("20220701", "fishing", since="2018-01-01"):
+#--       change.vessel_record_id, change.from_flag, change.to_flag, change.timestamp
+#-------------------------------------------------------------
+import sys
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from config import PROJECT, DATASET, REFLAGGING_CORE
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+SNAPSHOT_DIR = os.path.join(ROOT_DIR, "..", "..", "data", "reflagging_snapshot")
+
+COLUMNS = ["category", "vessel_record_id", "flag", "first_timestamp", "ssvids_associated"]
+ROW_GROUP_SIZE = 100000
+
+
+class FlagChange:
+    """
+    A vessel changing from one flag to another.
+    `timestamp` is the start of the block under the new flag and `ssvids`
+    are the MMSIs broadcast under the new flag.
+    """
+    __slots__ = ("vessel_record_id", "from_flag", "to_flag", "timestamp", "ssvids")
+
+    def __init__(self, vessel_record_id, from_flag, to_flag, timestamp, ssvids):
+        self.vessel_record_id = vessel_record_id
+        self.from_flag = from_flag
+        self.to_flag = to_flag
+        self.timestamp = timestamp
+        self.ssvids = ssvids
+
+    def __repr__(self):
+        return (f"FlagChange({self.vessel_record_id!r}, {self.from_flag!r} -> {self.to_flag!r}, "
+                f"{self.timestamp}, ssvids={self.ssvids!r})")
+
+
+def snapshot_path(YYYYMMDD):
+    """
+    Return the local Parquet file of the reflagging core
+
+    :param YYYYMMDD: vessel identity data version
+    :return: String, path to the Parquet file
+    """
+    return os.path.join(SNAPSHOT_DIR, f"v{YYYYMMDD}", "reflagging_core.parquet")
+
+
+def export_reflagging_core(YYYYMMDD):
+    """
+    Download the reflagging core table (all categories) and write it as one
+    Parquet file sorted by (category, vessel_record_id, first_timestamp), so
+    that each vessel's blocks are contiguous and row groups can be skipped
+    by category using their statistics.
+
+    :param YYYYMMDD: vessel identity data version
+    :return: None
+    """
+    q = f"""
+    SELECT *
+    FROM `{PROJECT}.{DATASET}.{REFLAGGING_CORE}{YYYYMMDD}`
+    """
+    df = pd.read_gbq(q, project_id=PROJECT, dialect='standard')
+    df = df.sort_values(["category", "vessel_record_id", "first_timestamp", "last_timestamp"])
+
+    path = snapshot_path(YYYYMMDD)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), path,
+                   row_group_size=ROW_GROUP_SIZE, write_statistics=True,
+                   compression="snappy")
+
+    print(f"{REFLAGGING_CORE}{YYYYMMDD} exported to {path} ({len(df)} rows)")
+
+
+def _row_group_may_contain(metadata, i, category_index, category):
+    """
+    Whether row group i can hold rows of the category, based on its min/max statistics
+    """
+    stats = metadata.row_group(i).column(category_index).statistics
+    if stats is None or not stats.has_min_max:
+        return True
+    return stats.min <= category <= stats.max
+
+
+def iter_flag_changes(YYYYMMDD, category="all", since=None):
+    """
+    Lazily yield the flag changes of a vessel category from the local Parquet
+    export of the reflagging core, in (vessel_record_id, timestamp) order.
+    Only one row group is held in memory at a time; the last block of a row
+    group is carried over so that changes across row group boundaries are kept.
+
+    :param YYYYMMDD: vessel identity data version
+    :param category: String, all, fishing or support
+    :param since: String or Timestamp, only yield changes at or after this time
+    :return: Generator of FlagChange
+    """
+    path = snapshot_path(YYYYMMDD)
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"No local export of {REFLAGGING_CORE}{YYYYMMDD}. "
+            f"Run `python reflagging_events.py {YYYYMMDD}` first.")
+
+    if since is not None:
+        since = pd.Timestamp(since)
+        since = since.tz_localize("UTC") if since.tz is None else since.tz_convert("UTC")
+    pf = pq.ParquetFile(path)
+    category_index = pf.schema_arrow.get_field_index("category")
+
+    #
+    # Last block seen so far: (vessel_record_id, flag)
+    prev_vessel, prev_flag = None, None
+    for i in range(pf.num_row_groups):
+        if not _row_group_may_contain(pf.metadata, i, category_index, category):
+            continue
+
+        table = pf.read_row_group(i, columns=COLUMNS)
+        df = table.to_pandas()
+        df = df[df["category"].to_numpy() == category]
+        if len(df) == 0:
+            continue
+
+        vessel = df["vessel_record_id"].to_numpy(dtype=object)
+        flag = df["flag"].to_numpy(dtype=object)
+        timestamp = df["first_timestamp"]
+        ssvids = df["ssvids_associated"].to_numpy(dtype=object)
+
+        #
+        # Previous block of each row, taking the carried-over block for the first row
+        prev_v = np.empty(len(df), dtype=object)
+        prev_f = np.empty(len(df), dtype=object)
+        prev_v[0], prev_f[0] = prev_vessel, prev_flag
+        prev_v[1:], prev_f[1:] = vessel[:-1], flag[:-1]
+
+        changed = (prev_v == vessel) & pd.notna(prev_f) & pd.notna(flag) & (prev_f != flag)
+        if since is not None:
+            changed &= (timestamp >= since).to_numpy()
+
+        for j in np.flatnonzero(changed):
+            yield FlagChange(
+                vessel[j], prev_f[j], flag[j], timestamp.iat[j],
+                tuple(ssvids[j].split("|")) if isinstance(ssvids[j], str) else ())
+
+        prev_vessel, prev_flag = vessel[-1], flag[-1]
+
+
+def flag_changes_array(YYYYMMDD, category="all", since=None):
+    """
+    Collect the flag change stream into a structured NumPy array
+    (one record per change) for vectorized downstream processing
+
+    :param YYYYMMDD: vessel identity data version
+    :param category: String, all, fishing or support
+    :param since: String or Timestamp, only keep changes at or after this time
+    :return: numpy structured array
+    """
+    dtype = [("vessel_record_id", object), ("from_flag", object), ("to_flag", object),
+             ("timestamp", "datetime64[us]"), ("ssvids", object)]
+    records = ((c.vessel_record_id, c.from_flag, c.to_flag,
+                np.datetime64(c.timestamp.tz_convert(None), "us"), c.ssvids)
+               for c in iter_flag_changes(YYYYMMDD, category, since))
+    return np.fromiter(records, dtype=dtype)
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) != 2:
+        print("Use example: python reflagging_events.py YYYYMMDD")
+        raise ValueError('Version date is supposed to be passed as "YYYYMMDD"')
+
+    #
+    # Setting
+    YYYYMMDD = sys.argv[1]
+    if len(YYYYMMDD) != 8:
+        raise ValueError("Version date is supposed to be passed as YYYYMMDD")
+
+    #
+    # Run
+    export_reflagging_core(YYYYMMDD)
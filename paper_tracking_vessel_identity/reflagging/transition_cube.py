@@ -0,0 +1,174 @@
+#-------------------------------------------------------------
+#-- Flag transition cube
+#-- This module loads `reflagging_transition_cube_v{YYYYMMDD}`
+#-- (created by `create_reflagging_transition_cube.sql.j2`),
+#-- a sparse COO table of flag changes by
+#-- (source, category, year, port, from_flag, to_flag),
+#-- and slices it into `scipy.sparse` from_flag x to_flag matrices
+#-- so that chord diagrams, top-N flags or per-flag reflagging
+#-- counts do not need another warehouse query.
+#--
+#-- Example:
+#--   cube = TransitionCube.from_bigquery("20220701")
+#--   m = cube.matrix(category="fishing", years=range(2015, 2022))
+#--   cube.chord_table(source="identity_stitcher", port="BUSAN", top_n=15)
+#-------------------------------------------------------------
+import os
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+from config import PROJECT, DATASET, REFLAGGING_TRANSITION_CUBE
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+CUBE_DIR = os.path.join(ROOT_DIR, "..", "..", "data", "reflagging_transition_cube")
+
+DIMENSIONS = ["source", "category", "year", "port", "from_flag", "to_flag"]
+
+
+class TransitionCube:
+    """
+    Flag transition counts in COO form.
+
+    Each row of `cells` is a non-zero cell of the cube; flags on both axes share
+    one index (`flags`) so that every slice is a square matrix and can be
+    compared or summed with any other slice.
+    """
+
+    def __init__(self, cells):
+        """
+        :param cells: DataFrame with the cube dimensions and `cnt`
+        """
+        cells = cells[DIMENSIONS + ["cnt"]].reset_index(drop=True)
+        self.cells = cells
+        self.flags = pd.Index(
+            np.unique(np.concatenate([cells["from_flag"].to_numpy(dtype=object),
+                                      cells["to_flag"].to_numpy(dtype=object)]).astype(str)))
+        self.row = self.flags.get_indexer(cells["from_flag"].astype(str)).astype(np.int32)
+        self.col = self.flags.get_indexer(cells["to_flag"].astype(str)).astype(np.int32)
+        self.cnt = cells["cnt"].to_numpy(np.int64)
+
+    def __len__(self):
+        return len(self.cells)
+
+    @classmethod
+    def from_bigquery(cls, YYYYMMDD):
+        """
+        Pull the cube table from BigQuery
+
+        :param YYYYMMDD: vessel identity data version
+        :return: TransitionCube
+        """
+        q = f"""
+        SELECT {", ".join(DIMENSIONS)}, cnt
+        FROM `{PROJECT}.{DATASET}.{REFLAGGING_TRANSITION_CUBE}{YYYYMMDD}`
+        """
+        return cls(pd.read_gbq(q, project_id=PROJECT, dialect='standard'))
+
+    @classmethod
+    def from_parquet(cls, YYYYMMDD):
+        """
+        Read the cube from its local copy (see `to_parquet`)
+
+        :param YYYYMMDD: vessel identity data version
+        :return: TransitionCube
+        """
+        return cls(pd.read_parquet(os.path.join(CUBE_DIR, f"v{YYYYMMDD}.parquet")))
+
+    def to_parquet(self, YYYYMMDD):
+        """
+        Store the cube locally, so later sessions can skip the BigQuery pull
+
+        :param YYYYMMDD: vessel identity data version
+        :return: String, path of the file
+        """
+        os.makedirs(CUBE_DIR, exist_ok=True)
+        path = os.path.join(CUBE_DIR, f"v{YYYYMMDD}.parquet")
+        self.cells.to_parquet(path, index=False)
+        return path
+
+    def _mask(self, source, category, years, port, exclude_same_flag):
+        """
+        Boolean mask of the cells in a slice. `years` and `port` can be a single
+        value or a list; port=None keeps all ports.
+        """
+        cells = self.cells
+        mask = (cells["source"] == source).to_numpy() & (cells["category"] == category).to_numpy()
+        if years is not None:
+            years = [years] if np.isscalar(years) else list(years)
+            mask &= cells["year"].isin(years).to_numpy()
+        if port is not None:
+            port = [port] if isinstance(port, str) else list(port)
+            mask &= cells["port"].isin(port).to_numpy()
+        if exclude_same_flag:
+            mask &= self.row != self.col
+        return mask
+
+    def matrix(self, source="reflagging_core", category="all", years=None, port=None,
+               exclude_same_flag=True):
+        """
+        Slice the cube into a from_flag x to_flag matrix, summing over the
+        dimensions that are not fixed. Rows and columns follow `self.flags`.
+
+        :param source: String, reflagging_core or identity_stitcher
+        :param category: String, all, fishing or support
+        :param years: Integer or list of years, all years if None
+        :param port: String or list of port labels, all ports if None
+        :param exclude_same_flag: Boolean, drop transitions to the same flag
+        :return: scipy.sparse.csr_matrix
+        """
+        mask = self._mask(source, category, years, port, exclude_same_flag)
+        n = len(self.flags)
+        return sparse.coo_matrix(
+            (self.cnt[mask], (self.row[mask], self.col[mask])), shape=(n, n)).tocsr()
+
+    def by_year(self, source="reflagging_core", category="all", exclude_same_flag=True):
+        """
+        One matrix per year of a category
+
+        :return: Dict of year to scipy.sparse.csr_matrix
+        """
+        years = self.cells["year"].dropna().astype(int).unique()
+        return {y: self.matrix(source, category, y, None, exclude_same_flag) for y in sorted(years)}
+
+    def flag_totals(self, source="reflagging_core", category="all", years=None, port=None,
+                    exclude_same_flag=True):
+        """
+        Number of transitions out of and into each flag
+
+        :return: DataFrame indexed by flag with `out` and `in` counts
+        """
+        m = self.matrix(source, category, years, port, exclude_same_flag)
+        return pd.DataFrame({
+            "out": np.asarray(m.sum(axis=1)).ravel(),
+            "in": np.asarray(m.sum(axis=0)).ravel()}, index=self.flags)
+
+    def top_flags(self, n=15, **kwargs):
+        """
+        Flags with the most transitions (in + out)
+
+        :param n: Integer, number of flags
+        :param kwargs: Slice arguments passed to `flag_totals`
+        :return: List of flags
+        """
+        totals = self.flag_totals(**kwargs).sum(axis=1)
+        totals = totals[totals > 0]
+        #
+        # Ties broken by flag, as in the chord diagram rankings
+        order = np.lexsort((totals.index.to_numpy(), -totals.to_numpy()))
+        return totals.index[order[:n]].tolist()
+
+    def chord_table(self, source="identity_stitcher", category="all", years=None, port=None,
+                    top_n=15, exclude_same_flag=False):
+        """
+        from_flag x to_flag counts in the shape used by the chord diagrams,
+        with flags outside the top N grouped as "OTHERS"
+
+        :param top_n: Integer, number of flags kept separately
+        :return: DataFrame with flag, pair_flag and cnt
+        """
+        top = self.top_flags(top_n, source=source, category=category, years=years, port=port,
+                             exclude_same_flag=exclude_same_flag)
+        m = self.matrix(source, category, years, port, exclude_same_flag).tocoo()
+        label = np.where(self.flags.isin(top), self.flags.to_numpy(dtype=object), "OTHERS")
+        df = pd.DataFrame({"flag": label[m.row], "pair_flag": label[m.col], "cnt": m.data})
+        return df.groupby(["flag", "pair_flag"], as_index=False)["cnt"].sum()
@@ -0,0 +1,216 @@
+#-------------------------------------------------------------
+#-- Headless figure rendering
+#-- This script renders the paper figures in batch, without a
+#-- Jupyter session, into `outputs/figures/v{VERSION}/`.
+#--
+#-- Figures are registered in FIGURES, either as a jupytext notebook
+#-- (every `plt.show()` is saved as the next numbered figure) or as
+#-- a function `fn(version)` returning a matplotlib Figure, e.g.
+#--   @register("reflagging_activity")
+#--   def reflagging_activity(version): ...
+#--
+#-- Figures render in a process pool with the Agg backend;
+#-- cartopy/pyseas are imported once per worker. Every
+#-- `pd.read_gbq` result is cached under `data/query_cache/` so a
+#-- figure is a function of cached input data and a re-render does
+#-- not query BigQuery again.
+#--
+#-- Run the following command (with version as YYYYMMDD, and
+#-- optionally the names of the figures to render):
+#-- `python render_figures.py YYYYMMDD [name ...]`
+#-------------------------------------------------------------
+import sys
+import os
+import time
+import hashlib
+import runpy
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.join(ROOT_DIR, "..", "paper_tracking_vessel_identity")
+OUTPUT_DIR = os.path.join(ROOT_DIR, "..", "outputs", "figures")
+QUERY_CACHE_DIR = os.path.join(ROOT_DIR, "..", "data", "query_cache")
+
+#
+# Figure name to a notebook path (relative to the package, `{version}` is
+# filled in) or to a function registered with `register`
+FIGURES = {
+    "auth_known_vs_unknown": "auth_analysis/fishing_effort_by_known_vs_unknown_revised_v{version}.py",
+    "ports_of_identity_changes": "identity_stitcher/ports_of_identity_changes_v{version}.py",
+    "map_reflagging": "reflagging/map_reflagging_v{version}.py",
+    "identity_data_stats": "identity_data_stats/identity_data_stats_v{version}.py",
+    "identity_paper_fishing_effort": "ownership_reflagging_analysis/identity_paper_fishing_effort.py",
+    "identity_paper_ownership_reflagging": "ownership_reflagging_analysis/identity_paper_ownership_reflagging.py",
+}
+
+#
+# Per-worker state: the figure being rendered and the files saved so far
+_current = {"name": None, "dir": None, "files": []}
+
+
+def register(name):
+    """
+    Register a function `fn(version) -> matplotlib.figure.Figure` as a figure
+
+    :param name: String, figure name (also the output file name)
+    :return: Decorator
+    """
+    def decorator(fn):
+        FIGURES[name] = fn
+        return fn
+    return decorator
+
+
+def _cached_read_gbq(read_gbq, version):
+    """
+    Wrap `pd.read_gbq` so each distinct query is pulled once per version
+    and then read from a local pickle
+    """
+    def cached(query, *args, **kwargs):
+        key = hashlib.sha1(repr((query, args, sorted(kwargs.items()))).encode()).hexdigest()
+        path = os.path.join(QUERY_CACHE_DIR, f"v{version}", f"{key}.pkl")
+        if os.path.exists(path):
+            import pandas as pd
+            return pd.read_pickle(path)
+        df = read_gbq(query, *args, **kwargs)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df.to_pickle(path)
+        return df
+    return cached
+
+
+def _save_open_figures(*args, **kwargs):
+    """
+    Replacement of `plt.show()`: save every open figure as the next numbered
+    file of the current figure name, then close it
+    """
+    import matplotlib.pyplot as plt
+    for num in plt.get_fignums():
+        fig = plt.figure(num)
+        path = os.path.join(_current["dir"], f"{_current['name']}_{len(_current['files']) + 1:02d}.png")
+        fig.savefig(path, bbox_inches="tight", facecolor=fig.get_facecolor())
+        _current["files"].append(path)
+        plt.close(fig)
+
+
+def _setup_worker(version):
+    """
+    Set up a worker once: Agg backend, map libraries, cached queries and
+    `plt.show()` saving to files
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import pandas as pd
+
+    #
+    # Map libraries are heavy to import; load them once if available
+    for module in ("cartopy.crs", "pyseas", "pyseas.maps"):
+        try:
+            __import__(module)
+        except ImportError:
+            pass
+
+    if hasattr(pd, "read_gbq"):
+        pd.read_gbq = _cached_read_gbq(pd.read_gbq, version)
+    plt.show = _save_open_figures
+    plt.ioff()
+
+
+def _purge_modules(folder):
+    """
+    Forget the modules imported from a notebook folder, since folders have
+    modules of the same name (e.g. `config`)
+    """
+    folder = os.path.abspath(folder)
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, "__file__", None)
+        if path and os.path.abspath(path).startswith(folder + os.sep):
+            del sys.modules[name]
+
+
+def _render(name, version):
+    """
+    Render one registered figure in the current worker
+
+    :return: Tuple of name, list of files, error (None if rendered) and seconds
+    """
+    import matplotlib.pyplot as plt
+    start = time.time()
+    out_dir = os.path.join(OUTPUT_DIR, f"v{version}")
+    os.makedirs(out_dir, exist_ok=True)
+    _current.update(name=name, dir=out_dir, files=[])
+
+    target = FIGURES[name]
+    cwd, path = os.getcwd(), list(sys.path)
+    try:
+        if callable(target):
+            fig = target(version)
+            file = os.path.join(out_dir, f"{name}.png")
+            fig.savefig(file, bbox_inches="tight", facecolor=fig.get_facecolor())
+            _current["files"].append(file)
+        else:
+            notebook = os.path.join(PACKAGE_DIR, target.format(version=version))
+            folder = os.path.dirname(notebook)
+            os.chdir(folder)
+            sys.path.insert(0, folder)
+            try:
+                runpy.run_path(notebook, run_name="__figures__")
+            finally:
+                _purge_modules(folder)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        os.chdir(cwd)
+        sys.path[:] = path
+        plt.close("all")
+    return name, list(_current["files"]), error, time.time() - start
+
+
+def render_figures(version, names=None, max_workers=None):
+    """
+    Render figures in a process pool
+
+    :param version: String, data version as YYYYMMDD
+    :param names: List of figure names, all registered figures if None
+    :param max_workers: Integer, number of processes (CPU count if None)
+    :return: Dict of name to (files, error)
+    """
+    names = list(FIGURES) if not names else names
+    unknown = [n for n in names if n not in FIGURES]
+    if unknown:
+        raise ValueError(f"Unknown figures: {unknown}. Options are {list(FIGURES)}")
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_setup_worker,
+                             initargs=(version,)) as pool:
+        futures = [pool.submit(_render, name, version) for name in names]
+        for future in as_completed(futures):
+            name, files, error, seconds = future.result()
+            results[name] = (files, error)
+            status = "failed" if error else f"{len(files)} figures"
+            print(f"{name}: {status} ({seconds:.0f} s)")
+            if error:
+                print(error)
+    return results
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2:
+        print("Use example: python render_figures.py YYYYMMDD [name ...]")
+        raise ValueError('Version date is supposed to be passed as "YYYYMMDD"')
+
+    #
+    # Setting
+    VERSION = sys.argv[1]
+    if len(VERSION) != 8:
+        raise ValueError("Version date is supposed to be passed as YYYYMMDD")
+
+    #
+    # Run
+    results = render_figures(VERSION, sys.argv[2:])
+    if any(error for _, error in results.values()):
+        sys.exit(1)